@@ -0,0 +1,159 @@
+"""
+积压嘟文批量写入基准测试
+在本地启动一个模拟的PDS（createRecord、applyWrites，每个请求加上固定的网络延迟，并按官方规则统计写入点数），
+用真实的atproto客户端分别以逐条 createRecord 和 applyWrites 批量写入的方式补同步一批积压的嘟文，
+比较耗时、请求数，并检查帖子顺序与嘟文创建顺序一致、同步状态完整。
+
+用法: python benchmarks/bench_apply_writes.py [嘟文数] [单次请求延迟毫秒]
+"""
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from atproto import Client
+from mastodon_to_bluesky_sync import MastodonToBlueskySyncer
+from sync_status_manager import SyncStatusManager
+from sync_cursor_store import SyncCursorStore
+from retry_queue import RetryQueue
+
+DID = 'did:plc:stubpds'
+# PDS的写入限额：每小时5000点，创建一条记录计3点
+POINTS_PER_CREATE = 3
+POINTS_PER_HOUR = 5000
+
+
+class StubPDS:
+    def __init__(self, latency):
+        """
+        模拟的PDS，记录按写入顺序保存在内存中
+        :param latency: 每个请求的额外延迟（秒），模拟到PDS的往返时间
+        """
+        self.latency = latency
+        self.records = []
+        self.requests = 0
+        self.points = 0
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self.handler_class())
+        self.httpd.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.httpd.server_address[1]}'
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def create(self, collection, rkey, record):
+        with self.lock:
+            rkey = rkey or f'{len(self.records):013d}'
+            cid = 'bafyrei' + hashlib.sha256(json.dumps(record, sort_keys=True).encode('utf-8') + rkey.encode('ascii')).hexdigest()[:52]
+            uri = f'at://{DID}/{collection}/{rkey}'
+            self.records.append({'uri': uri, 'cid': cid, 'value': record})
+            self.points += POINTS_PER_CREATE
+        return uri, cid
+
+    def close(self):
+        self.httpd.shutdown()
+
+    def handler_class(self):
+        pds = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, data):
+                body = json.dumps(data).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                data = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                time.sleep(pds.latency)
+                with pds.lock:
+                    pds.requests += 1
+                if self.path == '/xrpc/com.atproto.repo.createRecord':
+                    uri, cid = pds.create(data['collection'], data.get('rkey'), data['record'])
+                    self.send_json({'uri': uri, 'cid': cid})
+                elif self.path == '/xrpc/com.atproto.repo.applyWrites':
+                    results = []
+                    for write in data['writes']:
+                        uri, cid = pds.create(write['collection'], write['rkey'], write['value'])
+                        results.append({'$type': 'com.atproto.repo.applyWrites#createResult', 'uri': uri, 'cid': cid})
+                    self.send_json({'commit': {'cid': 'bafyreicommit', 'rev': 'rev'}, 'results': results})
+                else:
+                    self.send_error(404)
+
+        return Handler
+
+
+class FakeMastodon:
+    # 只提供补同步需要的接口，嘟文保存在内存中
+    def __init__(self, count):
+        start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+        self.statuses = [SimpleNamespace(
+            id=str(1000 + index),
+            created_at=start + timedelta(minutes=index),
+            content=f'<p>backlog {index}</p>',
+            url=f'https://mastodon.example/@user/{1000 + index}',
+            in_reply_to_id=None, reblog=None, mentions=[], visibility='public',
+            media_attachments=[], language='zh',
+        ) for index in range(count)]
+
+    def account_verify_credentials(self):
+        return SimpleNamespace(id='1', username='user')
+
+    def account_statuses(self, account_id, min_id=None, limit=20):
+        newer = [status for status in self.statuses if min_id is None or int(status.id) > int(min_id)]
+        if min_id is None:
+            return list(reversed(newer))[:limit]
+        return list(reversed(newer[:limit]))
+
+
+def run(count, latency, batched):
+    pds = StubPDS(latency)
+    mastodon = FakeMastodon(count)
+    bluesky = Client(f'{pds.url}/xrpc')
+    bluesky.me = SimpleNamespace(did=DID)
+    with tempfile.TemporaryDirectory() as directory:
+        ledger = SyncStatusManager(os.path.join(directory, 'sync_status.json'))
+        cursor_store = SyncCursorStore(os.path.join(directory, 'sync_cursor.json'))
+        # 从第一条之前开始，模拟停机后积压了 count 条嘟文
+        cursor_store.set('mastodon_since_id', '999')
+        syncer = MastodonToBlueskySyncer(mastodon, bluesky, ledger, cursor_store=cursor_store, from_mastodon_at='',
+                                         batch_threshold=1 if batched else 0,
+                                         retry_queue=RetryQueue(os.path.join(directory, 'retry_queue.json')))
+        start = time.perf_counter()
+        stats = syncer.sync()
+        elapsed = time.perf_counter() - start
+
+        created_order = [record['value']['createdAt'] for record in pds.records]
+        in_order = created_order == sorted(created_order) and len(created_order) == count
+        complete = all(ledger.is_synced(status.id, 'mastodon_to_bluesky') for status in mastodon.statuses)
+        caught_up = cursor_store.get('mastodon_since_id') == mastodon.statuses[-1].id
+        ledger.close()
+    pds.close()
+    return elapsed, pds.requests, pds.points, stats, in_order and complete and caught_up
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    latency = (float(sys.argv[2]) if len(sys.argv) > 2 else 50) / 1000
+    print(f"积压 {count} 条嘟文，模拟的PDS往返延迟 {latency * 1000:.0f} ms")
+    for name, batched in (('逐条 createRecord', False), ('applyWrites 批量', True)):
+        elapsed, requests, points, stats, ok = run(count, latency, batched)
+        print(f"{name}: {elapsed:.2f} 秒, {requests} 个写请求, 写入点数 {points}"
+              f"（每小时限额 {POINTS_PER_HOUR}）, 同步 {stats['synced']} 条, 顺序与同步状态{'正确' if ok else '错误'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+"""
+冷启动基准测试
+测量 cron 等定时单次运行的启动开销：
+1. 在全新的解释器中导入 sync_once（单次运行入口）和 sync_tool（完整同步工具）的耗时；
+2. 在本地模拟的Mastodon和Bluesky服务器上，分别用 python src/sync_once.py 和直接构建 SyncTool 运行一轮的方式
+   各运行一次单次同步，比较没有新帖子和有一条新帖子时的总耗时和请求数。
+每次运行都是新的子进程，数据目录中预先放好同步游标和保存的Bluesky会话。
+
+用法: python benchmarks/bench_cold_start.py [--repeat N] [--latency 毫秒]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCH_DIR, '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+from fake_servers import FakeMastodonServer, FakeBlueskyServer, fake_jwt, DID, HANDLE
+
+LEGACY_RUN = "from sync_tool import SyncTool; sync_tool = SyncTool(); sync_tool.run(); sync_tool.close()"
+
+
+def timed_subprocess(args, env, cwd=None):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, *args], env=env, cwd=cwd, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def import_times(module, repeat, env):
+    # 全新解释器中导入模块的耗时（扣除空解释器的启动时间）
+    baseline = statistics.median(timed_subprocess(['-c', 'pass'], env) for _ in range(repeat))
+    return statistics.median(timed_subprocess(['-c', f'import {module}'], env) for _ in range(repeat)) - baseline
+
+
+def prepare_data_dir(directory, mastodon_server, bluesky_server):
+    # 与定时运行的稳定状态相同：游标指向两边最新的帖子，会话和实例版本是之前保存的，编辑和删除刚检查过
+    data_dir = os.path.join(directory, 'data')
+    os.makedirs(data_dir, exist_ok=True)
+    latest_status = max(int(status_id) for status_id in mastodon_server.statuses)
+    latest_post = max(post['indexedAt'] for post in bluesky_server.posts)
+    with open(os.path.join(data_dir, 'sync_cursor.json'), 'w', encoding='utf-8') as f:
+        json.dump({'mastodon_since_id': str(latest_status), 'bluesky_indexed_at': latest_post,
+                   'reconciled_at': time.time()}, f)
+    # 与 SyncTool 保存的会话格式相同：handle:::did:::accessJwt:::refreshJwt:::pdsEndpoint
+    token = ':::'.join([HANDLE, DID, fake_jwt(DID, 'com.atproto.access', 2 * 3600),
+                        fake_jwt(DID, 'com.atproto.refresh', 90 * 86400), f'{bluesky_server.url}/xrpc'])
+    with open(os.path.join(data_dir, 'bluesky_token.json'), 'w') as f:
+        json.dump({'token': token}, f)
+    with open(os.path.join(data_dir, 'mastodon_version.json'), 'w') as f:
+        json.dump({'version': '4.2.0', 'time': time.time()}, f)
+
+
+def run_case(label, args, env, mastodon_server, bluesky_server, new_post):
+    with tempfile.TemporaryDirectory() as directory:
+        prepare_data_dir(directory, mastodon_server, bluesky_server)
+        if new_post:
+            mastodon_server.add_status(f'{label} new post')
+            bluesky_server.add_post(f'{label} new post', datetime.now(timezone.utc))
+        for server in (mastodon_server, bluesky_server):
+            server.requests.clear()
+        elapsed = timed_subprocess(args, env, cwd=directory)
+    requests = {name: dict(server.requests) for name, server in (('Mastodon', mastodon_server), ('Bluesky', bluesky_server))}
+    total = sum(sum(counts.values()) for counts in requests.values())
+    details = '; '.join(f"{name} " + ', '.join(f'{route} {count}' for route, count in sorted(counts.items()))
+                        for name, counts in requests.items() if counts)
+    print(f"  {label}: {elapsed:.2f} 秒, {total} 个请求" + (f" ({details})" if details else ''))
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='冷启动基准测试')
+    parser.add_argument('--repeat', type=int, default=5, help='导入耗时的重复次数，取中位数')
+    parser.add_argument('--latency', type=float, default=50, help='模拟服务器每个请求的额外延迟（毫秒）')
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONPATH=SRC_DIR, LOG_LEVEL='WARNING')
+    print(f"导入耗时（全新解释器，{args.repeat} 次取中位数）:")
+    for module in ('sync_once', 'sync_tool'):
+        print(f"  import {module}: {import_times(module, args.repeat, env) * 1000:.0f} ms")
+
+    mastodon_server = FakeMastodonServer(latency=args.latency / 1000)
+    bluesky_server = FakeBlueskyServer(latency=args.latency / 1000, seed=2)
+    start = datetime.now(timezone.utc) - timedelta(days=1)
+    for index in range(5):
+        mastodon_server.add_status(f'mastodon post {index}', start + timedelta(seconds=index))
+        bluesky_server.add_post(f'bluesky post {index}', start + timedelta(seconds=index))
+    env.update({
+        'MASTODON_INSTANCE_URL': mastodon_server.url,
+        'MASTODON_ACCESS_TOKEN': 'token',
+        'BLUESKY_INSTANCE_URL': f'{bluesky_server.url}/xrpc',
+        'BLUESKY_USERNAME': HANDLE,
+        'BLUESKY_PASSWORD': 'password',
+        'SYNC_EDITS_AND_DELETES': 'false',
+        'ACCOUNTS_CONFIG': '',
+    })
+    once = [os.path.join(SRC_DIR, 'sync_once.py')]
+    legacy = ['-c', LEGACY_RUN]
+    for new_post, title in ((False, '没有新帖子'), (True, '两边各有一条新帖子')):
+        print(f"单次运行，{title}（每个请求延迟 {args.latency:.0f} ms）:")
+        legacy_time = run_case('构建 SyncTool 并运行一轮', legacy, env, mastodon_server, bluesky_server, new_post)
+        once_time = run_case('sync_once.py', once, env, mastodon_server, bluesky_server, new_post)
+        print(f"  加速 {legacy_time / once_time:.1f} 倍")
+    mastodon_server.close()
+    bluesky_server.close()
+
+
+if __name__ == '__main__':
+    main()
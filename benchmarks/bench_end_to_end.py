@@ -0,0 +1,165 @@
+"""
+端到端同步基准测试
+在本地启动模拟的Mastodon和Bluesky服务器，两边各预先生成 N 条带 M 张图片的帖子，
+用真实的 SyncTool（真实的Mastodon.py和atproto客户端、媒体下载、转码、上传、同步状态）把它们同步到对方，
+报告吞吐量、逐条同步的 p50/p99 延迟、各阶段耗时和请求数，并核对两边的帖子和图片都已完整同步。
+可以为每个请求加上网络延迟、为写入和上传接口注入随机错误、限制请求速率。
+
+用法: python benchmarks/bench_end_to_end.py [--posts N] [--images M] [--latency 毫秒] [--error-rate 比例] [--rate-limit 次数] [--pipeline-depth N]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+# 失败的帖子立即重试，以便在几轮之内收敛；逐条的日志不输出
+os.environ.setdefault('RETRY_BASE_DELAY', '0')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+import metrics
+from sync_tool import SyncTool
+from sync_pipeline import SyncPipeline
+from fake_servers import FakeMastodonServer, FakeBlueskyServer, seed_accounts, HANDLE
+
+MAX_ROUNDS = 10
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def time_posts(syncer, samples, prepare_key, publish_key):
+    # 记录每条实际同步的帖子从开始转换到发布完成的耗时（流水线中包括在窗口中等待发布的时间）
+    prepare_post = syncer.prepare_post
+    publish_post = syncer.publish_post
+    started = {}
+
+    def timed_prepare(post):
+        started[prepare_key(post)] = time.perf_counter()
+        return prepare_post(post)
+
+    def timed_publish(post, *args):
+        published = publish_post(post, *args)
+        start = started.pop(publish_key(post), None)
+        if start is not None:
+            samples.append(time.perf_counter() - start)
+        return published
+
+    syncer.prepare_post = timed_prepare
+    syncer.publish_post = timed_publish
+
+
+def histogram_summary(histogram):
+    parts = []
+    for entry in histogram.snapshot():
+        label = ','.join(entry['labels'].values()) or '全部'
+        parts.append(f"{label} {entry['count']} 次/平均 {entry['sum'] / entry['count'] * 1000:.1f} ms")
+    return '; '.join(parts) or '无'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='端到端同步基准测试')
+    parser.add_argument('--posts', type=int, default=50, help='每个平台预先生成的帖子数')
+    parser.add_argument('--images', type=int, default=1, help='每条帖子的图片数')
+    parser.add_argument('--image-size', default='1024x768', help='合成图片的尺寸')
+    parser.add_argument('--latency', type=float, default=20, help='每个请求的额外延迟（毫秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='写入和上传接口随机返回500错误的比例')
+    parser.add_argument('--rate-limit', type=int, default=0, help='每个服务器每个窗口允许的请求数，0 表示不限制')
+    parser.add_argument('--rate-window', type=int, default=300, help='速率限制窗口（秒）')
+    parser.add_argument('--batch', action='store_true', help='积压嘟文使用 applyWrites 批量写入')
+    parser.add_argument('--pipeline-depth', type=int, help='同一方向提前转换的帖子数，1 表示逐条处理，默认使用 SYNC_PIPELINE_DEPTH')
+    args = parser.parse_args()
+    image_size = tuple(int(value) for value in args.image_size.split('x'))
+
+    options = dict(latency=args.latency / 1000, error_rate=args.error_rate, rate_limit=args.rate_limit, rate_window=args.rate_window)
+    mastodon_server = FakeMastodonServer(**options)
+    bluesky_server = FakeBlueskyServer(seed=2, **options)
+    print(f"生成两个平台各 {args.posts} 条帖子、每条 {args.images} 张 {args.image_size} 图片 ...")
+    cursors = seed_accounts(mastodon_server, bluesky_server, args.posts, args.images, image_size)
+
+    with tempfile.TemporaryDirectory() as directory:
+        with open(os.path.join(directory, 'sync_cursor.json'), 'w', encoding='utf-8') as f:
+            json.dump(cursors, f)
+        account = {
+            'name': 'bench',
+            'mastodon_instance_url': mastodon_server.url,
+            'mastodon_access_token': 'token',
+            'bluesky_instance_url': f'{bluesky_server.url}/xrpc',
+            'bluesky_username': HANDLE,
+            'bluesky_password': 'password',
+            'from_mastodon_at': '',
+            'from_bluesky_at': '',
+            'sync_edits_and_deletes': False,
+            'data_dir': directory,
+        }
+        start = time.perf_counter()
+        sync_tool = SyncTool(account)
+        print(f"SyncTool 初始化: {time.perf_counter() - start:.2f} 秒")
+        if not args.batch:
+            sync_tool.mastodon_to_bluesky_syncer.batch_threshold = 0
+        if args.pipeline_depth:
+            for syncer in (sync_tool.mastodon_to_bluesky_syncer, sync_tool.bluesky_to_mastodon_syncer):
+                syncer.pipeline.close()
+                syncer.pipeline = SyncPipeline(args.pipeline_depth)
+        samples = {'Mastodon 到 Bluesky': [], 'Bluesky 到 Mastodon': []}
+        time_posts(sync_tool.mastodon_to_bluesky_syncer, samples['Mastodon 到 Bluesky'],
+                   lambda post: post.id, lambda post: post.id)
+        time_posts(sync_tool.bluesky_to_mastodon_syncer, samples['Bluesky 到 Mastodon'],
+                   lambda item: item.post.cid, lambda post_view: post_view.cid)
+
+        # 第一轮同步全部积压的帖子，之后的几轮只处理重试队列，直到没有未完成的帖子
+        rounds = []
+        start = time.perf_counter()
+        for _ in range(MAX_ROUNDS):
+            round_start = time.perf_counter()
+            sync_tool.run()
+            rounds.append(time.perf_counter() - round_start)
+            if not len(sync_tool.retry_queue):
+                break
+        elapsed = time.perf_counter() - start
+        pending = len(sync_tool.retry_queue)
+        sync_tool.close()
+
+    print(f"同步用了 {len(rounds)} 轮, 共 {elapsed:.2f} 秒（第一轮 {rounds[0]:.2f} 秒）, 剩余未完成 {pending} 条")
+    total = 0
+    counted = True
+    for (name, durations), direction in zip(samples.items(), ('mastodon_to_bluesky', 'bluesky_to_mastodon')):
+        synced = metrics.posts_total.value(direction=direction, result='synced')
+        total += synced
+        counted = counted and synced == args.posts
+        # 批量写入的嘟文不经过逐条发布，没有逐条延迟
+        print(f"{name}: 同步 {synced} 条（逐条发布 {len(durations)} 条）, 逐条延迟 p50 {percentile(durations, 0.5) * 1000:.0f} ms, "
+              f"p99 {percentile(durations, 0.99) * 1000:.0f} ms")
+    print(f"吞吐量: {total / elapsed:.1f} 条/秒, 图片 {total * args.images / elapsed:.1f} 张/秒")
+    print(f"各阶段耗时: 获取 [{histogram_summary(metrics.fetch_seconds)}]")
+    print(f"  转码 [{histogram_summary(metrics.transcode_seconds)}]")
+    print(f"  上传 [{histogram_summary(metrics.upload_seconds)}]")
+    print(f"  发布 [{histogram_summary(metrics.post_seconds)}]")
+    for name, server in (('Mastodon', mastodon_server), ('Bluesky', bluesky_server)):
+        print(f"{name} 服务器: {sum(server.requests.values())} 个请求, 注入错误 {server.injected_errors} 次, "
+              f"限流 {server.throttled} 次; " + ', '.join(f'{route} {count}' for route, count in server.requests.most_common()))
+
+    # 核对：每条原帖在另一平台上恰好有一条带全部图片的帖子
+    to_bluesky = sorted(record['text'] for record in bluesky_server.created)
+    to_mastodon = sorted(status['content'] for status in mastodon_server.posted)
+    bluesky_images = all(len(record.get('embed', {}).get('images', [])) == args.images for record in bluesky_server.created)
+    mastodon_images = all(len(status['media_attachments']) == args.images for status in mastodon_server.posted)
+    correct = (to_bluesky == sorted(f'mastodon post {index}' for index in range(args.posts))
+               and to_mastodon == sorted(f'<p>bluesky post {index}</p>' for index in range(args.posts))
+               and bluesky_images and mastodon_images)
+    print(f"Bluesky 新帖子 {len(to_bluesky)} 条, Mastodon 新嘟文 {len(to_mastodon)} 条, 结果{'正确' if correct else '错误'}")
+    mastodon_server.close()
+    bluesky_server.close()
+    if not correct or not counted:
+        raise SystemExit(f"同步统计与帖子数不符或结果错误：每个方向应同步 {args.posts} 条")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+HTML转文本基准测试
+先用 benchmarks/html_corpus/ 下的真实Mastodon嘟文HTML核对转换结果（每个 .html 对应一个保存期望输出的 .json），
+再与旧版七次 re.sub 的实现对比转换速度。
+
+用法: python benchmarks/bench_html_to_text.py [--update]   # --update 用当前输出重新生成期望文件
+"""
+import json
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from html_to_text import html_to_text
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'html_corpus')
+ROUNDS = 2000
+
+
+def legacy_convert(content):
+    # 旧版实现：七次 re.sub，只解码四种实体，丢弃链接地址
+    text = re.sub(r'<br\s*/?>', '\n', content, flags=re.IGNORECASE)
+    text = re.sub(r'</p>', '\n', text, flags=re.IGNORECASE)
+    text = re.sub(r'<[^>]+>', '', text)
+    text = re.sub(r'&nbsp;', ' ', text)
+    text = re.sub(r'&amp;', '&', text)
+    text = re.sub(r'&lt;', '<', text)
+    text = re.sub(r'&gt;', '>', text)
+    return text
+
+
+def load_corpus():
+    corpus = []
+    for name in sorted(os.listdir(CORPUS_DIR)):
+        if name.endswith('.html'):
+            with open(os.path.join(CORPUS_DIR, name), 'r', encoding='utf-8') as f:
+                corpus.append((name[:-len('.html')], f.read()))
+    return corpus
+
+
+def check_facets(text, facets):
+    # facet的字节区间必须落在文本内且切在字符边界上
+    data = text.encode('utf-8')
+    for facet in facets:
+        start, end = facet['index']['byteStart'], facet['index']['byteEnd']
+        assert 0 <= start < end <= len(data), facet
+        data[start:end].decode('utf-8')
+
+
+def verify(corpus, update):
+    failures = 0
+    for name, content in corpus:
+        text, facets = html_to_text(content)
+        check_facets(text, facets)
+        result = {'text': text, 'facets': facets}
+        expected_file = os.path.join(CORPUS_DIR, f'{name}.json')
+        if update or not os.path.exists(expected_file):
+            with open(expected_file, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+                f.write('\n')
+            print(f"已更新 {name}.json")
+            continue
+        with open(expected_file, 'r', encoding='utf-8') as f:
+            expected = json.load(f)
+        if expected != result:
+            failures += 1
+            print(f"不一致: {name}\n  期望: {expected}\n  实际: {result}")
+    print(f"核对 {len(corpus)} 个样本，{failures} 个不一致")
+    return failures
+
+
+def bench(corpus):
+    contents = [content for _, content in corpus]
+    for label, convert in (('旧版七次 re.sub', legacy_convert), ('单次扫描', html_to_text)):
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            for content in contents:
+                convert(content)
+        elapsed = time.perf_counter() - start
+        print(f"{label}: 每条 {elapsed / (ROUNDS * len(contents)) * 1e6:.1f} 微秒")
+
+
+def main():
+    corpus = load_corpus()
+    failures = verify(corpus, '--update' in sys.argv)
+    bench(corpus)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+图片转码基准测试
+对比旧版 compress_image（逐像素复制清除元数据 + 质量每次降5的循环）与 image_transcoder 的耗时、
+编码次数和输出大小。
+
+用法: python benchmarks/bench_image_transcoder.py [图片目录]
+不指定目录时会在临时目录中生成一组大尺寸的示例图片（带EXIF的照片、带透明通道的PNG和WebP）。
+"""
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from PIL import Image, ImageFilter
+
+import image_transcoder
+from image_transcoder import transcode_image
+
+MAX_BYTES = 950 * 1024
+
+
+def legacy_compress_image(image_data, max_size_kb=950):
+    # 旧版实现
+    img = Image.open(io.BytesIO(image_data))
+    data = list(img.getdata())
+    img_without_exif = Image.new(img.mode, img.size)
+    img_without_exif.putdata(data)
+    if img_without_exif.mode != 'RGB':
+        img_without_exif = img_without_exif.convert('RGB')
+    quality = 95
+    while True:
+        buffer = io.BytesIO()
+        img_without_exif.save(buffer, format="JPEG", quality=quality)
+        size = buffer.getbuffer().nbytes
+        if size <= max_size_kb * 1024 or quality <= 20:
+            return buffer.getvalue()
+        quality -= 5
+
+
+def synthetic_photo(size):
+    # 渐变 + 噪声 + 轻微模糊，压缩特性接近真实照片
+    width, height = size
+    noise = Image.effect_noise(size, 80).filter(ImageFilter.GaussianBlur(1))
+    gradient = Image.linear_gradient('L').resize(size)
+    mandel = Image.effect_mandelbrot(size, (-2.0, -1.2, 1.0, 1.2), 64)
+    return Image.merge('RGB', (noise, gradient, mandel))
+
+
+def make_corpus(directory):
+    photo = synthetic_photo((6000, 4000))
+    exif = Image.Exif()
+    exif[0x0112] = 6  # 方向：需要旋转90度
+    exif[0x010F] = 'BenchCam'
+    photo.save(os.path.join(directory, 'photo_24mp.jpg'), quality=95, exif=exif.tobytes())
+    synthetic_photo((4032, 3024)).save(os.path.join(directory, 'photo_12mp.jpg'), quality=92)
+
+    overlay = synthetic_photo((2500, 2500)).convert('RGBA')
+    alpha = Image.radial_gradient('L').resize((2500, 2500))
+    overlay.putalpha(alpha)
+    overlay.save(os.path.join(directory, 'overlay_alpha.png'))
+    overlay.save(os.path.join(directory, 'overlay_alpha.webp'), quality=90)
+
+    screenshot = Image.new('RGB', (2880, 1800), (250, 250, 250))
+    screenshot.paste(synthetic_photo((1200, 800)), (200, 200))
+    screenshot.save(os.path.join(directory, 'screenshot.png'))
+
+
+def count_encodes(func, data):
+    # 统计一次转码中 JPEG/PNG 编码的次数
+    calls = 0
+    original_save = Image.Image.save
+
+    def counting_save(self, *args, **kwargs):
+        nonlocal calls
+        calls += 1
+        return original_save(self, *args, **kwargs)
+
+    Image.Image.save = counting_save
+    try:
+        start = time.perf_counter()
+        result = func(data)
+        elapsed = time.perf_counter() - start
+    finally:
+        Image.Image.save = original_save
+    return result, elapsed, calls
+
+
+def bench(directory):
+    names = sorted(name for name in os.listdir(directory)
+                   if name.lower().endswith(('.jpg', '.jpeg', '.png', '.webp', '.gif')))
+    total_legacy = total_new = 0.0
+    for name in names:
+        with open(os.path.join(directory, name), 'rb') as f:
+            data = f.read()
+        legacy, legacy_time, legacy_calls = count_encodes(legacy_compress_image, data)
+        new, new_time, new_calls = count_encodes(lambda d: transcode_image(d, MAX_BYTES), data)
+        total_legacy += legacy_time
+        total_new += new_time
+        with Image.open(io.BytesIO(new)) as out:
+            new_desc = f"{out.format} {out.size[0]}x{out.size[1]}"
+        print(f"{name:<22} {len(data) / 1024:8.0f} KB | "
+              f"旧版 {legacy_time * 1000:7.0f} ms, {legacy_calls:2d} 次编码, {len(legacy) / 1024:5.0f} KB | "
+              f"新版 {new_time * 1000:6.0f} ms, {new_calls:2d} 次编码, {len(new) / 1024:5.0f} KB ({new_desc})")
+    if total_new:
+        print(f"合计: 旧版 {total_legacy:.2f} s, 新版 {total_new:.2f} s, 加速 {total_legacy / total_new:.1f}x")
+
+
+def main():
+    if len(sys.argv) > 1:
+        bench(sys.argv[1])
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"生成示例图片 (最长边上限 {image_transcoder.IMAGE_MAX_DIMENSION}px)...")
+        make_corpus(tmp)
+        bench(tmp)
+
+
+if __name__ == '__main__':
+    main()
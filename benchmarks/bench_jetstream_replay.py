@@ -0,0 +1,166 @@
+"""
+Jetstream消费者回放基准测试
+从录制的事件文件（每行一条Jetstream原始消息）回放全网事件，测量按DID过滤、解析和分发的吞吐量，
+并与逐条解析JSON后再过滤的做法对比。没有指定文件时生成一份合成的事件文件。
+
+用法:
+  python benchmarks/bench_jetstream_replay.py [事件文件] [订阅的DID ...]
+  python benchmarks/bench_jetstream_replay.py --record 事件文件 [条数]   # 从 JETSTREAM_URL 录制全网帖子事件
+"""
+import json
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from jetstream_consumer import JetstreamConsumer, JETSTREAM_URL, JETSTREAM_COLLECTION
+
+SYNTHETIC_EVENTS = 300000
+SYNTHETIC_DIDS = 50000
+OUR_DID = 'did:plc:ourownaccountxxxxxxxxxx'
+# 全网事件速率的参考值（事件/秒），高峰时约为平时的数倍
+NETWORK_EVENT_RATE = 2000
+
+
+class MemoryCursorStore:
+    def __init__(self):
+        self.cursors = {}
+
+    def get(self, key, default=None):
+        return self.cursors.get(key, default)
+
+    def set(self, key, value):
+        self.cursors[key] = value
+
+
+class CountingSyncer:
+    # 只记录收到的帖子，不访问网络
+    def __init__(self):
+        self.posts = []
+
+    def sync_post(self, feed_item):
+        self.posts.append(feed_item.post.cid)
+        return True
+
+    def sync_or_defer(self, feed_item, stats):
+        self.sync_post(feed_item)
+        stats['synced'] += 1
+
+    def sync(self):
+        return {'fetched': 0, 'synced': 0, 'skipped': 0, 'failed': 0}
+
+
+def random_id(length):
+    return ''.join(random.choices(string.ascii_lowercase + string.digits, k=length))
+
+
+def synthetic_event(did, time_us):
+    kind = random.random()
+    if kind < 0.02:
+        return {'did': did, 'time_us': time_us, 'kind': 'identity',
+                'identity': {'did': did, 'handle': f'{random_id(8)}.bsky.social', 'seq': time_us, 'time': '2024-01-01T00:00:00Z'}}
+    collection = random.choices(
+        ['app.bsky.feed.like', 'app.bsky.feed.post', 'app.bsky.feed.repost', 'app.bsky.graph.follow'],
+        weights=[50, 25, 10, 15])[0]
+    record = {'$type': collection, 'createdAt': '2024-01-01T00:00:00.000Z'}
+    if collection == 'app.bsky.feed.post':
+        record['text'] = ' '.join(random_id(random.randint(2, 9)) for _ in range(random.randint(3, 40)))
+        record['langs'] = ['en']
+        if random.random() < 0.3:
+            record['embed'] = {'$type': 'app.bsky.embed.images', 'images': [
+                {'alt': '', 'image': {'$type': 'blob', 'ref': {'$link': 'bafkrei' + random_id(52)}, 'mimeType': 'image/jpeg', 'size': 123456}}
+            ]}
+        if random.random() < 0.4:
+            record['reply'] = {'root': {'uri': f'at://{did}/app.bsky.feed.post/{random_id(13)}', 'cid': 'bafyrei' + random_id(52)},
+                               'parent': {'uri': f'at://{did}/app.bsky.feed.post/{random_id(13)}', 'cid': 'bafyrei' + random_id(52)}}
+    else:
+        record['subject'] = {'uri': f'at://did:plc:{random_id(24)}/app.bsky.feed.post/{random_id(13)}', 'cid': 'bafyrei' + random_id(52)}
+    return {'did': did, 'time_us': time_us, 'kind': 'commit', 'commit': {
+        'rev': random_id(13), 'operation': 'create', 'collection': collection,
+        'rkey': random_id(13), 'record': record, 'cid': 'bafyrei' + random_id(52)}}
+
+
+def write_synthetic(filename):
+    dids = [f'did:plc:{random_id(24)}' for _ in range(SYNTHETIC_DIDS)]
+    time_us = int(time.time() * 1000000)
+    with open(filename, 'w', encoding='utf-8') as f:
+        for index in range(SYNTHETIC_EVENTS):
+            # 约每5000条事件中有一条来自我们的账户
+            did = OUR_DID if index % 5000 == 0 else random.choice(dids)
+            time_us += random.randint(100, 900)
+            f.write(json.dumps(synthetic_event(did, time_us), separators=(',', ':')) + '\n')
+
+
+def record(filename, count):
+    # 录制全网的帖子事件（不按DID过滤）
+    from websockets.sync.client import connect
+    with connect(f'{JETSTREAM_URL}?wantedCollections={JETSTREAM_COLLECTION}', max_size=None) as websocket, \
+            open(filename, 'w', encoding='utf-8') as f:
+        for index in range(count):
+            f.write(websocket.recv() + '\n')
+    print(f"已录制 {count} 条事件到 {filename}")
+
+
+def naive_replay(messages, dids):
+    # 对照组：每条消息都完整解析JSON后再过滤
+    matched = 0
+    for message in messages:
+        event = json.loads(message)
+        if event.get('did') in dids and event.get('kind') == 'commit' and event['commit'].get('collection') == JETSTREAM_COLLECTION:
+            matched += 1
+    return matched
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--record':
+        record(sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 100000)
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        if len(sys.argv) > 1:
+            filename = sys.argv[1]
+            dids = sys.argv[2:]
+        else:
+            filename = os.path.join(directory, 'events.jsonl')
+            write_synthetic(filename)
+            dids = [OUR_DID]
+        with open(filename, 'r', encoding='utf-8') as f:
+            messages = [line.rstrip('\n') for line in f if line.strip()]
+        if not dids:
+            # 没有指定DID时取文件中发帖最多的账户
+            counts = {}
+            for message in messages:
+                event = json.loads(message)
+                if event.get('kind') == 'commit' and event['commit'].get('collection') == JETSTREAM_COLLECTION:
+                    counts[event['did']] = counts.get(event['did'], 0) + 1
+            dids = [max(counts, key=counts.get)] if counts else []
+
+        consumer = JetstreamConsumer(MemoryCursorStore(), url='ws://127.0.0.1')
+        syncers = {}
+        for did in dids:
+            syncers[did] = CountingSyncer()
+            consumer.subscribe(did, syncers[did])
+
+        start = time.perf_counter()
+        handled = sum(1 for message in messages if consumer.handle_message(message))
+        elapsed = time.perf_counter() - start
+        synced = sum(len(syncer.posts) for syncer in syncers.values())
+        rate = len(messages) / elapsed
+
+        naive_start = time.perf_counter()
+        naive_matched = naive_replay(messages, set(dids))
+        naive_elapsed = time.perf_counter() - naive_start
+
+        print(f"事件 {len(messages)} 条，订阅 {len(dids)} 个账户，匹配的帖子 {handled} 条（其中非回复 {synced} 条）")
+        print(f"原始字符串预过滤: {elapsed:.3f} 秒, {rate:,.0f} 事件/秒, 约为全网速率 {NETWORK_EVENT_RATE} 事件/秒的 {rate / NETWORK_EVENT_RATE:,.0f} 倍")
+        print(f"逐条解析JSON:     {naive_elapsed:.3f} 秒, {len(messages) / naive_elapsed:,.0f} 事件/秒 (匹配 {naive_matched} 条)")
+        consumer.save_cursor(force=True)
+        print(f"游标已推进到 time_us={consumer.cursor}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""
+速率限制调度基准测试
+用模拟时钟模拟一个按固定窗口限制请求数的服务器（Mastodon 风格的 X-RateLimit-* 头和ISO时间，
+Bluesky 风格的 RateLimit-* 头和时间戳），连续发送大量请求，
+对比经过 RateGovernor 和不做控制（收到429后等到重置再发）时的429次数、总耗时和请求分布。
+不发送真实请求，也不真正等待。
+
+用法: python benchmarks/bench_rate_governor.py [--requests N] [--limit 次数] [--window 秒]
+"""
+import argparse
+import os
+import sys
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from rate_governor import RateGovernor, RateLimitExceeded
+
+
+class FakeClock:
+    def __init__(self, start=1_700_000_000.0):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += max(0.0, seconds)
+
+
+class FakeServer:
+    # 固定窗口限流，每个请求耗时 request_seconds
+    def __init__(self, clock, limit, window, style, request_seconds=0.05):
+        self.clock = clock
+        self.limit = limit
+        self.window = window
+        self.style = style
+        self.request_seconds = request_seconds
+        self.window_start = clock()
+        self.used = 0
+        self.rejected = 0
+        self.per_window = []
+
+    def request(self):
+        self.clock.sleep(self.request_seconds)
+        now = self.clock()
+        if now - self.window_start >= self.window:
+            self.per_window.append(self.used)
+            self.window_start += self.window * int((now - self.window_start) // self.window)
+            self.used = 0
+        reset = self.window_start + self.window
+        if self.used >= self.limit:
+            self.rejected += 1
+            return 429, self.headers(0, reset)
+        self.used += 1
+        return 200, self.headers(self.limit - self.used, reset)
+
+    def headers(self, remaining, reset):
+        if self.style == 'mastodon':
+            reset_text = datetime.fromtimestamp(reset, timezone.utc).isoformat().replace('+00:00', 'Z')
+            return {'X-RateLimit-Limit': str(self.limit), 'X-RateLimit-Remaining': str(remaining),
+                    'X-RateLimit-Reset': reset_text}
+        return {'RateLimit-Limit': str(self.limit), 'RateLimit-Remaining': str(remaining),
+                'RateLimit-Reset': str(int(reset)), 'RateLimit-Policy': f'{self.limit};w={self.window}'}
+
+
+def run_naive(requests, limit, window, style):
+    # 不做控制：一直发送，收到429后等到重置时间再重试
+    clock = FakeClock()
+    server = FakeServer(clock, limit, window, style)
+    start = clock()
+    done = 0
+    while done < requests:
+        status, _ = server.request()
+        if status == 429:
+            clock.sleep(server.window_start + window - clock())
+        else:
+            done += 1
+    return clock() - start, server
+
+
+def run_governed(requests, limit, window, style):
+    clock = FakeClock()
+    server = FakeServer(clock, limit, window, style)
+    governor = RateGovernor(clock=clock, sleep=clock.sleep, max_wait=window)
+    platform = 'Mastodon' if style == 'mastodon' else 'Bluesky'
+    start = clock()
+    done = 0
+    deferred = 0
+    while done < requests:
+        try:
+            governor.acquire(platform, 'write')
+        except RateLimitExceeded as e:
+            deferred += 1
+            clock.sleep(e.wait)
+            continue
+        status, headers = server.request()
+        governor.observe(platform, 'write', status, headers)
+        if status != 429:
+            done += 1
+    return clock() - start, server, governor.status(), deferred
+
+
+def main():
+    parser = argparse.ArgumentParser(description='速率限制调度基准测试（模拟时钟）')
+    parser.add_argument('--requests', type=int, default=2000, help='发送的请求数')
+    parser.add_argument('--limit', type=int, default=300, help='每个窗口允许的请求数')
+    parser.add_argument('--window', type=int, default=300, help='窗口长度（秒）')
+    args = parser.parse_args()
+
+    for style in ('mastodon', 'bluesky'):
+        print(f"== {style} 风格的速率限制头: {args.requests} 个请求, 每 {args.window} 秒 {args.limit} 个 ==")
+        elapsed, server = run_naive(args.requests, args.limit, args.window, style)
+        print(f"不做控制: 模拟耗时 {elapsed:.0f} 秒, 429 {server.rejected} 次, 各窗口请求数 {server.per_window[:5]}")
+        elapsed, server, status, deferred = run_governed(args.requests, args.limit, args.window, style)
+        print(f"RateGovernor: 模拟耗时 {elapsed:.0f} 秒, 429 {server.rejected} 次, 推迟 {deferred} 次, "
+              f"各窗口请求数 {server.per_window[:5]}")
+        print(f"剩余额度: {status}")
+        if server.rejected:
+            raise SystemExit(f"RateGovernor 仍然收到了 {server.rejected} 次429")
+
+
+if __name__ == '__main__':
+    main()
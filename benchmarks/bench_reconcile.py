@@ -0,0 +1,215 @@
+"""
+编辑和删除同步基准测试
+构造一个带元数据的大规模同步状态（一半原帖在Mastodon，一半在Bluesky），在内存中模拟两个平台，
+随机编辑和删除一部分最近的和历史上的原帖，测量每轮检查的耗时和请求数，
+以及巡检完整个历史需要的轮数，并确认所有编辑和删除都同步到了另一平台。
+
+用法: python benchmarks/bench_reconcile.py [记录数]
+"""
+import os
+import bisect
+import random
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from mastodon import MastodonNotFoundError
+from mastodon_to_bluesky_sync import mastodon_content_hash, MASTODON_PAGE_LIMIT
+from post_reconciler import PostReconciler, RECONCILE_SWEEP_PAGES, BLUESKY_GET_POSTS_LIMIT
+from sync_status_manager import SyncStatusManager
+from sync_cursor_store import SyncCursorStore
+
+DID = 'did:plc:bench'
+EDITS = 20
+DELETES = 20
+
+
+class FakeMastodon:
+    def __init__(self):
+        self.statuses = {}
+        self._sorted_ids = None
+        self.requests = 0
+        self.updated = {}
+        self.deleted = set()
+
+    def add(self, status_id, content):
+        self.statuses[status_id] = SimpleNamespace(id=status_id, content=content, media_attachments=[])
+        self._sorted_ids = None
+
+    def remove(self, status_id):
+        del self.statuses[status_id]
+        self._sorted_ids = None
+
+    def account_verify_credentials(self):
+        self.requests += 1
+        return SimpleNamespace(id='1')
+
+    def account_statuses(self, account_id, max_id=None, limit=20):
+        self.requests += 1
+        if self._sorted_ids is None:
+            self._sorted_ids = sorted(int(status_id) for status_id in self.statuses)
+        end = bisect.bisect_left(self._sorted_ids, int(max_id)) if max_id is not None else len(self._sorted_ids)
+        return [self.statuses[str(status_id)] for status_id in reversed(self._sorted_ids[max(0, end - limit):end])]
+
+    def status(self, status_id):
+        self.requests += 1
+        if str(status_id) not in self.statuses:
+            raise MastodonNotFoundError('Record not found')
+        return self.statuses[str(status_id)]
+
+    def status_update(self, status_id, status=None, media_ids=None):
+        self.requests += 1
+        self.updated[str(status_id)] = status
+
+    def status_delete(self, status_id):
+        self.requests += 1
+        self.deleted.add(str(status_id))
+
+
+class FakeBluesky:
+    def __init__(self):
+        self.me = SimpleNamespace(did=DID)
+        self.posts = {}
+        self.requests = 0
+        self.deleted = set()
+        self.com = SimpleNamespace(atproto=SimpleNamespace(repo=SimpleNamespace(
+            delete_record=self.delete_record, get_record=self.get_record)))
+
+    def get_posts(self, uris):
+        self.requests += 1
+        return SimpleNamespace(posts=[self.posts[uri] for uri in uris if uri in self.posts])
+
+    def get_record(self, params):
+        self.requests += 1
+        uri = f"at://{DID}/{params['collection']}/{params['rkey']}"
+        if uri not in self.posts:
+            raise Exception('RecordNotFound: Could not locate record')
+        return self.posts[uri]
+
+    def delete_record(self, data):
+        self.requests += 1
+        self.deleted.add(f"at://{DID}/{data['collection']}/{data['rkey']}")
+
+
+class FakeMastodonToBluesky:
+    # 只记录重新发布的嘟文
+    def __init__(self, mastodon, bluesky, ledger):
+        self.mastodon = mastodon
+        self.bluesky = bluesky
+        self.ledger = ledger
+        self.republished = set()
+
+    def is_eligible(self, status):
+        return True
+
+    def convert_mastodon_to_bluesky(self, status):
+        return [{'text': status.content}]
+
+    def publish_reserved(self, status, records):
+        self.republished.add(status.id)
+        self.ledger.mark_as_synced(status.id, f'new-{status.id}', 'mastodon_to_bluesky', meta={
+            'origin': 'mastodon', 'hash': mastodon_content_hash(status), 'uri': f'at://{DID}/app.bsky.feed.post/new{status.id}'})
+
+
+class FakeBlueskyToMastodon:
+    def __init__(self):
+        self.media_cache = None
+
+    def convert_bluesky_to_mastodon(self, post_view):
+        return post_view.record.text, []
+
+    def media_sources(self, post_view):
+        return []
+
+
+def build(directory, size):
+    mastodon = FakeMastodon()
+    bluesky = FakeBluesky()
+    ledger = SyncStatusManager(os.path.join(directory, 'sync_status.json'), compact_threshold=size * 4)
+    pairs = []
+    for index in range(size):
+        status_id = str(100000000000000000 + index * 1000)
+        rkey = f'3k{index:011d}'
+        uri = f'at://{DID}/app.bsky.feed.post/{rkey}'
+        cid = f'bafyrei{index:052d}'
+        mastodon.add(status_id, f'<p>post {index}</p>')
+        if index % 2 == 0:
+            meta = {'origin': 'mastodon', 'hash': mastodon_content_hash(mastodon.statuses[status_id]), 'uri': uri}
+        else:
+            meta = {'origin': 'bluesky', 'uri': uri}
+            bluesky.posts[uri] = SimpleNamespace(uri=uri, cid=cid, record=SimpleNamespace(text=f'post {index}'), embed=None)
+        pairs.append((status_id, cid, meta))
+    ledger.mark_many_as_synced(pairs, 'mastodon_to_bluesky')
+    ledger.compact()
+    return mastodon, bluesky, ledger, pairs
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    with tempfile.TemporaryDirectory() as directory:
+        mastodon, bluesky, ledger, pairs = build(directory, size)
+        start = time.perf_counter()
+        ledger = SyncStatusManager(os.path.join(directory, 'sync_status.json'))
+        print(f"加载 {size} 条带元数据的同步记录: {time.perf_counter() - start:.3f} 秒")
+
+        # 一半改动在最近的帖子上，一半在历史帖子上
+        random.seed(1)
+        recent = pairs[-200:]
+        history = pairs[:-200]
+        changed = random.sample(recent, (EDITS + DELETES) // 2) + random.sample(history, (EDITS + DELETES) // 2)
+        expected_edits = {}
+        expected_deletes = {}
+        for number, (status_id, cid, meta) in enumerate(changed):
+            edit = number % 2 == 0
+            if meta['origin'] == 'mastodon':
+                if edit:
+                    mastodon.statuses[status_id].content += '<p>edited</p>'
+                else:
+                    mastodon.remove(status_id)
+            else:
+                if edit:
+                    bluesky.posts[meta['uri']] = SimpleNamespace(uri=meta['uri'], cid=cid + 'x',
+                                                                 record=SimpleNamespace(text='edited'), embed=None)
+                else:
+                    del bluesky.posts[meta['uri']]
+            (expected_edits if edit else expected_deletes)[status_id] = meta['origin']
+
+        m2b = FakeMastodonToBluesky(mastodon, bluesky, ledger)
+        reconciler = PostReconciler(m2b, FakeBlueskyToMastodon(), ledger, SyncCursorStore(os.path.join(directory, 'sync_cursor.json')))
+
+        first = reconciler.reconcile()
+        print(f"第一轮: 检查 {first['checked']} 条, 编辑 {first['edited']} 次, 删除 {first['deleted']} 次（最近的改动）")
+
+        rounds = 1
+        durations = []
+        total = dict(first)
+        mastodon.requests = bluesky.requests = 0
+        # Mastodon要翻完账户的全部嘟文（包括从Bluesky同步过来的），Bluesky只查原帖在Bluesky上的记录
+        full_sweep = max(size // MASTODON_PAGE_LIMIT, size // 2 // BLUESKY_GET_POSTS_LIMIT) // RECONCILE_SWEEP_PAGES + 2
+        while rounds < full_sweep:
+            start = time.perf_counter()
+            stats = reconciler.reconcile()
+            durations.append(time.perf_counter() - start)
+            for key in total:
+                total[key] += stats[key]
+            rounds += 1
+        durations.sort()
+        requests = (mastodon.requests + bluesky.requests) / (rounds - 1)
+        print(f"巡检完整个历史用了 {rounds} 轮，每轮耗时 p50 {durations[len(durations) // 2] * 1000:.1f} ms, "
+              f"最大 {durations[-1] * 1000:.1f} ms，平均每轮 {requests:.1f} 个请求")
+
+        edits_ok = all((status_id in m2b.republished) if origin == 'mastodon' else (status_id in mastodon.updated)
+                       for status_id, origin in expected_edits.items())
+        deletes_ok = all((any(uri.startswith(f'at://{DID}/') for uri in bluesky.deleted) and not ledger.is_synced(status_id, 'mastodon_to_bluesky'))
+                         if origin == 'mastodon' else (status_id in mastodon.deleted)
+                         for status_id, origin in expected_deletes.items())
+        print(f"编辑 {len(expected_edits)} 条、删除 {len(expected_deletes)} 条，共同步了编辑 {total['edited']} 次、删除 {total['deleted']} 次，"
+              f"结果{'正确' if edits_ok and deletes_ok and total['edited'] == len(expected_edits) and total['deleted'] == len(expected_deletes) else '错误'}")
+        ledger.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+同步状态管理器基准测试
+分别在 1万、10万、100万 条记录的规模下测量加载、查询、追加写入和合并的耗时，
+并与旧版基于列表线性扫描、每次整体重写JSON的实现做对比。
+
+用法: python benchmarks/bench_sync_status.py [规模 ...]
+"""
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from sync_status_manager import SyncStatusManager
+
+LOOKUPS = 10000
+WRITES = 1000
+# 旧版实现太慢，只在这些规模下做少量采样
+LEGACY_LOOKUPS = 200
+LEGACY_WRITES = 20
+
+
+class LegacySyncStatusManager:
+    # 旧版实现：线性扫描 + 每次标记都整体重写带缩进的JSON
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'r', encoding='utf-8') as f:
+            self.sync_status = json.load(f)
+
+    def is_synced(self, post_id, direction):
+        if direction == 'mastodon_to_bluesky':
+            return any(pair[0] == str(post_id) for pair in self.sync_status)
+        return any(pair[1] == str(post_id) for pair in self.sync_status)
+
+    def mark_as_synced(self, post_id, synced_id, direction):
+        self.sync_status.append([str(post_id), str(synced_id)])
+        with open(self.filename, 'w', encoding='utf-8') as f:
+            json.dump(self.sync_status, f, ensure_ascii=False, indent=2)
+
+
+def make_ledger(filename, size):
+    pairs = [[str(100000000000000000 + i), f'bafyrei{i:052d}'] for i in range(size)]
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump(pairs, f, separators=(',', ':'))
+    return pairs
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def bench(size):
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, 'sync_status.json')
+        pairs = make_ledger(filename, size)
+        probes = [random.choice(pairs)[0] for _ in range(LOOKUPS // 2)] + \
+                 [str(i) for i in range(LOOKUPS // 2)]
+
+        manager = None
+
+        def load():
+            nonlocal manager
+            manager = SyncStatusManager(filename, compact_threshold=WRITES * 2)
+
+        load_time = timed(load)
+        lookup_time = timed(lambda: [manager.is_synced(p, 'mastodon_to_bluesky') for p in probes])
+        write_time = timed(lambda: [manager.mark_as_synced(f'new{i}', f'cid{i}', 'mastodon_to_bluesky')
+                                    for i in range(WRITES)])
+        compact_time = timed(manager.compact)
+        manager.close()
+
+        print(f"规模 {size:>9,}: 加载 {load_time * 1000:9.1f} ms | "
+              f"查询 {lookup_time / LOOKUPS * 1e6:7.2f} µs/次 | "
+              f"写入 {write_time / WRITES * 1e6:8.1f} µs/次 | "
+              f"合并 {compact_time * 1000:9.1f} ms")
+
+        if size <= 100000:
+            legacy = LegacySyncStatusManager(filename)
+            legacy_lookup = timed(lambda: [legacy.is_synced(p, 'mastodon_to_bluesky')
+                                           for p in probes[:LEGACY_LOOKUPS]])
+            legacy_write = timed(lambda: [legacy.mark_as_synced(f'old{i}', f'cid{i}', 'mastodon_to_bluesky')
+                                          for i in range(LEGACY_WRITES)])
+            print(f"{'旧版实现':>13}: {'':>20}| "
+                  f"查询 {legacy_lookup / LEGACY_LOOKUPS * 1e6:7.0f} µs/次 | "
+                  f"写入 {legacy_write / LEGACY_WRITES * 1e6:8.0f} µs/次")
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000]
+    for size in sizes:
+        bench(size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+"""
+Mastodon流式同步测试
+在本地启动一个模拟的Mastodon服务器（实例信息、账户、嘟文列表和 /api/v1/streaming/user 推送），
+测量嘟文发布到同步到Bluesky的延迟，并在中途断开连接、断线期间继续发帖，验证重连后的增量轮询能补上漏掉的嘟文。
+
+用法: python benchmarks/fake_mastodon_streaming.py [嘟文数]
+"""
+import json
+import os
+import queue
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import urlparse, parse_qs
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from mastodon import Mastodon
+from mastodon_stream import MastodonStatusStream
+from mastodon_to_bluesky_sync import MastodonToBlueskySyncer
+from sync_status_manager import SyncStatusManager
+from sync_cursor_store import SyncCursorStore
+from retry_queue import RetryQueue
+
+ACCOUNT_ID = '1'
+OTHER_ACCOUNT_ID = '2'
+HEARTBEAT_INTERVAL = 1
+
+
+class FakeMastodonServer:
+    def __init__(self):
+        """
+        模拟的Mastodon服务器，嘟文保存在内存中，新嘟文同时推送给所有流式连接
+        """
+        self.statuses = []
+        self.streams = []
+        self.lock = threading.Lock()
+        self.next_id = 100
+        self.stream_connections = 0
+        # 为True时嘟文列表接口返回503，模拟增量轮询失败
+        self.fail_polls = False
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self.handler_class())
+        self.httpd.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.httpd.server_address[1]}'
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def status(self, account_id, content):
+        with self.lock:
+            self.next_id += 1
+            status_id = str(self.next_id)
+        return {
+            'id': status_id,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'content': f'<p>{content}</p>',
+            'url': f'{self.url}/@user/{status_id}',
+            'account': {'id': account_id, 'username': 'user', 'acct': 'user'},
+            'in_reply_to_id': None,
+            'reblog': None,
+            'mentions': [],
+            'visibility': 'public',
+            'media_attachments': [],
+            'language': 'zh',
+        }
+
+    def publish(self, content, account_id=ACCOUNT_ID):
+        # 发布一条嘟文并推送给当前所有流式连接
+        status = self.status(account_id, content)
+        with self.lock:
+            if account_id == ACCOUNT_ID:
+                self.statuses.append(status)
+            for stream in self.streams:
+                stream.put(status)
+        return status
+
+    def drop_streams(self):
+        # 断开所有流式连接
+        with self.lock:
+            for stream in self.streams:
+                stream.put(None)
+            self.streams = []
+
+    def close(self):
+        self.drop_streams()
+        self.httpd.shutdown()
+
+    def handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, data):
+                body = json.dumps(data).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                path = parsed.path.rstrip('/')
+                params = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+                if path == '/api/v1/instance':
+                    self.send_json({'uri': '127.0.0.1', 'title': 'fake', 'version': '4.2.0', 'urls': {}})
+                elif path == '/api/v1/accounts/verify_credentials':
+                    self.send_json({'id': ACCOUNT_ID, 'username': 'user', 'acct': 'user'})
+                elif path == f'/api/v1/accounts/{ACCOUNT_ID}/statuses':
+                    if server.fail_polls:
+                        self.send_error(503)
+                    else:
+                        self.send_json(self.page(params))
+                elif path == '/api/v1/streaming/user':
+                    self.stream()
+                else:
+                    self.send_error(404)
+
+            def page(self, params):
+                limit = int(params.get('limit', 20))
+                with server.lock:
+                    statuses = sorted(server.statuses, key=lambda status: int(status['id']))
+                if 'min_id' in params:
+                    # min_id 返回紧接在它之后的一页，从旧到新截取，按新到旧返回
+                    newer = [status for status in statuses if int(status['id']) > int(params['min_id'])]
+                    return list(reversed(newer[:limit]))
+                return list(reversed(statuses))[:limit]
+
+            def stream(self):
+                events = queue.Queue()
+                with server.lock:
+                    server.streams.append(events)
+                    server.stream_connections += 1
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                try:
+                    # 与真实服务器一样，连接建立后立即发送一条注释行
+                    self.write_chunk(b':)\n')
+                    while True:
+                        try:
+                            status = events.get(timeout=HEARTBEAT_INTERVAL)
+                        except queue.Empty:
+                            self.write_chunk(b':thump\n')
+                            continue
+                        if status is None:
+                            break
+                        payload = json.dumps(status)
+                        self.write_chunk(f'event: update\ndata: {payload}\n\n'.encode('utf-8'))
+                    self.wfile.write(b'0\r\n\r\n')
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                finally:
+                    with server.lock:
+                        if events in server.streams:
+                            server.streams.remove(events)
+                self.close_connection = True
+
+            def write_chunk(self, data):
+                self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+                self.wfile.flush()
+
+        return Handler
+
+
+class FakeBluesky:
+    # 只记录创建的帖子及创建时间的Bluesky客户端
+    def __init__(self):
+        self.created = {}
+        self.me = SimpleNamespace(did='did:plc:fake')
+        self.com = SimpleNamespace(atproto=SimpleNamespace(repo=SimpleNamespace(create_record=self.create_record)))
+
+    def create_record(self, data):
+        text = data['record']['text'].strip()
+        self.created[text] = time.monotonic()
+        return SimpleNamespace(cid=f'cid-{len(self.created)}', uri=f'at://did:plc:fake/app.bsky.feed.post/{len(self.created)}')
+
+
+def wait_until(predicate, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    server = FakeMastodonServer()
+    bluesky = FakeBluesky()
+    with tempfile.TemporaryDirectory() as directory:
+        mastodon = Mastodon(access_token='token', api_base_url=server.url)
+        ledger = SyncStatusManager(os.path.join(directory, 'sync_status.json'))
+        cursor_store = SyncCursorStore(os.path.join(directory, 'sync_cursor.json'))
+        syncer = MastodonToBlueskySyncer(mastodon, bluesky, ledger, cursor_store=cursor_store, from_mastodon_at='',
+                                         retry_queue=RetryQueue(os.path.join(directory, 'retry_queue.json')))
+        stream = MastodonStatusStream(mastodon, syncer, cursor_store)
+        stream.start()
+        if not wait_until(lambda: stream.connected):
+            print("未能连接模拟的流式接口")
+            return
+
+        # 推送延迟：发帖到创建Bluesky帖子之间的时间
+        latencies = []
+        for index in range(count):
+            content = f'stream {index}'
+            published = time.monotonic()
+            server.publish(content)
+            # 关注对象的嘟文不应被同步
+            server.publish(f'other {index}', account_id=OTHER_ACCOUNT_ID)
+            if not wait_until(lambda: content in bluesky.created):
+                print(f"嘟文 {content} 未被同步")
+                return
+            latencies.append((bluesky.created[content] - published) * 1000)
+        latencies.sort()
+        print(f"推送同步 {count} 条: p50 {statistics.median(latencies):.1f} ms, "
+              f"p99 {latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]:.1f} ms")
+
+        # 断线期间发布的嘟文由重连后的增量轮询补上
+        server.drop_streams()
+        wait_until(lambda: not stream.connected)
+        missed = [f'gap {index}' for index in range(5)]
+        for content in missed:
+            server.publish(content)
+        start = time.monotonic()
+        filled = wait_until(lambda: all(content in bluesky.created for content in missed))
+        print(f"断线期间的 {len(missed)} 条嘟文{'已在 %.2f 秒内补齐' % (time.monotonic() - start) if filled else '未能补齐'}，"
+              f"流式连接次数 {server.stream_connections}")
+
+        leaked = [text for text in bluesky.created if text.startswith('other')]
+        print(f"误同步的他人嘟文: {len(leaked)} 条，Bluesky帖子总数: {len(bluesky.created)}")
+
+        stream.close()
+        ledger.close()
+        server.close()
+
+
+if __name__ == '__main__':
+    main()
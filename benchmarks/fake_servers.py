@@ -0,0 +1,456 @@
+"""
+基准测试用的本地模拟服务器：Mastodon 和 Bluesky（PDS + AppView）
+只实现同步工具用到的接口，数据保存在内存中；每个请求可以加上固定的网络延迟，
+写入和上传接口可以按比例随机返回500错误，并按固定窗口限制请求数（超出时返回429和速率限制头）。
+"""
+import base64
+import hashlib
+import io
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+from PIL import Image, ImageDraw
+
+ACCOUNT_ID = '1'
+DID = 'did:plc:fakeaccount'
+HANDLE = 'fake.bsky.example'
+
+
+def synthetic_image(seed, size=(1024, 768)):
+    """
+    生成一张接近照片的合成JPEG：渐变背景加噪点，每张的内容都不同（媒体缓存不会命中）
+    :param seed: 图片编号，写在图片上
+    :param size: 尺寸
+    """
+    noise = [Image.effect_noise(size, 48) for _ in range(3)]
+    gradient = Image.linear_gradient('L').resize(size)
+    img = Image.merge('RGB', [Image.blend(channel, gradient, 0.5) for channel in noise])
+    ImageDraw.Draw(img).text((10, 10), f'image {seed}', fill=(255, 255, 255))
+    buffer = io.BytesIO()
+    img.save(buffer, 'JPEG', quality=92)
+    return buffer.getvalue()
+
+
+def fake_jwt(did, scope, lifetime):
+    # 客户端只解码载荷读取过期时间，不校验签名
+    def encode(data):
+        return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+    now = int(time.time())
+    payload = {'scope': scope, 'sub': did, 'iat': now, 'exp': now + lifetime}
+    return '.'.join([encode(json.dumps({'alg': 'HS256', 'typ': 'JWT'}).encode('utf-8')),
+                     encode(json.dumps(payload).encode('utf-8')), encode(b'fake-signature')])
+
+
+def iso_time(moment):
+    return moment.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.') + f'{moment.microsecond // 1000:03d}Z'
+
+
+class FakeServer:
+    # 需要注入错误的接口（写入和上传），由子类设置
+    WRITE_ROUTES = ()
+
+    def __init__(self, latency=0.0, error_rate=0.0, rate_limit=0, rate_window=300, seed=1):
+        """
+        :param latency: 每个请求的额外延迟（秒）
+        :param error_rate: 写入和上传接口随机返回500错误的比例
+        :param rate_limit: 每个窗口允许的请求数，0 表示不限制
+        :param rate_window: 速率限制窗口的长度（秒）
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.rate_window = rate_window
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = Counter()
+        self.injected_errors = 0
+        self.throttled = 0
+        self.window_start = time.time()
+        self.window_requests = 0
+        self.images = {}
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self.handler_class())
+        self.httpd.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.httpd.server_address[1]}'
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+
+    def add_image(self, name, size):
+        self.images[name] = synthetic_image(name, size)
+        return f'{self.url}/media/{name}.jpg'
+
+    def take_rate_limit(self):
+        # 固定窗口计数，返回 (是否允许, 剩余次数, 窗口重置时间戳)
+        with self.lock:
+            now = time.time()
+            if now - self.window_start >= self.rate_window:
+                self.window_start = now
+                self.window_requests = 0
+            reset = int(self.window_start + self.rate_window)
+            if not self.rate_limit:
+                return True, None, reset
+            if self.window_requests >= self.rate_limit:
+                self.throttled += 1
+                return False, 0, reset
+            self.window_requests += 1
+            return True, self.rate_limit - self.window_requests, reset
+
+    def rate_limit_headers(self, remaining, reset):
+        return {}
+
+    def inject_error(self, route):
+        # 在写入之前决定是否失败，失败的请求不产生任何数据
+        if route not in self.WRITE_ROUTES or not self.error_rate:
+            return False
+        with self.lock:
+            if self.random.random() < self.error_rate:
+                self.injected_errors += 1
+                return True
+        return False
+
+    def failure(self, route):
+        return route, 500, self.error_body(500, 'InternalServerError'), 'application/json'
+
+    def route(self, method, path, query, body, headers):
+        """
+        处理一个请求，由子类实现
+        :return: (路由名, 状态码, 响应内容, Content-Type)
+        """
+        raise NotImplementedError
+
+    def error_body(self, status, message):
+        return json.dumps({'error': message}).encode('utf-8')
+
+    def handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def respond(self, status, body, content_type, extra_headers):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                for name, value in extra_headers.items():
+                    self.send_header(name, str(value))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def handle_method(self, method):
+                parsed = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                allowed, remaining, reset = server.take_rate_limit()
+                limit_headers = server.rate_limit_headers(remaining, reset)
+                time.sleep(server.latency)
+                if not allowed:
+                    self.respond(429, server.error_body(429, 'RateLimitExceeded'), 'application/json', limit_headers)
+                    return
+                name, status, data, content_type = server.route(method, parsed.path, parse_qs(parsed.query), body, self.headers)
+                with server.lock:
+                    server.requests[name] += 1
+                self.respond(status, data, content_type, limit_headers)
+
+            def do_GET(self):
+                self.handle_method('GET')
+
+            def do_POST(self):
+                self.handle_method('POST')
+
+            def do_PUT(self):
+                self.handle_method('PUT')
+
+            def do_DELETE(self):
+                self.handle_method('DELETE')
+
+        return Handler
+
+
+class FakeMastodonServer(FakeServer):
+    WRITE_ROUTES = ('status_post', 'media_post')
+
+    def __init__(self, processing_delay=0.0, **kwargs):
+        """
+        模拟的Mastodon实例：一个账户的嘟文列表、发嘟、上传媒体、查看、编辑和删除嘟文
+        :param processing_delay: 上传的媒体异步处理的时间（秒），处理完成前 url 为空
+        """
+        super().__init__(**kwargs)
+        self.processing_delay = processing_delay
+        self.statuses = {}
+        self.media = {}
+        self.next_id = 100000
+        self.posted = []
+
+    def rate_limit_headers(self, remaining, reset):
+        if remaining is None:
+            return {}
+        return {'X-RateLimit-Limit': self.rate_limit, 'X-RateLimit-Remaining': remaining, 'X-RateLimit-Reset': reset}
+
+    def error_body(self, status, message):
+        return json.dumps({'error': 'Record not found' if status == 404 else message}).encode('utf-8')
+
+    def new_id(self):
+        with self.lock:
+            self.next_id += 1
+            return str(self.next_id)
+
+    def account(self):
+        return {'id': ACCOUNT_ID, 'username': 'user', 'acct': 'user', 'display_name': 'user', 'url': f'{self.url}/@user'}
+
+    def add_status(self, content, created_at=None, images=0, image_size=(1024, 768)):
+        # 生成一条本账户的嘟文，附带 images 张合成图片
+        status_id = self.new_id()
+        attachments = []
+        for index in range(images):
+            name = f'{status_id}-{index}'
+            attachments.append({'id': name, 'type': 'image', 'url': self.add_image(name, image_size),
+                                'preview_url': None, 'description': f'image {index}'})
+        status = {
+            'id': status_id,
+            'created_at': (created_at or datetime.now(timezone.utc)).isoformat(),
+            'content': f'<p>{content}</p>',
+            'url': f'{self.url}/@user/{status_id}',
+            'account': self.account(),
+            'in_reply_to_id': None,
+            'reblog': None,
+            'mentions': [],
+            'visibility': 'public',
+            'media_attachments': attachments,
+            'language': 'zh',
+            'edited_at': None,
+        }
+        with self.lock:
+            self.statuses[status_id] = status
+        return status
+
+    def media_attachment(self, media_id):
+        with self.lock:
+            ready = self.media[media_id][1] <= time.time()
+        return {'id': media_id, 'type': 'image', 'url': f'{self.url}/media/{media_id}.jpg' if ready else None, 'description': None}
+
+    def list_statuses(self, query):
+        limit = min(int(query.get('limit', ['20'])[0]), 40)
+        with self.lock:
+            ids = sorted(self.statuses, key=int)
+        if 'max_id' in query:
+            ids = [status_id for status_id in ids if int(status_id) < int(query['max_id'][0])]
+        if 'since_id' in query:
+            ids = [status_id for status_id in ids if int(status_id) > int(query['since_id'][0])]
+        if 'min_id' in query:
+            # min_id 返回紧接在该ID之后的一页
+            ids = [status_id for status_id in ids if int(status_id) > int(query['min_id'][0])][:limit]
+        else:
+            ids = ids[-limit:]
+        return [self.statuses[status_id] for status_id in reversed(ids)]
+
+    def route(self, method, path, query, body, headers):
+        def ok(name, data):
+            return name, 200, json.dumps(data).encode('utf-8'), 'application/json'
+
+        if path.startswith('/api/v1/instance'):
+            return ok('instance', {'uri': urlparse(self.url).netloc, 'title': 'fake', 'version': '4.2.0'})
+        if path == '/api/v1/accounts/verify_credentials':
+            return ok('account_verify_credentials', self.account())
+        if re.fullmatch(r'/api/v1/accounts/[^/]+/statuses', path):
+            return ok('account_statuses', self.list_statuses(query))
+        if path == '/api/v2/media' and method == 'POST':
+            if self.inject_error('media_post'):
+                return self.failure('media_post')
+            media_id = self.new_id()
+            with self.lock:
+                self.media[media_id] = (len(body), time.time() + self.processing_delay)
+            if self.processing_delay:
+                return 'media_post', 202, json.dumps(self.media_attachment(media_id)).encode('utf-8'), 'application/json'
+            return ok('media_post', self.media_attachment(media_id))
+        match = re.fullmatch(r'/api/v1/media/(\d+)', path)
+        if match and method == 'GET':
+            if match.group(1) not in self.media:
+                return 'media', 404, self.error_body(404, ''), 'application/json'
+            attachment = self.media_attachment(match.group(1))
+            return 'media', 200 if attachment['url'] else 206, json.dumps(attachment).encode('utf-8'), 'application/json'
+        if path == '/api/v1/statuses' and method == 'POST':
+            if self.inject_error('status_post'):
+                return self.failure('status_post')
+            params = parse_qs(body.decode('utf-8')) if 'json' not in headers.get('Content-Type', '') else json.loads(body)
+            text = params.get('status', [''])
+            status = self.add_status(text[0] if isinstance(text, list) else text)
+            status['media_attachments'] = [{'id': media_id, 'type': 'image', 'url': f'{self.url}/media/{media_id}.jpg', 'description': None}
+                                           for media_id in params.get('media_ids[]', [])]
+            with self.lock:
+                self.posted.append(status)
+            return ok('status_post', status)
+        match = re.fullmatch(r'/api/v1/statuses/(\d+)', path)
+        if match:
+            with self.lock:
+                status = self.statuses.get(match.group(1))
+                if status is not None and method == 'DELETE':
+                    del self.statuses[match.group(1)]
+            if status is None:
+                return 'status', 404, self.error_body(404, ''), 'application/json'
+            return ok({'GET': 'status', 'PUT': 'status_update', 'DELETE': 'status_delete'}[method], status)
+        match = re.fullmatch(r'/media/(.+)\.jpg', path)
+        if match and match.group(1) in self.images:
+            return 'media_download', 200, self.images[match.group(1)], 'image/jpeg'
+        return 'not_found', 404, self.error_body(404, ''), 'application/json'
+
+
+class FakeBlueskyServer(FakeServer):
+    WRITE_ROUTES = ('com.atproto.repo.createRecord', 'com.atproto.repo.applyWrites', 'com.atproto.repo.uploadBlob')
+
+    def __init__(self, **kwargs):
+        """
+        模拟的PDS和AppView：登录、作者动态、创建和删除记录、上传blob、按 uri 查询帖子
+        同步工具创建的帖子和预先生成的帖子一起出现在作者动态中
+        """
+        super().__init__(**kwargs)
+        self.posts = []
+        self.by_uri = {}
+        self.blobs = {}
+        self.created = []
+        self.rkey_counter = 0
+
+    def rate_limit_headers(self, remaining, reset):
+        if remaining is None:
+            return {}
+        return {'RateLimit-Limit': self.rate_limit, 'RateLimit-Remaining': remaining, 'RateLimit-Reset': reset,
+                'RateLimit-Policy': f'{self.rate_limit};w={self.rate_window}'}
+
+    def error_body(self, status, message):
+        return json.dumps({'error': message, 'message': message}).encode('utf-8')
+
+    def store(self, record, rkey=None, indexed_at=None, embed=None):
+        with self.lock:
+            self.rkey_counter += 1
+            rkey = rkey or f'3k{self.rkey_counter:011d}'
+            uri = f'at://{DID}/app.bsky.feed.post/{rkey}'
+            cid = 'bafyrei' + hashlib.sha256(json.dumps(record, sort_keys=True).encode('utf-8') + rkey.encode('ascii')).hexdigest()[:52]
+            post = {'uri': uri, 'cid': cid, 'author': {'did': DID, 'handle': HANDLE}, 'record': record,
+                    'indexedAt': indexed_at or iso_time(datetime.now(timezone.utc))}
+            if embed is not None:
+                post['embed'] = embed
+            self.posts.append(post)
+            self.by_uri[uri] = post
+        return uri, cid
+
+    def add_post(self, text, indexed_at, images=0, image_size=(1024, 768)):
+        # 生成一条本账户的帖子，附带 images 张合成图片
+        record = {'$type': 'app.bsky.feed.post', 'text': text, 'createdAt': iso_time(indexed_at), 'langs': ['zh']}
+        embed = None
+        if images:
+            views = []
+            for index in range(images):
+                name = f'{len(self.posts)}-{index}'
+                url = self.add_image(name, image_size)
+                views.append({'thumb': url, 'fullsize': url, 'alt': f'image {index}'})
+            embed = {'$type': 'app.bsky.embed.images#view', 'images': views}
+        return self.store(record, indexed_at=iso_time(indexed_at), embed=embed)
+
+    def session(self):
+        return {'did': DID, 'handle': HANDLE, 'active': True,
+                'accessJwt': fake_jwt(DID, 'com.atproto.access', 2 * 3600),
+                'refreshJwt': fake_jwt(DID, 'com.atproto.refresh', 90 * 86400)}
+
+    def author_feed(self, query):
+        limit = int(query.get('limit', ['50'])[0])
+        offset = int(query.get('cursor', ['0'])[0])
+        with self.lock:
+            posts = sorted((post for post in self.posts if not post['record'].get('reply')),
+                           key=lambda post: post['indexedAt'], reverse=True)
+        page = posts[offset:offset + limit]
+        data = {'feed': [{'post': post} for post in page]}
+        if offset + limit < len(posts):
+            data['cursor'] = str(offset + limit)
+        return data
+
+    def route(self, method, path, query, body, headers):
+        def ok(name, data):
+            return name, 200, json.dumps(data).encode('utf-8'), 'application/json'
+
+        if not path.startswith('/xrpc/'):
+            match = re.fullmatch(r'/media/(.+)\.jpg', path)
+            if match and match.group(1) in self.images:
+                return 'media_download', 200, self.images[match.group(1)], 'image/jpeg'
+            return 'not_found', 404, self.error_body(404, 'NotFound'), 'application/json'
+        name = path[len('/xrpc/'):]
+        if self.inject_error(name):
+            return self.failure(name)
+        if name in ('com.atproto.server.createSession', 'com.atproto.server.refreshSession', 'com.atproto.server.getSession'):
+            return ok(name, self.session())
+        if name == 'app.bsky.actor.getProfile':
+            return ok(name, {'did': DID, 'handle': HANDLE})
+        if name == 'app.bsky.feed.getAuthorFeed':
+            return ok(name, self.author_feed(query))
+        if name == 'app.bsky.feed.getPosts':
+            with self.lock:
+                posts = [self.by_uri[uri] for uri in query.get('uris', []) if uri in self.by_uri]
+            return ok(name, {'posts': posts})
+        if name == 'com.atproto.sync.getBlob':
+            # 预先生成的媒体按 cid 下载，与真实PDS一样不返回准确的 Content-Type
+            data = self.images.get(query.get('cid', [''])[0])
+            if data is None:
+                return name, 400, self.error_body(400, 'BlobNotFound'), 'application/json'
+            return name, 200, data, 'application/octet-stream'
+        if name == 'com.atproto.repo.uploadBlob':
+            link = 'bafkrei' + hashlib.sha256(body).hexdigest()[:52]
+            with self.lock:
+                self.blobs[link] = len(body)
+            return ok(name, {'blob': {'$type': 'blob', 'ref': {'$link': link},
+                                      'mimeType': headers.get('Content-Type', 'image/jpeg'), 'size': len(body)}})
+        if name == 'com.atproto.repo.createRecord':
+            data = json.loads(body)
+            uri, cid = self.store(data['record'], data.get('rkey'))
+            with self.lock:
+                self.created.append(data['record'])
+            return ok(name, {'uri': uri, 'cid': cid})
+        if name == 'com.atproto.repo.applyWrites':
+            data = json.loads(body)
+            results = []
+            for write in data['writes']:
+                uri, cid = self.store(write['value'], write.get('rkey'))
+                with self.lock:
+                    self.created.append(write['value'])
+                results.append({'$type': 'com.atproto.repo.applyWrites#createResult', 'uri': uri, 'cid': cid})
+            return ok(name, {'commit': {'cid': 'bafyreicommit', 'rev': 'rev'}, 'results': results})
+        if name == 'com.atproto.repo.getRecord':
+            uri = f"at://{DID}/{query['collection'][0]}/{query['rkey'][0]}"
+            post = self.by_uri.get(uri)
+            if post is None:
+                return name, 400, json.dumps({'error': 'RecordNotFound', 'message': 'Could not locate record'}).encode('utf-8'), 'application/json'
+            return ok(name, {'uri': uri, 'cid': post['cid'], 'value': post['record']})
+        if name == 'com.atproto.repo.deleteRecord':
+            data = json.loads(body)
+            uri = f"at://{DID}/{data['collection']}/{data['rkey']}"
+            with self.lock:
+                post = self.by_uri.pop(uri, None)
+                if post is not None:
+                    self.posts.remove(post)
+            return ok(name, {})
+        return name, 400, self.error_body(400, 'MethodNotImplemented'), 'application/json'
+
+
+def seed_accounts(mastodon_server, bluesky_server, posts, images, image_size=(1024, 768)):
+    """
+    在两个模拟服务器上各生成 posts 条带 images 张图片的帖子，创建时间早于当前时间
+    :return: 同步游标，从这些帖子之前开始同步
+    """
+    start = datetime.now(timezone.utc) - timedelta(days=1)
+    first_status_id = None
+    for index in range(posts):
+        status = mastodon_server.add_status(f'mastodon post {index}', start + timedelta(seconds=index), images, image_size)
+        first_status_id = first_status_id or status['id']
+        bluesky_server.add_post(f'bluesky post {index}', start + timedelta(seconds=index), images, image_size)
+    return {
+        'mastodon_since_id': str(int(first_status_id) - 1) if first_status_id else None,
+        'bluesky_indexed_at': iso_time(start - timedelta(seconds=1)),
+    }
@@ -0,0 +1,46 @@
+import os
+import json
+
+# 是否在同步时把获取到的原帖写入归档
+ARCHIVE_POSTS = os.environ.get('ARCHIVE_POSTS', '').lower() in ('1', 'true', 'yes')
+
+
+def account_from_env():
+    # 单账户模式下从环境变量读取账户配置
+    return {
+        'name': 'default',
+        'mastodon_instance_url': os.environ.get('MASTODON_INSTANCE_URL', ''),
+        'mastodon_access_token': os.environ.get('MASTODON_ACCESS_TOKEN'),
+        'bluesky_instance_url': os.environ.get('BLUESKY_INSTANCE_URL', ''),
+        'bluesky_username': os.environ.get('BLUESKY_USERNAME', ''),
+        'bluesky_password': os.environ.get('BLUESKY_PASSWORD', ''),
+        'from_mastodon_at': os.environ.get('FROM_MASTODON_AT', ''),
+        'from_bluesky_at': os.environ.get('FROM_BLUESKY_AT', ''),
+        'mastodon_streaming': os.environ.get('MASTODON_STREAMING', '').lower() in ('1', 'true', 'yes'),
+        'bluesky_thread_split': os.environ.get('BLUESKY_THREAD_SPLIT', '').lower() in ('1', 'true', 'yes'),
+        'bluesky_jetstream': os.environ.get('BLUESKY_JETSTREAM', '').lower() in ('1', 'true', 'yes'),
+        'sync_edits_and_deletes': os.environ.get('SYNC_EDITS_AND_DELETES', 'true').lower() in ('1', 'true', 'yes'),
+        'archive_posts': ARCHIVE_POSTS,
+        'data_dir': 'data',
+    }
+
+
+def load_accounts(config_file):
+    """
+    读取多账户配置文件
+    配置文件是一个JSON列表，每一项是一对账户，字段与单账户模式的环境变量对应（小写），另需一个唯一的 name
+    :param config_file: 配置文件路径
+    :return: 账户配置列表，每个账户的数据目录默认为 data/accounts/<name>
+    """
+    with open(config_file, 'r', encoding='utf-8') as f:
+        accounts = json.load(f)
+    names = set()
+    for account in accounts:
+        name = account.get('name')
+        if not name:
+            raise ValueError("账户配置缺少 name 字段")
+        if name in names:
+            raise ValueError(f"账户名称重复: {name}")
+        names.add(name)
+        account.setdefault('data_dir', os.path.join('data', 'accounts', name))
+    return accounts
@@ -0,0 +1,69 @@
+import os
+import time
+import random
+import logging
+
+# 基础同步间隔（秒），也是启动后的第一个间隔
+SYNC_INTERVAL = int(os.environ.get('SYNC_INTERVAL', 300))
+# 自适应间隔的上下限（秒）
+SYNC_INTERVAL_MIN = int(os.environ.get('SYNC_INTERVAL_MIN', 30))
+SYNC_INTERVAL_MAX = int(os.environ.get('SYNC_INTERVAL_MAX', 1800))
+# 连续没有新帖子时，间隔每轮乘以该系数
+SYNC_BACKOFF_FACTOR = float(os.environ.get('SYNC_BACKOFF_FACTOR', 2))
+# 随机抖动的比例，避免多个账户或进程同时请求
+SYNC_JITTER = float(os.environ.get('SYNC_JITTER', 0.1))
+# 剩余请求额度低于上限的该比例时，等到额度重置后再同步
+RATE_LIMIT_RESERVE = 0.05
+
+class AdaptivePollScheduler:
+    def __init__(self, base_interval=None, min_interval=None, max_interval=None,
+                 backoff_factor=None, jitter=None, name=''):
+        """
+        自适应轮询调度器：发现新帖子后缩短间隔，空轮询时按指数退避拉长间隔
+        :param base_interval: 初始间隔（秒）
+        :param min_interval: 最短间隔（秒）
+        :param max_interval: 最长间隔（秒）
+        :param backoff_factor: 空轮询后间隔乘以的系数
+        :param jitter: 随机抖动的比例
+        :param name: 日志中显示的名称（多账户模式下为账户名）
+        """
+        self.min_interval = min_interval or SYNC_INTERVAL_MIN
+        self.max_interval = max(max_interval or SYNC_INTERVAL_MAX, self.min_interval)
+        self.backoff_factor = backoff_factor or SYNC_BACKOFF_FACTOR
+        self.jitter = SYNC_JITTER if jitter is None else jitter
+        self.name = name
+        base_interval = base_interval or SYNC_INTERVAL
+        self.interval = min(max(base_interval, self.min_interval), self.max_interval)
+
+    def next_interval(self, new_posts, rate_limits=None, now=None):
+        """
+        根据本轮结果计算下一次同步前的等待时间
+        :param new_posts: 本轮获取到的新帖子数
+        :param rate_limits: 各平台的速率限制状态列表，每项包含 remaining、limit、reset（重置时间戳）
+        :param now: 当前时间戳，默认使用 time.time()
+        :return: 等待的秒数
+        """
+        now = time.time() if now is None else now
+        if new_posts > 0:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * self.backoff_factor, self.max_interval)
+
+        delay = self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+        delay = min(max(delay, self.min_interval), self.max_interval)
+
+        reason = f"新帖子 {new_posts} 条"
+        for status in rate_limits or []:
+            remaining = status.get('remaining')
+            reset = status.get('reset')
+            if remaining is None or reset is None:
+                continue
+            limit = status.get('limit') or 0
+            if remaining <= max(1, limit * RATE_LIMIT_RESERVE) and reset - now > delay:
+                # 速率限制额度即将用完，等到重置之后再同步
+                delay = reset - now
+                reason = f"{status.get('platform', '')} 速率限制剩余 {remaining}，等待额度重置"
+
+        prefix = f"账户 {self.name} " if self.name else ""
+        logging.info(f"{prefix}下次同步在 {delay:.0f} 秒后 ({reason})")
+        return delay
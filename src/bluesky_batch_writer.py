@@ -0,0 +1,75 @@
+import os
+import time
+import logging
+import threading
+
+# 积压的待同步嘟文达到该数量时改用 applyWrites 批量写入
+BLUESKY_BATCH_THRESHOLD = int(os.environ.get('BLUESKY_BATCH_THRESHOLD', 10))
+# 每次 applyWrites 最多包含的记录数，PDS 单次请求的上限为200
+BLUESKY_BATCH_SIZE = max(1, min(int(os.environ.get('BLUESKY_BATCH_SIZE', 50)), 200))
+
+POST_COLLECTION = 'app.bsky.feed.post'
+CREATE_TYPE = 'com.atproto.repo.applyWrites#create'
+
+# TID使用的按字典序可排序的base32字母表
+TID_ALPHABET = '234567abcdefghijklmnopqrstuvwxyz'
+
+_tid_lock = threading.Lock()
+_last_tid_us = 0
+_clock_id = int.from_bytes(os.urandom(2), 'big') & 0x3FF
+
+
+def next_tid():
+    """
+    生成客户端的记录键（TID）：53位微秒时间戳加10位时钟ID，编码为13个字符
+    同一进程内严格递增，同一批次中的记录键顺序与写入顺序一致
+    """
+    global _last_tid_us
+    with _tid_lock:
+        now_us = max(time.time_ns() // 1000, _last_tid_us + 1)
+        _last_tid_us = now_us
+    value = (now_us << 10) | _clock_id
+    chars = []
+    for _ in range(13):
+        chars.append(TID_ALPHABET[value & 0x1F])
+        value >>= 5
+    return ''.join(reversed(chars))
+
+
+class BlueskyBatchWriter:
+    def __init__(self, bluesky_client, batch_size=None):
+        """
+        通过 com.atproto.repo.applyWrites 一次请求创建多条帖子，用于积压嘟文的补同步
+        记录键由客户端生成，整个批次在PDS上原子提交：要么全部创建，要么全部失败
+        :param bluesky_client: 已登录的Bluesky客户端
+        :param batch_size: 每批的记录数，默认使用 BLUESKY_BATCH_SIZE
+        """
+        self.bluesky = bluesky_client
+        self.batch_size = batch_size or BLUESKY_BATCH_SIZE
+
+    def create_records(self, records):
+        """
+        在一次 applyWrites 中创建一批帖子
+        :param records: 帖子记录列表，数量不超过 batch_size
+        :return: 与 records 顺序一致的 (uri, cid) 列表
+        """
+        did = self.bluesky.me.did
+        rkeys = [next_tid() for _ in records]
+        response = self.bluesky.com.atproto.repo.apply_writes({
+            'repo': did,
+            'writes': [
+                {'$type': CREATE_TYPE, 'collection': POST_COLLECTION, 'rkey': rkey, 'value': record}
+                for rkey, record in zip(rkeys, records)
+            ],
+        })
+        results = getattr(response, 'results', None)
+        if results and len(results) == len(records):
+            return [(result.uri, result.cid) for result in results]
+
+        # 旧版PDS不返回每条记录的结果，逐条查询生成的CID
+        logging.info("applyWrites 响应中没有记录结果，逐条查询创建的记录")
+        created = []
+        for rkey in rkeys:
+            record = self.bluesky.com.atproto.repo.get_record({'repo': did, 'collection': POST_COLLECTION, 'rkey': rkey})
+            created.append((record.uri, record.cid))
+        return created
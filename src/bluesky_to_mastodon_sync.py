@@ -1,137 +1,416 @@
-from dotenv import load_dotenv
-load_dotenv()  # 加载环境变量
-
 import os
-import json
+import time
 import logging
-import requests
-from PIL import Image
-import io
+import metrics
+from types import SimpleNamespace
+from urllib.parse import urlparse, urlencode
+from sync_cursor_store import SyncCursorStore
+from media_pipeline import MediaPipeline, MediaUploadError
+from media_cache import MediaCache
+from media_fetcher import MediaFetcher
+from retry_queue import RetryQueue
+from sync_pipeline import SyncPipeline
+from post_archive import bluesky_record
+from media_types import sniff_mime, media_kind, file_extension, MASTODON_IMAGE_MAX_MB, MASTODON_VIDEO_MAX_MB, MEDIA_MAX_VIDEO_DOWNLOAD_MB
+from video_transcoder import transcode_video
+
+# 首次运行（没有保存的高水位）时获取的最近帖子数
+BLUESKY_INITIAL_FETCH_LIMIT = 30
+# 增量获取时每页的帖子数，getAuthorFeed单页上限为100
+BLUESKY_PAGE_LIMIT = 100
+# 等待Mastodon异步处理上传的媒体的最长时间（秒），超时的帖子进入重试队列
+MASTODON_MEDIA_PROCESSING_TIMEOUT = int(os.environ.get('MASTODON_MEDIA_PROCESSING_TIMEOUT', 120))
+# 轮询媒体处理状态的间隔（秒），每次加倍直到上限
+MEDIA_POLL_INITIAL_DELAY = 0.5
+MEDIA_POLL_MAX_DELAY = 5
+# Bluesky的GIF选择器插入的是 Tenor 的GIF链接卡片
+GIF_HOSTS = ('media.tenor.com',)
+
+
+def gif_link(uri):
+    # 链接卡片是否指向一张GIF动图
+    parsed = urlparse(uri)
+    return parsed.hostname in GIF_HOSTS and parsed.path.lower().endswith('.gif')
+
 
 class BlueskyToMastodonSyncer:
-    def __init__(self, mastodon_client, bluesky_client, sync_status_manager):
+    def __init__(self, mastodon_client, bluesky_client, sync_status_manager, cursor_store=None, media_pipeline=None, media_cache=None, media_fetcher=None, from_bluesky_at=None, retry_queue=None, archive=None, pipeline=None):
         # 初始化同步器，接收Mastodon和Bluesky的客户端以及同步状态管理器
         self.mastodon = mastodon_client
         self.bluesky = bluesky_client
         self.sync_status_manager = sync_status_manager
-        self.posts_file = 'bluesky_posts.json'  # 用于保存Bluesky帖子的文件
+        # 保存已处理到的最新帖子的 indexedAt，下次只获取更新的帖子
+        self.cursor_store = cursor_store or SyncCursorStore()
+        # 并行处理同一帖子的多张图片
+        self.media_pipeline = media_pipeline or MediaPipeline()
+        # 按内容哈希缓存已上传但尚未附加的媒体
+        self.media_cache = media_cache or MediaCache()
+        # 共享连接池的媒体下载器
+        self.media_fetcher = media_fetcher or MediaFetcher()
+        # 同步后附加的来源说明，默认从环境变量读取
+        self.from_bluesky_at = os.environ.get('FROM_BLUESKY_AT', '') if from_bluesky_at is None else from_bluesky_at
+        # 同步失败的帖子进入持久化的重试队列，按退避时间单独重试，不阻塞高水位
+        self.retry_queue = RetryQueue() if retry_queue is None else retry_queue
+        # 获取到的原帖写入压缩的JSONL归档（PostArchive），为None时不归档
+        self.archive = archive
+        # 后面帖子的转换和媒体上传与前面帖子的发布重叠，发布仍按顺序进行
+        self.pipeline = pipeline or SyncPipeline()
 
-    def sync(self):
-        try:
-            # 获取Bluesky用户的帖子
+    @staticmethod
+    def feed_item_indexed_at(item):
+        # 转发条目在作者动态中的位置由转发时间决定，而不是原帖的时间
+        reason = getattr(item, 'reason', None)
+        if reason is not None and getattr(reason, 'indexed_at', None):
+            return reason.indexed_at
+        return item.post.indexed_at
+
+    def fetch_new_posts(self):
+        # 获取上次处理之后的所有帖子，按时间从旧到新排列
+        last_indexed_at = self.cursor_store.get('bluesky_indexed_at')
+        if last_indexed_at is None:
+            # 首次运行只获取最近的帖子
             data = self.bluesky.get_author_feed(
                 actor=self.bluesky.me.did,
                 filter='posts_no_replies',
-                limit=30
+                limit=BLUESKY_INITIAL_FETCH_LIMIT
             )
-            bluesky_posts = data.feed
-            logging.info(f"从Bluesky获取了 {len(bluesky_posts)} 条帖子")
-            
-            synced_count = 0
-            skipped_count = 0
-            for post in bluesky_posts:
-                post_view = post.post
-                # 更安全的检查方式
-                has_embed_record = (hasattr(post_view, 'record') and 
-                                    hasattr(post_view.record, 'embed') and 
-                                    post_view.record.embed is not None and 
-                                    hasattr(post_view.record.embed, 'record') and 
-                                    post_view.record.embed.record is not None)
-                has_reason = hasattr(post_view, 'reason') and post_view.reason is not None
-
-                if has_embed_record or has_reason:
-                    logging.info(f"跳过Bluesky帖子 {post_view.cid} (包含提及或转发)")
-                    skipped_count += 1
-                    continue
-                
-                logging.info(f"正在处理Bluesky帖子 {post_view.cid}:")
-                logging.info(f"  内容: {post_view.record.text[:100]}...")
-                
-                # self.save_post(post_view)  # 保存帖子到本地文件
-                
-                # 如果帖子未同步，则进行同步
-                if not self.sync_status_manager.is_synced(post_view.cid, 'bluesky_to_mastodon'):
-                    mastodon_post, media_ids = self.convert_bluesky_to_mastodon(post_view)
-                    response = self.mastodon.status_post(mastodon_post, media_ids=media_ids)
-                    self.sync_status_manager.mark_as_synced(post_view.cid, response['id'], 'bluesky_to_mastodon')
-                    logging.info(f"成功将Bluesky帖子 {post_view.cid} 同步到Mastodon")
-                    synced_count += 1
-                else:
-                    logging.info(f"Bluesky帖子 {post_view.cid} 已同步，跳过")
-                    skipped_count += 1
+            return list(reversed(data.feed))
+
+        items = []
+        cursor = None
+        while True:
+            # 作者动态从新到旧排列，沿着cursor向旧的方向翻页，直到遇到已处理过的帖子
+            data = self.bluesky.get_author_feed(
+                actor=self.bluesky.me.did,
+                filter='posts_no_replies',
+                limit=BLUESKY_PAGE_LIMIT,
+                cursor=cursor
+            )
+            caught_up = False
+            for item in data.feed:
+                if self.feed_item_indexed_at(item) <= last_indexed_at:
+                    caught_up = True
+                    break
+                items.append(item)
+            if caught_up or not data.feed or not data.cursor:
+                break
+            cursor = data.cursor
+        items.reverse()
+        return items
+
+    def sync(self):
+        # 返回本轮的统计：获取、同步、跳过和失败的帖子数
+        stats = {'fetched': 0, 'synced': 0, 'skipped': 0, 'failed': 0, 'deferred': 0}
+        self.retry_failed(stats)
+        try:
+            # 获取Bluesky用户上次同步之后的新帖子
+            with metrics.fetch_seconds.time(direction='bluesky_to_mastodon'):
+                bluesky_posts = self.fetch_new_posts()
+            logging.info(f"从Bluesky获取了 {len(bluesky_posts)} 条新帖子")
+            stats['fetched'] = len(bluesky_posts)
             
-            logging.info(f"Bluesky同步摘要: 同步了 {synced_count} 条帖子, 跳过了 {skipped_count} 条帖子")
+            last_indexed_at = self.cursor_store.get('bluesky_indexed_at')
+
+            def publish(post, prepared):
+                nonlocal last_indexed_at
+                # 失败的帖子进入重试队列，高水位照常推进
+                self.publish_or_defer(post, prepared, stats)
+                last_indexed_at = self.feed_item_indexed_at(post)
+
+            self.pipeline.run(bluesky_posts, self.prepare_unless_queued, publish)
+
+            if last_indexed_at is not None:
+                self.cursor_store.set('bluesky_indexed_at', last_indexed_at)
+            logging.info(f"Bluesky同步摘要: 同步了 {stats['synced']} 条帖子, 跳过了 {stats['skipped']} 条帖子, "
+                         f"失败 {stats['failed']} 条帖子, 进入重试队列 {stats['deferred']} 条帖子")
         except Exception as e:
+            # 获取或批量发布中断时高水位不推进，计为一次失败，调用方据此安排重试
+            stats['failed'] += 1
             logging.error(f"同步Bluesky到Mastodon时出错: {str(e)}")
             logging.exception("异常详情:")
+        return stats
+
+    def sync_or_defer(self, post, stats):
+        """
+        同步作者动态中的单个条目，失败时放入重试队列而不是抛出异常
+        :param stats: 统计，原地更新
+        """
+        self.publish_or_defer(post, lambda: self.prepare_unless_queued(post), stats)
 
-    def save_post(self, post):
-        # 保存Bluesky帖子到本地JSON文件
+    def prepare_unless_queued(self, post):
+        # 已在重试队列中的帖子按退避时间重试，这里返回 False；不需要同步时返回 None
+        if self.retry_queue.contains('bluesky_to_mastodon', post.post.cid):
+            return False
+        return self.prepare_post(post)
+
+    def publish_or_defer(self, post, prepared, stats):
+        """
+        发布已转换的帖子，转换或发布失败时放入重试队列而不是抛出异常
+        :param prepared: 返回 prepare_unless_queued 结果的函数，转换失败时抛出异常
+        :param stats: 统计，原地更新
+        """
         try:
-            posts = []
-            if os.path.exists(self.posts_file):
-                with open(self.posts_file, 'r', encoding='utf-8') as f:
-                    posts = json.load(f)
-            
-            post_data = {
-                'cid': post.cid,
-                'uri': post.uri,
-                'text': post.record.text,
-                'created_at': post.record.created_at,
-                'embed': post.embed.dict() if hasattr(post, 'embed') else None
-            }
-            posts.append(post_data)
-            
-            with open(self.posts_file, 'w', encoding='utf-8') as f:
-                json.dump(posts, f, ensure_ascii=False, indent=2)
-            
-            logging.info(f"已将Bluesky帖子 {post.cid} 保存到 {self.posts_file}")
-            logging.info(f"已保存的帖子总数: {len(posts)}")
+            converted = prepared()
+            if converted and self.publish_post(post.post, *converted):
+                stats['synced'] += 1
+            else:
+                stats['skipped'] += 1
         except Exception as e:
-            logging.error(f"保存Bluesky帖子 {post.cid} 时出错: {str(e)}")
+            logging.error(f"同步Bluesky帖子 {post.post.cid} 时出错: {str(e)}")
             logging.exception("异常详情:")
+            stats['deferred' if self.defer(post, e) else 'failed'] += 1
+
+    def defer(self, post, error):
+        # 把同步失败的帖子放入重试队列，重试时按 uri 重新获取，重试次数用尽移入死信时返回None
+        return self.retry_queue.add('bluesky_to_mastodon', post.post.cid, error, ref=post.post.uri)
+
+    def retry_failed(self, stats=None):
+        """
+        重试队列中已到时间的帖子：重新获取帖子后再次同步，成功或帖子已删除时移出队列，失败时按退避时间重新排队
+        上一次已上传但未附加的Mastodon媒体保存在媒体缓存中，重试时直接复用
+        :param stats: 统计，原地更新
+        :return: 统计
+        """
+        stats = stats if stats is not None else {'fetched': 0, 'synced': 0, 'skipped': 0, 'failed': 0, 'deferred': 0}
+        for item in self.retry_queue.take_due('bluesky_to_mastodon'):
+            cid = item['post_id']
+            logging.info(f"第 {item['attempts'] + 1} 次尝试同步Bluesky帖子 {cid}")
+            try:
+                posts = self.bluesky.get_posts([item['ref']]).posts
+            except Exception as e:
+                stats['deferred' if self.retry_queue.add('bluesky_to_mastodon', cid, e) else 'failed'] += 1
+                continue
+            if not posts:
+                logging.info(f"Bluesky帖子 {cid} 已删除，移出重试队列")
+                self.retry_queue.done('bluesky_to_mastodon', cid)
+                continue
+            try:
+                # 与作者动态中的条目结构一致，直接获取的帖子没有转发信息
+                if self.sync_post(SimpleNamespace(post=posts[0], reason=None)):
+                    stats['synced'] += 1
+                else:
+                    stats['skipped'] += 1
+            except Exception as e:
+                logging.error(f"重试同步Bluesky帖子 {cid} 时出错: {str(e)}")
+                stats['deferred' if self.retry_queue.add('bluesky_to_mastodon', cid, e) else 'failed'] += 1
+                continue
+            self.retry_queue.done('bluesky_to_mastodon', cid)
+        return stats
+
+    def sync_post(self, post):
+        # 同步作者动态中的单个条目，返回是否进行了同步
+        converted = self.prepare_post(post)
+        if converted is None:
+            return False
+        return self.publish_post(post.post, *converted)
+
+    def prepare_post(self, post):
+        """
+        检查帖子是否需要同步，需要时转换为Mastodon嘟文（包括上传媒体）
+        :return: (正文, 媒体ID列表)，不需要同步时返回 None
+        """
+        post_view = post.post
+        if self.archive is not None:
+            self.archive.append('bluesky', bluesky_record(post))
+        # 纯引用帖子不同步；带媒体的引用（recordWithMedia）同步媒体并附上被引用帖子的链接
+        embed = getattr(getattr(post_view, 'record', None), 'embed', None)
+        has_embed_record = getattr(embed, 'py_type', None) == 'app.bsky.embed.record'
+        # 转发信息在动态条目上，而不是帖子本身
+        has_reason = ((hasattr(post, 'reason') and post.reason is not None) or
+                      (hasattr(post_view, 'reason') and post_view.reason is not None))
+
+        if has_embed_record or has_reason:
+            logging.debug(f"跳过Bluesky帖子 {post_view.cid} (包含提及或转发)")
+            return None
+        # 作者动态已过滤掉回复，这里再检查一次：从归档重新同步或直接获取的帖子可能是回复
+        if getattr(getattr(post_view, 'record', None), 'reply', None) is not None:
+            logging.debug(f"跳过Bluesky帖子 {post_view.cid} (回复)")
+            return None
+        
+        logging.debug(f"正在处理Bluesky帖子 {post_view.cid}:")
+        logging.debug(f"  内容: {post_view.record.text[:100]}...")
+        
+        # 如果帖子已同步，则跳过
+        if self.sync_status_manager.is_synced(post_view.cid, 'bluesky_to_mastodon'):
+            logging.debug(f"Bluesky帖子 {post_view.cid} 已同步，跳过")
+            return None
+
+        return self.convert_bluesky_to_mastodon(post_view)
+
+    def publish_post(self, post_view, mastodon_post, media_ids):
+        """
+        发布转换后的嘟文并标记同步
+        发布前预留帖子，标记后才释放，另一方向在此期间不会把新嘟文当作未同步的嘟文同步回来；请求期间不持有同步状态的锁
+        :return: 是否发布了嘟文，其他线程正在发布该帖子或帖子已同步时返回False
+        """
+        # 预留之前等待另一方向正在发布的帖子，预留之后只查询记录
+        if self.sync_status_manager.is_synced(post_view.cid, 'bluesky_to_mastodon'):
+            logging.debug(f"Bluesky帖子 {post_view.cid} 已同步，跳过")
+            return False
+        with self.sync_status_manager.publishing(post_view.cid, 'bluesky_to_mastodon') as reserved:
+            if not reserved or self.sync_status_manager.is_synced(post_view.cid, 'bluesky_to_mastodon', wait=False):
+                logging.debug(f"Bluesky帖子 {post_view.cid} 已同步或正在同步，跳过")
+                return False
+            with metrics.post_seconds.time(platform='mastodon'):
+                response = self.mastodon.status_post(mastodon_post, media_ids=media_ids)
+            self.sync_status_manager.mark_as_synced(post_view.cid, response['id'], 'bluesky_to_mastodon',
+                                                    meta={'origin': 'bluesky', 'uri': post_view.uri})
+        # Mastodon的媒体附加到嘟文后不能再复用
+        for url, _ in self.media_sources(post_view):
+            self.media_cache.mark_attached('mastodon', url)
+        logging.debug(f"成功将Bluesky帖子 {post_view.cid} 同步到Mastodon")
+        return True
+
+    def media_sources(self, bluesky_post):
+        """
+        帖子中要同步到Mastodon的媒体：图片、视频、GIF链接卡片，以及带媒体引用中的媒体部分
+        :return: [(媒体URL, 描述)] 列表
+        """
+        embed = bluesky_post.embed
+        embed_type = getattr(embed, 'py_type', None)
+        if embed_type == 'app.bsky.embed.recordWithMedia#view':
+            embed = embed.media
+            embed_type = getattr(embed, 'py_type', None)
+        if embed_type == 'app.bsky.embed.images#view':
+            return [(image.fullsize, image.alt or '') for image in embed.images]
+        if embed_type == 'app.bsky.embed.video#view':
+            # 视频的 playlist 是HLS分片，直接从PDS下载原始的blob
+            query = urlencode({'did': bluesky_post.author.did, 'cid': embed.cid})
+            return [(f"{self.bluesky._build_url('com.atproto.sync.getBlob')}?{query}", embed.alt or '')]
+        if embed_type == 'app.bsky.embed.external#view' and gif_link(embed.external.uri):
+            return [(embed.external.uri, embed.external.description or embed.external.title or '')]
+        return []
+
+    def embed_links(self, bluesky_post, text):
+        # 链接卡片和被引用的帖子在Mastodon上以链接的形式附在正文后面
+        links = []
+        embed = bluesky_post.embed
+        embed_type = getattr(embed, 'py_type', None)
+        if embed_type == 'app.bsky.embed.external#view' and not gif_link(embed.external.uri):
+            links.append(embed.external.uri)
+        elif embed_type == 'app.bsky.embed.recordWithMedia#view':
+            record = getattr(embed.record, 'record', None)
+            uri = getattr(record, 'uri', None) or ''
+            if '/app.bsky.feed.post/' in uri:
+                # 没有作者信息（例如来自Jetstream的事件）时使用 uri 中的DID
+                author = getattr(record, 'author', None)
+                actor = author.handle if author is not None else uri[len('at://'):].split('/', 1)[0]
+                links.append(f"https://bsky.app/profile/{actor}/post/{uri.rsplit('/', 1)[-1]}")
+        return [link for link in links if link not in text]
 
     def convert_bluesky_to_mastodon(self, bluesky_post):
         # 将Bluesky帖子转换为Mastodon格式
-        from_bluesky_at = os.environ.get('FROM_BLUESKY_AT', '')
+        from_bluesky_at = self.from_bluesky_at
 
+        text = bluesky_post.record.text
+        links = self.embed_links(bluesky_post, text)
+        if links:
+            text = text + '\n\n' + '\n'.join(links)
         if from_bluesky_at:
-            text = bluesky_post.record.text + '\n\nfrom bluesky ' + from_bluesky_at
-        else:
-            text = bluesky_post.record.text
+            text = text + '\n\nfrom bluesky ' + from_bluesky_at
         
         media_ids = []
 
-        # 处理帖子中的图片
-        if hasattr(bluesky_post.embed, 'images'):
-            logging.info(f"Bluesky帖子 {bluesky_post.cid} 包含图片，尝试上传")
-            for image in bluesky_post.embed.images:
-                image_url = image.fullsize
-                alt_text = image.alt or ''
-                logging.info(f"正在从URL上传图片: {image_url}")
-                media_id = self.upload_image_to_mastodon(image_url, alt_text)
-                if media_id:
-                    media_ids.append(media_id)
-                    logging.info(f"成功上传图片到Mastodon，media_id: {media_id}")
-                else:
-                    logging.warning(f"从URL上传图片失败: {image_url}")
+        # 处理帖子中的图片、视频和GIF
+        sources = self.media_sources(bluesky_post)
+        if sources:
+            logging.debug(f"Bluesky帖子 {bluesky_post.cid} 包含 {len(sources)} 个媒体，尝试上传")
+            # 并行上传所有媒体，结果保持原始顺序
+            uploaded = self.media_pipeline.map(lambda source: self.upload_media_to_mastodon(*source), sources)
+            processing = []
+            for (url, _), result in zip(sources, uploaded):
+                if not result:
+                    # 不发布缺少媒体的嘟文，已上传的媒体保存在媒体缓存中，重试时复用
+                    raise MediaUploadError(f"从URL上传媒体失败: {url}")
+                media_id, ready = result
+                media_ids.append(media_id)
+                if not ready:
+                    processing.append(media_id)
+                logging.debug(f"成功上传媒体到Mastodon，media_id: {media_id}")
+            # 视频和较大的图片由Mastodon异步处理，处理完成后才能附加到嘟文
+            self.wait_for_mastodon_media(processing)
 
-        logging.info(f"已将Bluesky帖子转换为Mastodon帖子。文本: {text[:100]}..., 媒体ID: {media_ids}")
+        logging.debug(f"已将Bluesky帖子转换为Mastodon帖子。文本: {text[:100]}..., 媒体ID: {media_ids}")
         return text, media_ids
 
-    def upload_image_to_mastodon(self, image_url, alt_text=''):
-        # 上传图片到Mastodon
+    def upload_media_to_mastodon(self, media_url, alt_text=''):
+        """
+        流式下载媒体并上传到Mastodon，按文件内容识别类型，只在超过Mastodon的大小上限时转码
+        :return: (media_id, 是否已处理完成)，失败时返回None；复用的媒体按未处理完成对待
+        """
+        fetched = None
+        transcoded = None
         try:
-            response = requests.get(image_url)
-            if response.status_code == 200:
-                image_data = response.content
-                media = self.mastodon.media_post(image_data, mime_type='image/jpeg', description=alt_text)
-                logging.info(f"成功上传图片到Mastodon，media_id: {media['id']}")
-                return media['id']
-            else:
-                logging.error(f"从Bluesky下载图片失败，状态码: {response.status_code}")
+            # 同一内容、同一描述的媒体已上传且尚未附加到嘟文时直接复用（例如上一轮发嘟失败）
+            content_hash = self.media_cache.lookup_url(media_url)
+            if content_hash is not None:
+                media_id = self.cached_media_id(content_hash, alt_text)
+                if media_id is not None:
+                    return media_id, False
+
+            fetched = self.media_fetcher.fetch_to_file(media_url, max_bytes=MEDIA_MAX_VIDEO_DOWNLOAD_MB * 1024 * 1024)
+            if fetched is None:
+                logging.error(f"从Bluesky下载媒体失败: {media_url}")
                 return None
+            content_hash = fetched.content_hash
+            self.media_cache.remember_url(media_url, content_hash)
+            media_id = self.cached_media_id(content_hash, alt_text)
+            if media_id is not None:
+                return media_id, False
+
+            mime_type = sniff_mime(fetched.head) or (fetched.content_type or '').split(';', 1)[0] or 'application/octet-stream'
+            kind = media_kind(mime_type)
+            path, size = fetched.path, fetched.size
+            max_mb = MASTODON_IMAGE_MAX_MB if kind == 'image' else MASTODON_VIDEO_MAX_MB
+            if size > max_mb * 1024 * 1024:
+                if kind not in ('video', 'gif'):
+                    logging.error(f"媒体超过Mastodon的大小上限: {size} 字节")
+                    return None
+                with metrics.transcode_seconds.time(platform='mastodon'):
+                    transcoded = transcode_video(path, max_mb * 1024 * 1024)
+                path, size, mime_type = transcoded, os.path.getsize(transcoded), 'video/mp4'
+
+            logging.debug(f"正在从URL上传媒体（{mime_type}, {size} 字节）: {media_url}")
+            with self.media_pipeline.reserve(size), metrics.upload_seconds.time(platform='mastodon'), open(path, 'rb') as f:
+                media = self.mastodon.media_post(f, mime_type=mime_type, description=alt_text,
+                                                 file_name=f'{content_hash[:16]}.{file_extension(mime_type)}')
+            metrics.uploaded_bytes_total.inc(size, platform='mastodon')
+            logging.debug(f"成功上传媒体到Mastodon，media_id: {media['id']}")
+            self.media_cache.put_remote('mastodon', content_hash, {'id': str(media['id']), 'description': alt_text})
+            # v2 接口异步处理媒体，处理完成前 url 为空
+            return media['id'], media.get('url') is not None
         except Exception as e:
-            logging.error(f"上传图片到Mastodon时出错: {str(e)}")
+            logging.error(f"上传媒体到Mastodon时出错: {str(e)}")
             logging.exception("异常详情:")
             return None
+        finally:
+            if fetched is not None:
+                fetched.close()
+            if transcoded is not None:
+                os.remove(transcoded)
+
+    def wait_for_mastodon_media(self, media_ids, timeout=None):
+        """
+        等待Mastodon处理完上传的媒体（url 不为空）；轮询间隔从 MEDIA_POLL_INITIAL_DELAY 开始加倍
+        :param timeout: 最长等待时间（秒），超时抛出 MediaUploadError，帖子进入重试队列，已上传的媒体在重试时复用
+        """
+        timeout = MASTODON_MEDIA_PROCESSING_TIMEOUT if timeout is None else timeout
+        pending = list(media_ids)
+        deadline = time.monotonic() + timeout
+        delay = MEDIA_POLL_INITIAL_DELAY
+        while pending:
+            pending = [media_id for media_id in pending if self.mastodon.media(media_id).get('url') is None]
+            if not pending:
+                break
+            if time.monotonic() + delay > deadline:
+                raise MediaUploadError(f"Mastodon媒体处理超时: {pending}")
+            logging.debug(f"等待Mastodon处理媒体: {pending}")
+            time.sleep(delay)
+            delay = min(delay * 2, MEDIA_POLL_MAX_DELAY)
+
+    def cached_media_id(self, content_hash, alt_text):
+        ref = self.media_cache.get_remote('mastodon', content_hash)
+        if ref is None or ref.get('description') != alt_text:
+            return None
+        logging.debug(f"复用已上传但未附加的Mastodon媒体: {ref['id']}")
+        return ref['id']
@@ -0,0 +1,203 @@
+import re
+from html import unescape
+
+# 一次扫描即可把HTML切分为交替的文本和标签（奇数位置是标签）
+TAG_SPLIT_RE = re.compile(r'(<(?:!--.*?--|/?[a-zA-Z][^>]*)>)', re.S)
+TAG_NAME_RE = re.compile(r'</?([a-zA-Z][a-zA-Z0-9]*)')
+ATTR_RE = re.compile(r'([a-zA-Z_:][-a-zA-Z0-9_:.]*)(?:\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s"\'>]+)))?')
+
+# 块级标签之间空一行，与Mastodon网页上的显示一致
+BLOCK_TAGS = {'p', 'blockquote', 'pre', 'ul', 'ol', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+# 转换时需要处理的标签种类，其他标签只保留其中的文本
+TAG_OTHER, TAG_BLOCK, TAG_BR, TAG_SPAN, TAG_A, TAG_LI = range(6)
+TAG_KINDS = dict.fromkeys(BLOCK_TAGS, TAG_BLOCK)
+TAG_KINDS.update(br=TAG_BR, span=TAG_SPAN, a=TAG_A, li=TAG_LI)
+# 缓存的标签数上限，超过后清空重新缓存
+TAG_CACHE_SIZE = 4096
+
+LINK_FACET = 'app.bsky.richtext.facet#link'
+TAG_FACET = 'app.bsky.richtext.facet#tag'
+
+
+def parse_attrs(tag):
+    # 只有 a 和 span 标签需要属性，值中的实体同样需要解码
+    attrs = {}
+    for match in ATTR_RE.finditer(tag, tag.find(' ') + 1 or len(tag)):
+        value = match.group(2)
+        if value is None:
+            value = match.group(3) if match.group(3) is not None else (match.group(4) or '')
+        attrs[match.group(1).lower()] = unescape(value) if '&' in value else value
+    return attrs
+
+
+# 解析过的标签，Mastodon生成的标签大量重复（<p>、<span class="invisible"> 等），按原始字符串缓存；
+# 转换时直接查字典，比每个标签调用一次 lru_cache 包装的函数快
+_tag_cache = {}
+
+
+def tag_info(token):
+    """
+    解析一个标签，结果按原始字符串缓存
+    :return: (标签种类, 是否是结束标签, 类型, href)；span 的类型为 invisible/ellipsis/空，a 的类型为 hashtag/mention/link
+    """
+    info = _tag_cache.get(token)
+    if info is None:
+        if len(_tag_cache) >= TAG_CACHE_SIZE:
+            _tag_cache.clear()
+        info = _tag_cache[token] = parse_tag(token)
+    return info
+
+
+def parse_tag(token):
+    if token.startswith('<!--'):
+        return TAG_OTHER, False, '', ''
+    closing = token[1] == '/'
+    name = TAG_NAME_RE.match(token).group(1).lower()
+    kind = ''
+    href = ''
+    if closing:
+        return TAG_KINDS.get(name, TAG_OTHER), closing, kind, href
+    if name == 'span':
+        if token.endswith('/>'):
+            # 自闭合的 span 不会有对应的结束标签
+            name = ''
+        else:
+            classes = parse_attrs(token).get('class', '').split()
+            kind = 'invisible' if 'invisible' in classes else 'ellipsis' if 'ellipsis' in classes else ''
+    elif name == 'a':
+        attrs = parse_attrs(token)
+        classes = attrs.get('class', '').split()
+        if 'hashtag' in classes or 'tag' in attrs.get('rel', '').split():
+            kind = 'hashtag'
+        elif 'mention' in classes:
+            kind = 'mention'
+        else:
+            kind = 'link'
+        href = attrs.get('href', '')
+    return TAG_KINDS.get(name, TAG_OTHER), closing, kind, href
+
+
+def decode_entities(text):
+    # 先用 str.replace 解码Mastodon常用的几种实体，只有还剩其他实体时才交给逐个回调的 html.unescape；&amp; 最后解码，避免产生新的实体
+    # &nbsp; 与旧版一样换成普通空格，同步到Bluesky的文本照常换行和搜索
+    text = text.replace('&lt;', '<').replace('&gt;', '>').replace('&quot;', '"').replace('&#39;', "'").replace('&nbsp;', ' ')
+    if text.count('&') != text.count('&amp;'):
+        return unescape(text)
+    return text.replace('&amp;', '&')
+
+
+def make_facet(start, end, feature):
+    return {'index': {'byteStart': start, 'byteEnd': end}, 'features': [feature]}
+
+
+def html_to_text(content):
+    """
+    把Mastodon嘟文的HTML转换为纯文本和Bluesky富文本facets，只扫描一遍
+    - <br> 换行，段落、引用、列表等块级标签之间空一行，列表项前加 "- "
+    - 解码所有HTML实体（命名实体和数字实体）
+    - 链接显示为Mastodon缩短后的文本（隐藏 invisible 部分，ellipsis 部分后加 "…"），并生成指向完整地址的链接facet
+    - 提及生成指向对方主页的链接facet（Bluesky的提及facet需要DID，无法对应Mastodon账户）
+    - 话题标签生成标签facet
+    :param content: 嘟文的HTML
+    :return: (文本, facets列表)，facets的偏移是文本UTF-8编码后的字节位置
+    """
+    # 输出的文本片段；facets先记录在片段列表中的位置，最后再换算为字节位置
+    parts = []
+    # 块级标签结束后的换行延迟到下一段文本之前再写入，避免开头和结尾出现多余的空行；多个连续的只保留最长的一个
+    pending_break = ''
+    facets = []
+    # 每层 span 是否是隐藏或省略的部分
+    spans = []
+    hidden = 0
+    # 当前链接的 (类型, href)、第一个文本片段的位置和文本片段
+    link = None
+    link_start = None
+    link_text = None
+
+    # 状态都放在局部变量中，循环里不调用辅助方法，这是转换的热点
+    cached_tag = _tag_cache.get
+    # 切分结果是 文本、标签、文本……、文本，补一个空标签后按（文本, 标签）成对处理
+    tokens = TAG_SPLIT_RE.split(content)
+    tokens.append('')
+    pairs = iter(tokens)
+    for token, tag_token in zip(pairs, pairs):
+        # 文本；块级标签之间和开头的空白不显示
+        if token and not hidden and not ((pending_break or not parts) and token.isspace()):
+            if '&' in token:
+                token = decode_entities(token)
+            if pending_break:
+                if parts:
+                    parts.append(pending_break)
+                pending_break = ''
+            if link is not None:
+                if link_start is None:
+                    link_start = len(parts)
+                link_text.append(token)
+            parts.append(token)
+        if not tag_token:
+            break
+
+        tag, closing, kind, href = cached_tag(tag_token) or tag_info(tag_token)
+        if tag == TAG_BLOCK:
+            if len(pending_break) < 2:
+                pending_break = '\n\n'
+            continue
+        if tag == TAG_BR:
+            # </br> 不换行
+            if closing:
+                continue
+            text = '\n'
+        elif tag == TAG_SPAN:
+            if not closing:
+                if kind == 'invisible':
+                    hidden += 1
+                spans.append(kind)
+                continue
+            if not spans:
+                continue
+            kind = spans.pop()
+            if kind == 'invisible':
+                hidden -= 1
+            if kind != 'ellipsis' or hidden:
+                continue
+            text = '…'
+        elif tag == TAG_A:
+            if not closing:
+                link = (kind, href)
+                link_start = None
+                link_text = []
+            elif link is not None:
+                if link_start is not None and len(parts) > link_start:
+                    if link[0] == 'hashtag':
+                        tag_text = ''.join(link_text).strip().lstrip('#')
+                        if tag_text:
+                            facets.append((link_start, len(parts), {'$type': TAG_FACET, 'tag': tag_text}))
+                    elif link[1].startswith(('http://', 'https://')):
+                        facets.append((link_start, len(parts), {'$type': LINK_FACET, 'uri': link[1]}))
+                link = None
+            continue
+        elif tag == TAG_LI:
+            if closing:
+                continue
+            if not pending_break:
+                pending_break = '\n'
+            text = '- '
+        else:
+            continue
+        # 标签产生的文本（换行、省略号、列表项前缀）
+        if pending_break:
+            if parts:
+                parts.append(pending_break)
+            pending_break = ''
+        parts.append(text)
+
+    text = ''.join(parts)
+    if not facets:
+        return text, facets
+    is_ascii = text.isascii()
+
+    def byte_offset(index):
+        prefix = ''.join(parts[:index])
+        return len(prefix) if is_ascii else len(prefix.encode('utf-8'))
+
+    return text, [make_facet(byte_offset(start), byte_offset(end), feature) for start, end, feature in facets]
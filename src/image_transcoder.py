@@ -0,0 +1,134 @@
+import io
+import os
+import logging
+from PIL import Image, ImageOps
+
+# 转码后图片最长边的像素上限
+IMAGE_MAX_DIMENSION = int(os.environ.get('IMAGE_MAX_DIMENSION', 2000))
+# JPEG 质量的搜索范围
+MAX_QUALITY = 95
+MIN_QUALITY = 20
+# 质量降到最低仍然过大时，每次缩小尺寸后重试的最多次数
+MAX_DOWNSCALE_ATTEMPTS = 3
+# 短边不小于该值时在缩小的代理图上估计质量
+PROXY_MIN_DIMENSION = 512
+# 透明图片的未压缩大小超过上限的该倍数时，不再尝试保留为 PNG
+PNG_MAX_COMPRESSION_RATIO = 8
+
+def has_alpha(img):
+    # 判断图片是否带有透明通道
+    return img.mode in ('RGBA', 'LA', 'PA') or (img.mode == 'P' and 'transparency' in img.info)
+
+def open_image(image_data, max_dimension=IMAGE_MAX_DIMENSION):
+    """
+    打开图片并完成解码前的准备：JPEG 直接按比例缩小解码、按 EXIF 方向旋转、缩放到尺寸上限
+    :param image_data: 原始图片字节
+    :param max_dimension: 最长边的像素上限
+    :return: 已加载的 PIL 图片，不带任何元数据
+    """
+    img = Image.open(io.BytesIO(image_data))
+    if img.format == 'JPEG':
+        # draft 让 JPEG 解码器直接以 1/2、1/4、1/8 的比例解码，超大照片无需完整解码
+        img.draft('RGB', (max_dimension, max_dimension))
+    # 先按 EXIF 方向旋转，之后编码时不写入任何元数据
+    img = ImageOps.exif_transpose(img)
+    if max(img.size) > max_dimension:
+        img.thumbnail((max_dimension, max_dimension), Image.LANCZOS, reducing_gap=3.0)
+    # 只保留调色板透明色，丢弃 EXIF、ICC 等其他元数据
+    img.info = {key: value for key, value in img.info.items() if key == 'transparency'}
+    return img
+
+def flatten(img, background=(255, 255, 255)):
+    # 把透明图片合成到纯色背景上，转换为 JPEG 可用的模式
+    if has_alpha(img):
+        rgba = img.convert('RGBA')
+        canvas = Image.new('RGB', rgba.size, background)
+        canvas.paste(rgba, mask=rgba.getchannel('A'))
+        return canvas
+    if img.mode not in ('RGB', 'L'):
+        return img.convert('RGB')
+    return img
+
+def encode_jpeg(img, quality):
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+def encode_png(img):
+    buffer = io.BytesIO()
+    img.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+def bisect_quality(img, max_bytes, low, high):
+    # 在 [low, high] 范围内二分查找不超过大小上限的最高质量
+    best = None
+    best_quality = low
+    while low <= high:
+        quality = (low + high) // 2
+        data = encode_jpeg(img, quality)
+        if len(data) <= max_bytes:
+            best, best_quality = data, quality
+            low = quality + 1
+        else:
+            high = quality - 1
+    return best, best_quality
+
+def search_quality(img, max_bytes):
+    """
+    查找不超过大小上限的最高 JPEG 质量
+    先在缩小一半的代理图上二分估计质量，再用完整尺寸验证
+    :return: (编码结果, 质量)，最低质量仍然过大时返回 (None, MIN_QUALITY)
+    """
+    data = encode_jpeg(img, MAX_QUALITY)
+    if len(data) <= max_bytes:
+        return data, MAX_QUALITY
+
+    if min(img.size) >= PROXY_MIN_DIMENSION:
+        proxy = img.reduce(2)
+        # 用两者在最高质量下的大小比例校准代理图的目标大小
+        proxy_max_bytes = max_bytes * len(encode_jpeg(proxy, MAX_QUALITY)) / len(data)
+        _, estimate = bisect_quality(proxy, proxy_max_bytes, MIN_QUALITY, MAX_QUALITY - 1)
+        data = encode_jpeg(img, estimate)
+        if len(data) <= max_bytes:
+            return data, estimate
+        # 估计略高时只在附近的范围内继续查找
+        data, quality = bisect_quality(img, max_bytes, max(MIN_QUALITY, estimate - 10), estimate - 1)
+        if data is not None:
+            return data, quality
+        return bisect_quality(img, max_bytes, MIN_QUALITY, max(MIN_QUALITY, estimate - 11))
+
+    return bisect_quality(img, max_bytes, MIN_QUALITY, MAX_QUALITY - 1)
+
+def transcode_image(image_data, max_bytes=950 * 1024, max_dimension=IMAGE_MAX_DIMENSION):
+    """
+    把图片转码为不超过大小上限的图片，同时清除元数据
+    带透明通道的图片优先保留为 PNG，放不下时再合成到白色背景上转为 JPEG
+    :param image_data: 原始图片字节
+    :param max_bytes: 转码结果的字节上限
+    :param max_dimension: 最长边的像素上限
+    :return: 转码后的图片字节
+    """
+    img = open_image(image_data, max_dimension)
+
+    if has_alpha(img) and img.width * img.height * 4 <= max_bytes * PNG_MAX_COMPRESSION_RATIO:
+        data = encode_png(img)
+        if len(data) <= max_bytes:
+            logging.debug(f"转码后的PNG图片大小: {len(data)} 字节, 尺寸: {img.size}")
+            return data
+
+    img = flatten(img)
+    for _ in range(MAX_DOWNSCALE_ATTEMPTS + 1):
+        data, quality = search_quality(img, max_bytes)
+        if data is not None:
+            logging.debug(f"转码后的图片大小: {len(data)} 字节, 质量: {quality}, 尺寸: {img.size}")
+            return data
+        # 最低质量仍然过大，按面积比例缩小后重试
+        smallest = encode_jpeg(img, MIN_QUALITY)
+        scale = max(0.5, min(0.9, (max_bytes / len(smallest)) ** 0.5))
+        new_size = (max(1, int(img.width * scale)), max(1, int(img.height * scale)))
+        logging.debug(f"图片在最低质量下仍然过大 ({len(smallest)} 字节), 缩小至 {new_size}")
+        img = img.resize(new_size, Image.LANCZOS)
+
+    data = encode_jpeg(img, MIN_QUALITY)
+    logging.debug(f"转码后的图片大小: {len(data)} 字节, 质量: {MIN_QUALITY}, 尺寸: {img.size}")
+    return data
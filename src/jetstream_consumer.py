@@ -0,0 +1,380 @@
+import os
+import json
+import time
+import random
+import logging
+import threading
+import metrics
+from collections import deque
+from types import SimpleNamespace
+from urllib.parse import urlencode
+from websockets.sync.client import connect
+
+# Jetstream服务地址（把仓库事件流转换为JSON的官方服务）
+JETSTREAM_URL = os.environ.get('JETSTREAM_URL', 'wss://jetstream2.us-east.bsky.network/subscribe')
+# 只订阅帖子集合
+JETSTREAM_COLLECTION = 'app.bsky.feed.post'
+# 订阅的DID不超过该数量时交给服务器过滤，否则接收全部帖子事件在本地过滤
+JETSTREAM_MAX_WANTED_DIDS = 100
+# 断线后的重连间隔（秒），每次失败翻倍直到上限
+JETSTREAM_RECONNECT_MIN = 1
+JETSTREAM_RECONNECT_MAX = int(os.environ.get('JETSTREAM_RECONNECT_MAX', 300))
+# 游标最多每隔多少秒保存一次
+JETSTREAM_CURSOR_SAVE_INTERVAL = 5
+# 原图的CDN地址，与getAuthorFeed返回的 fullsize 一致
+BLUESKY_CDN_IMAGE_URL = 'https://cdn.bsky.app/img/feed_fullsize/plain/{did}/{cid}@jpeg'
+
+DID_PREFIX = '{"did":"'
+
+
+def event_did(message):
+    """
+    不解析JSON，直接从原始消息中取出事件所属的DID
+    Jetstream的消息总是以 {"did":"...", 开头，其他格式时退回到查找字段
+    """
+    if message.startswith(DID_PREFIX):
+        start = len(DID_PREFIX)
+    else:
+        start = message.find('"did":"')
+        if start < 0:
+            return None
+        start += len('"did":"')
+    end = message.find('"', start)
+    return message[start:end] if end > 0 else None
+
+
+def event_time_us(message):
+    # 不解析JSON，直接取出事件的 time_us，用作游标
+    start = message.find('"time_us":')
+    if start < 0:
+        return None
+    start += len('"time_us":')
+    end = message.find(',', start)
+    try:
+        return int(message[start:end if end > 0 else message.find('}', start)])
+    except ValueError:
+        return None
+
+
+def embed_view(did, media):
+    """
+    把帖子记录中的图片、视频或链接卡片转换为与帖子视图（#view）相同结构的对象
+    :return: 对象，没有可同步的媒体或链接时返回None
+    """
+    def blob_cid(blob):
+        # 旧版blob格式直接带 cid 字段
+        return ((blob or {}).get('ref') or {}).get('$link') or (blob or {}).get('cid')
+
+    media_type = media.get('$type')
+    if media_type == 'app.bsky.embed.images':
+        images = [SimpleNamespace(fullsize=BLUESKY_CDN_IMAGE_URL.format(did=did, cid=blob_cid(image.get('image'))),
+                                  alt=image.get('alt') or '')
+                  for image in media.get('images') or [] if blob_cid(image.get('image'))]
+        return SimpleNamespace(py_type='app.bsky.embed.images#view', images=images) if images else None
+    if media_type == 'app.bsky.embed.video' and blob_cid(media.get('video')):
+        return SimpleNamespace(py_type='app.bsky.embed.video#view', cid=blob_cid(media.get('video')), alt=media.get('alt') or '')
+    if media_type == 'app.bsky.embed.external':
+        external = media.get('external') or {}
+        return SimpleNamespace(py_type='app.bsky.embed.external#view', external=SimpleNamespace(
+            uri=external.get('uri', ''), title=external.get('title') or '', description=external.get('description') or ''))
+    return None
+
+
+def feed_item_from_event(event):
+    """
+    把Jetstream的帖子创建事件转换为与作者动态条目相同结构的对象，供现有的同步流程使用
+    :param event: 解析后的事件
+    :return: 带 post（cid、uri、record、embed、indexed_at）和 reason 的对象
+    """
+    did = event['did']
+    commit = event['commit']
+    record = commit['record']
+    embed = record.get('embed') or {}
+
+    # 与作者动态一样，纯引用帖子通过 record.embed 的类型识别，带媒体的引用同步其中的媒体
+    embed_type = embed.get('$type')
+    quoted = embed.get('record') if embed_type in ('app.bsky.embed.record', 'app.bsky.embed.recordWithMedia') else None
+    media_view = embed_view(did, (embed.get('media') or {}) if embed_type == 'app.bsky.embed.recordWithMedia' else embed)
+    if embed_type == 'app.bsky.embed.recordWithMedia':
+        quoted_uri = (quoted or {}).get('record', {}).get('uri', '')
+        view = SimpleNamespace(py_type='app.bsky.embed.recordWithMedia#view', media=media_view,
+                               record=SimpleNamespace(record=SimpleNamespace(uri=quoted_uri, author=None)))
+    else:
+        view = media_view
+
+    post_view = SimpleNamespace(
+        uri=f"at://{did}/{commit['collection']}/{commit['rkey']}",
+        cid=commit['cid'],
+        record=SimpleNamespace(
+            text=record.get('text') or '',
+            created_at=record.get('createdAt'),
+            embed=SimpleNamespace(py_type=embed_type, record=quoted) if embed_type else None,
+        ),
+        embed=view,
+        author=SimpleNamespace(did=did),
+        indexed_at=record.get('createdAt'),
+    )
+    return SimpleNamespace(post=post_view, reason=None)
+
+
+class AccountQueue:
+    def __init__(self, executor=None):
+        """
+        把同一账户的事件按到达顺序交给线程池处理：同一账户同一时刻只有一个任务在执行，不同账户之间并行，
+        接收事件的线程只负责过滤和分发，不等待同步的网络请求
+        :param executor: 执行任务的线程池，为None时在调用线程中直接执行
+        """
+        self.executor = executor
+        self.tasks = deque()
+        self.running = False
+        self.closed = False
+        self._idle = threading.Condition()
+
+    def submit(self, fn, *args):
+        if self.executor is None:
+            fn(*args)
+            return
+        with self._idle:
+            if self.closed:
+                return
+            self.tasks.append((fn, args))
+            if self.running:
+                return
+            self.running = True
+        try:
+            self.executor.submit(self.drain)
+        except RuntimeError as e:
+            # 线程池已关闭，丢弃的帖子由下次启动时的增量轮询补上
+            logging.warning(f"无法分发Jetstream事件: {str(e)}")
+            with self._idle:
+                self.tasks.clear()
+                self.running = False
+                self._idle.notify_all()
+
+    def drain(self):
+        while True:
+            with self._idle:
+                if not self.tasks:
+                    self.running = False
+                    self._idle.notify_all()
+                    return
+                fn, args = self.tasks.popleft()
+            try:
+                fn(*args)
+            except Exception as e:
+                logging.error(f"处理Jetstream事件时出错: {str(e)}")
+                logging.exception("异常详情:")
+
+    def close(self):
+        # 丢弃尚未开始的任务，等待正在执行的任务完成
+        with self._idle:
+            self.closed = True
+            self.tasks.clear()
+            while self.running:
+                self._idle.wait()
+
+
+class JetstreamConsumer:
+    def __init__(self, cursor_store, url=None):
+        """
+        订阅Jetstream事件流，把订阅账户新发布的帖子交给对应的同步器，代替定时轮询作者动态
+        消息先按DID在原始字符串上过滤，只有订阅账户的事件才会解析JSON，单核即可跟上全网的事件速率
+        :param cursor_store: 保存事件游标（time_us）的存储，重连或重启后从游标处继续
+        :param url: Jetstream服务地址，默认使用 JETSTREAM_URL
+        """
+        self.cursor_store = cursor_store
+        self.url = url or JETSTREAM_URL
+        self.subscribers = {}
+        # DID -> AccountQueue，订阅账户的事件在各自的队列中按顺序处理
+        self.queues = {}
+        # DID -> PostReconciler，处理帖子的修改和删除事件
+        self.reconcilers = {}
+        # 新订阅的账户在接收事件前先增量轮询一次，补上订阅之前的帖子
+        self.pending_polls = set()
+        self.new_posts = {}
+        self.closed = threading.Event()
+        self.reconnect = False
+        self.thread = None
+        self.connected = False
+        self.cursor = cursor_store.get('jetstream_time_us')
+        # 最近一条已处理的消息，保存游标时才从中取出 time_us
+        self._last_message = None
+        self._saved_at = 0
+        self._lock = threading.Lock()
+
+    def subscribe(self, did, syncer, reconciler=None, executor=None):
+        """
+        订阅一个账户的帖子
+        :param did: 账户的DID
+        :param syncer: 该账户的 BlueskyToMastodonSyncer
+        :param reconciler: 该账户的 PostReconciler，为None时忽略修改和删除事件
+        :param executor: 处理该账户事件的线程池，为None时在接收事件的线程中直接处理
+        """
+        with self._lock:
+            is_new = did not in self.subscribers
+            self.subscribers[did] = syncer
+            if is_new:
+                self.queues[did] = AccountQueue(executor)
+            if reconciler is not None:
+                self.reconcilers[did] = reconciler
+            self.new_posts.setdefault(did, 0)
+            if is_new:
+                self.pending_polls.add(did)
+                # 订阅列表变化后重新连接，让服务器端过滤包含新账户
+                self.reconnect = True
+
+    def unsubscribe(self, did):
+        # 返回前等待该账户正在处理的事件完成，之后可以安全地关闭它的同步状态
+        with self._lock:
+            self.subscribers.pop(did, None)
+            account_queue = self.queues.pop(did, None)
+            self.reconcilers.pop(did, None)
+            self.pending_polls.discard(did)
+            self.new_posts.pop(did, None)
+        if account_queue is not None:
+            account_queue.close()
+
+    def pop_new_posts(self, did):
+        # 上次调用以来该账户的新帖子数，供调度器参考
+        with self._lock:
+            count = self.new_posts.get(did, 0)
+            if did in self.new_posts:
+                self.new_posts[did] = 0
+        return count
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='jetstream', daemon=True)
+            self.thread.start()
+
+    def close(self):
+        self.closed.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+        self.save_cursor(force=True)
+
+    def subscription_url(self):
+        params = [('wantedCollections', JETSTREAM_COLLECTION)]
+        dids = sorted(self.subscribers)
+        if len(dids) <= JETSTREAM_MAX_WANTED_DIDS:
+            params.extend(('wantedDids', did) for did in dids)
+        if self.cursor is not None:
+            params.append(('cursor', str(self.cursor)))
+        return f'{self.url}?{urlencode(params)}'
+
+    def run(self):
+        delay = JETSTREAM_RECONNECT_MIN
+        while not self.closed.is_set():
+            started = time.monotonic()
+            try:
+                self.poll_pending()
+                with self._lock:
+                    self.reconnect = False
+                    url = self.subscription_url()
+                with connect(url, max_size=None, open_timeout=30) as websocket:
+                    logging.info("已连接Jetstream事件流")
+                    self.connected = True
+                    self.receive(websocket)
+            except Exception as e:
+                logging.warning(f"Jetstream连接中断: {str(e)}")
+            self.connected = False
+            self.save_cursor(force=True)
+            if self.closed.is_set():
+                break
+
+            if self.reconnect or time.monotonic() - started >= 60:
+                delay = JETSTREAM_RECONNECT_MIN
+            wait = delay * random.uniform(0.5, 1.0)
+            logging.info(f"{wait:.1f} 秒后重新连接Jetstream")
+            self.closed.wait(wait)
+            delay = min(delay * 2, JETSTREAM_RECONNECT_MAX)
+
+    def poll_pending(self):
+        # 首次连接时从当前时间开始接收事件，再用增量轮询补上之前的帖子，两者之间不留空档
+        if self.cursor is None:
+            self.cursor = int(time.time() * 1000000)
+        with self._lock:
+            pending = [(did, self.subscribers[did]) for did in self.pending_polls if did in self.subscribers]
+            self.pending_polls.clear()
+        for did, syncer in pending:
+            stats = syncer.sync()
+            metrics.record_sync_stats('bluesky_to_mastodon', stats)
+            with self._lock:
+                if did in self.new_posts:
+                    self.new_posts[did] += stats['fetched']
+
+    def receive(self, websocket):
+        while not self.closed.is_set():
+            if self.reconnect:
+                break
+            try:
+                message = websocket.recv(timeout=1)
+            except TimeoutError:
+                continue
+            self.handle_message(message)
+
+    def handle_message(self, message):
+        """
+        处理一条原始消息
+        :return: 是否是订阅账户的帖子事件（创建、修改或删除）
+        """
+        if isinstance(message, bytes):
+            message = message.decode('utf-8')
+        handled = False
+        did = event_did(message)
+        syncer = self.subscribers.get(did)
+        account_queue = self.queues.get(did)
+        if syncer is not None and account_queue is not None:
+            event = json.loads(message)
+            commit = event.get('commit')
+            if event.get('kind') == 'commit' and commit and commit.get('collection') == JETSTREAM_COLLECTION:
+                handled = True
+                if commit.get('operation') == 'create':
+                    self.handle_post(event, syncer, account_queue)
+                elif event['did'] in self.reconcilers:
+                    account_queue.submit(self.handle_change, event, self.reconcilers[event['did']])
+
+        self._last_message = message
+        self.save_cursor()
+        return handled
+
+    def handle_post(self, event, syncer, account_queue):
+        # 与作者动态的 posts_no_replies 一致，不同步回复
+        if event['commit']['record'].get('reply'):
+            return
+        with self._lock:
+            if event['did'] in self.new_posts:
+                self.new_posts[event['did']] += 1
+        account_queue.submit(self.sync_post, event, syncer)
+
+    def sync_post(self, event, syncer):
+        # 失败的帖子进入同步器的重试队列，游标照常推进
+        stats = {'synced': 0, 'skipped': 0, 'failed': 0, 'deferred': 0}
+        syncer.sync_or_defer(feed_item_from_event(event), stats)
+        metrics.record_sync_stats('bluesky_to_mastodon', stats)
+
+    def handle_change(self, event, reconciler):
+        # 帖子的修改和删除；失败时由定期的编辑和删除检查兜底
+        commit = event['commit']
+        uri = f"at://{event['did']}/{commit['collection']}/{commit['rkey']}"
+        try:
+            if commit.get('operation') == 'update':
+                reconciler.apply_bluesky_edit(feed_item_from_event(event).post)
+            elif commit.get('operation') == 'delete':
+                reconciler.apply_bluesky_delete(uri)
+        except Exception as e:
+            logging.error(f"同步Jetstream推送的Bluesky帖子{'修改' if commit.get('operation') == 'update' else '删除'}事件 {uri} 时出错: {str(e)}")
+            logging.exception("异常详情:")
+
+    def save_cursor(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._saved_at < JETSTREAM_CURSOR_SAVE_INTERVAL:
+            return
+        if self._last_message is not None:
+            time_us = event_time_us(self._last_message)
+            if time_us is not None:
+                self.cursor = time_us
+            self._last_message = None
+        if self.cursor is not None:
+            self.cursor_store.set('jetstream_time_us', self.cursor)
+        self._saved_at = now
@@ -1,28 +1,73 @@
+from dotenv import load_dotenv
+load_dotenv()  # 加载环境变量
+
 import time
 import logging
 import os
+import metrics
 from sync_tool import SyncTool
+from adaptive_scheduler import AdaptivePollScheduler
 
-# 配置日志
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# 配置日志，LOG_LEVEL=DEBUG 时输出逐条帖子的处理详情
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(), format='%(asctime)s - %(levelname)s - %(message)s')
 
-# 从环境变量获取睡眠间隔，默认为300秒（5分钟）
+# 从环境变量获取睡眠间隔，默认为300秒（5分钟），作为自适应调度的初始间隔
 SLEEP_INTERVAL = int(os.environ.get('SYNC_INTERVAL', 300))
 
-def run_sync():
+def create_sync_tool():
+    # 客户端、会话和同步状态只在启动时（或上一轮出现严重错误后）构建一次
     try:
+        start = time.monotonic()
         sync_tool = SyncTool()
-        sync_tool.run()
-        logging.info("同步执行成功")
+        logging.info(f"同步工具初始化完成，耗时 {time.monotonic() - start:.2f} 秒")
+        return sync_tool
+    except Exception as e:
+        logging.error(f"同步工具初始化失败: {str(e)}")
+        return None
+
+def run_sync(sync_tool):
+    # 返回本轮获取到的新帖子数，失败时返回None
+    start = time.monotonic()
+    try:
+        new_posts = sync_tool.run()
+        logging.info(f"同步执行成功，本轮耗时 {time.monotonic() - start:.2f} 秒")
+        return new_posts
     except Exception as e:
-        logging.error(f"同步执行失败: {str(e)}")
+        logging.error(f"同步执行失败: {str(e)}，本轮耗时 {time.monotonic() - start:.2f} 秒")
+        return None
 
 def main():
+    # 设置了 METRICS_PORT 时在后台提供 /metrics
+    metrics.registry.start_http_server()
+
+    # 设置了多账户配置文件时，在同一进程中同步配置里的所有账户
+    accounts_config = os.environ.get('ACCOUNTS_CONFIG', '')
+    if accounts_config:
+        from multi_account import MultiAccountRunner
+        MultiAccountRunner(accounts_config, SLEEP_INTERVAL).run_forever()
+        return
+
+    scheduler = AdaptivePollScheduler(base_interval=SLEEP_INTERVAL)
+    sync_tool = None
     while True:
         logging.info("开始执行同步")
-        run_sync()
-        logging.info(f"同步完成，等待 {SLEEP_INTERVAL} 秒后再次执行")
-        time.sleep(SLEEP_INTERVAL)
+        new_posts = 0
+        rate_limits = None
+        if sync_tool is None:
+            sync_tool = create_sync_tool()
+        if sync_tool is not None:
+            new_posts = run_sync(sync_tool)
+            if new_posts is None:
+                # 出现未处理的错误时丢弃常驻的同步工具，下一轮重新构建
+                sync_tool.close()
+                sync_tool = None
+                new_posts = 0
+            else:
+                rate_limits = sync_tool.rate_limit_status()
+        metrics.registry.dump_json()
+        interval = scheduler.next_interval(new_posts, rate_limits)
+        logging.info(f"同步完成，等待 {interval:.0f} 秒后再次执行")
+        time.sleep(interval)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,204 @@
+import os
+import time
+import queue
+import random
+import logging
+import threading
+import metrics
+from mastodon import StreamListener
+
+# 流式连接断开后的重连间隔（秒），每次失败翻倍直到上限
+MASTODON_STREAM_RECONNECT_MIN = 1
+MASTODON_STREAM_RECONNECT_MAX = int(os.environ.get('MASTODON_STREAM_RECONNECT_MAX', 300))
+# 连接保持超过该时长（秒）才视为稳定，重连间隔回到最小值
+MASTODON_STREAM_STABLE_SECONDS = 60
+# 读取超时（秒），服务器大约每15秒发送一次心跳，超时说明连接已经失效
+MASTODON_STREAM_READ_TIMEOUT = int(os.environ.get('MASTODON_STREAM_READ_TIMEOUT', 60))
+# 等待连接建立（收到第一条心跳）的最长时间（秒）
+MASTODON_STREAM_CONNECT_TIMEOUT = 30
+# 增量轮询失败后，隔多久再次轮询（秒）
+MASTODON_STREAM_RETRY_DELAY = 60
+
+
+class OwnStatusListener(StreamListener):
+    def __init__(self, account_id):
+        """
+        用户流的监听器，只收集本账户发布、编辑的嘟文和删除事件，由同步线程按顺序处理
+        :param account_id: 本账户的Mastodon ID
+        """
+        self.account_id = str(account_id)
+        # (事件类型, 嘟文或嘟文ID)，类型为 update、status.update 或 delete
+        self.statuses = queue.Queue()
+        # 收到第一条心跳或事件即说明连接已经建立
+        self.connected = threading.Event()
+        self.stopped = False
+        self.error = None
+
+    def on_update(self, status):
+        self.connected.set()
+        if self.stopped:
+            raise ConnectionAbortedError("流式连接已停止")
+        # 用户流同时推送关注对象的嘟文，只保留自己的
+        if str(status.account.id) == self.account_id:
+            self.statuses.put(('update', status))
+
+    def on_status_update(self, status):
+        self.connected.set()
+        if str(status.account.id) == self.account_id:
+            self.statuses.put(('status.update', status))
+
+    def on_delete(self, status_id):
+        # 删除事件只有嘟文ID，是否是自己的嘟文由同步状态判断
+        self.connected.set()
+        self.statuses.put(('delete', status_id))
+
+    def handle_heartbeat(self):
+        self.connected.set()
+        if self.stopped:
+            raise ConnectionAbortedError("流式连接已停止")
+
+    def on_unknown_event(self, name, unknown_event=None):
+        # 新版本服务器可能推送未知事件，忽略即可
+        pass
+
+    def on_abort(self, err):
+        self.error = err
+
+
+class MastodonStatusStream:
+    def __init__(self, mastodon_client, syncer, cursor_store, reconciler=None):
+        """
+        基于Mastodon用户流式接口的近实时同步：新嘟文推送到达后立即交给同步器发布到Bluesky
+        断线后按指数退避重连，每次（重新）连接后先做一次增量轮询，补上断线期间漏掉的嘟文
+        :param mastodon_client: Mastodon客户端
+        :param syncer: MastodonToBlueskySyncer，复用其转换和发布流程
+        :param cursor_store: 同步游标存储，推送的嘟文同步成功后推进 mastodon_since_id
+        :param reconciler: PostReconciler，推送的编辑和删除事件交给它同步，为None时忽略这些事件
+        """
+        self.mastodon = mastodon_client
+        self.syncer = syncer
+        self.cursor_store = cursor_store
+        self.reconciler = reconciler
+        self.closed = threading.Event()
+        self.thread = None
+        self.connected = False
+        # 补漏轮询失败时不再推进高水位，到期后再次轮询
+        self.retry_at = None
+        self._lock = threading.Lock()
+        self._new_posts = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='mastodon-stream', daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.closed.set()
+        if self.thread is not None:
+            self.thread.join(timeout=5)
+
+    def pop_new_posts(self):
+        # 上次调用以来通过流式接口或补漏轮询获取到的新嘟文数，供调度器参考
+        with self._lock:
+            count, self._new_posts = self._new_posts, 0
+        return count
+
+    def run(self):
+        delay = MASTODON_STREAM_RECONNECT_MIN
+        while not self.closed.is_set():
+            started = time.monotonic()
+            try:
+                account = self.mastodon.account_verify_credentials()
+                listener = OwnStatusListener(account.id)
+                reader = threading.Thread(target=self.read_stream, args=(listener,), name='mastodon-stream-reader', daemon=True)
+                reader.start()
+                # 先建立连接再轮询，轮询期间推送来的嘟文进入队列，不会落在两者之间的空档里
+                connected = self.wait_connected(listener, reader)
+                self.catch_up()
+                if connected:
+                    logging.info("已连接Mastodon流式接口")
+                    self.connected = True
+                    self.consume(listener, reader)
+                listener.stopped = True
+                if listener.error is not None:
+                    logging.warning(f"Mastodon流式连接中断: {str(listener.error)}")
+            except Exception as e:
+                logging.error(f"Mastodon流式同步出错: {str(e)}")
+            self.connected = False
+            if self.closed.is_set():
+                break
+
+            if time.monotonic() - started >= MASTODON_STREAM_STABLE_SECONDS:
+                delay = MASTODON_STREAM_RECONNECT_MIN
+            wait = delay * random.uniform(0.5, 1.0)
+            logging.info(f"{wait:.1f} 秒后重新连接Mastodon流式接口")
+            self.closed.wait(wait)
+            delay = min(delay * 2, MASTODON_STREAM_RECONNECT_MAX)
+
+    def read_stream(self, listener):
+        # 阻塞读取直到连接断开或出错
+        try:
+            self.mastodon.stream_user(listener, timeout=MASTODON_STREAM_READ_TIMEOUT)
+        except Exception as e:
+            if listener.error is None:
+                listener.error = e
+
+    def wait_connected(self, listener, reader):
+        deadline = time.monotonic() + MASTODON_STREAM_CONNECT_TIMEOUT
+        while not self.closed.is_set() and reader.is_alive() and time.monotonic() < deadline:
+            if listener.connected.wait(0.1):
+                return True
+        return listener.connected.is_set() and reader.is_alive()
+
+    def consume(self, listener, reader):
+        while not self.closed.is_set():
+            # 推送持续到达时也要按时重试补漏轮询，否则高水位会一直停在断线前
+            if self.retry_at is not None and time.monotonic() >= self.retry_at:
+                self.catch_up()
+            try:
+                event, payload = listener.statuses.get(timeout=1)
+            except queue.Empty:
+                if not reader.is_alive():
+                    break
+                continue
+            if event == 'update':
+                self.handle_status(payload)
+            elif self.reconciler is not None:
+                self.handle_change(event, payload)
+
+    def handle_change(self, event, payload):
+        # 编辑和删除事件；失败时由定期的编辑和删除检查兜底
+        try:
+            if event == 'status.update':
+                self.reconciler.handle_mastodon_update(payload)
+            else:
+                self.reconciler.handle_mastodon_delete(payload)
+        except Exception as e:
+            logging.error(f"同步推送的Mastodon嘟文{'编辑' if event == 'status.update' else '删除'}事件时出错: {str(e)}")
+            logging.exception("异常详情:")
+
+    def handle_status(self, status):
+        with self._lock:
+            self._new_posts += 1
+        # 失败的嘟文进入同步器的重试队列，与轮询一致，高水位照常推进
+        stats = {'synced': 0, 'skipped': 0, 'failed': 0, 'deferred': 0}
+        self.syncer.sync_or_defer(status, stats)
+        metrics.record_sync_stats('mastodon_to_bluesky', stats)
+        if self.retry_at is None:
+            since_id = self.cursor_store.get('mastodon_since_id')
+            if since_id is None or int(status.id) > int(since_id):
+                self.cursor_store.set('mastodon_since_id', str(status.id))
+
+    def catch_up(self):
+        """
+        从高水位增量轮询，补上断线期间或失败的嘟文；已同步的嘟文由同步状态跳过
+        轮询中断（获取嘟文或批量写入失败）时高水位停在原处，推送的嘟文不再推进它，直到一次轮询完整完成；
+        单条嘟文失败（放入重试队列或移入死信）不影响高水位
+        """
+        stats = self.syncer.sync()
+        metrics.record_sync_stats('mastodon_to_bluesky', stats)
+        with self._lock:
+            self._new_posts += stats['fetched']
+        if not self.syncer.round_complete:
+            self.retry_at = time.monotonic() + MASTODON_STREAM_RETRY_DELAY
+        else:
+            self.retry_at = None
@@ -1,225 +1,608 @@
-from dotenv import load_dotenv
-load_dotenv()  # 加载环境变量
-
 import os
 import json
+import hashlib
 import logging
-import re
-import requests
-from PIL import Image
-import io
-import time
+import metrics
 from atproto import Client
+from sync_cursor_store import SyncCursorStore
+from media_pipeline import MediaPipeline, MediaUploadError
+from image_transcoder import transcode_image
+from media_cache import MediaCache
+from media_fetcher import MediaFetcher
+from html_to_text import html_to_text
+from bluesky_batch_writer import BlueskyBatchWriter, BLUESKY_BATCH_THRESHOLD
+from retry_queue import RetryQueue
+from sync_pipeline import SyncPipeline
+from post_archive import mastodon_record
+from media_types import sniff_mime, media_kind, BLUESKY_IMAGE_MAX_BYTES, BLUESKY_VIDEO_MAX_MB, MEDIA_MAX_VIDEO_DOWNLOAD_MB
+from video_transcoder import transcode_video
+from text_layout import truncate, split_thread
+from atproto_client.models.blob_ref import BlobRef
+from mastodon import MastodonNotFoundError
+
+# 首次运行（没有保存的高水位）时获取的最近嘟文数
+MASTODON_INITIAL_FETCH_LIMIT = 20
+# 增量获取时每页的嘟文数，Mastodon单页上限为40
+MASTODON_PAGE_LIMIT = 40
+
+
+def mastodon_content_hash(status):
+    """
+    嘟文中会同步到Bluesky的内容（正文、附件及其描述）的哈希，记入同步状态，用于检测编辑
+    """
+    content = [status.content, [[str(attachment.id), attachment.description or ''] for attachment in status.media_attachments]]
+    return hashlib.sha256(json.dumps(content, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
 
 class MastodonToBlueskySyncer:
-    def __init__(self, mastodon_client, bluesky_client, sync_status_manager):
+    def __init__(self, mastodon_client, bluesky_client, sync_status_manager, cursor_store=None, media_pipeline=None, media_cache=None, media_fetcher=None, from_mastodon_at=None, split_threads=None, batch_writer=None, batch_threshold=None, retry_queue=None, archive=None, pipeline=None):
         # 初始化同步器，接收Mastodon和Bluesky的客户端以及同步状态管理器
         self.mastodon = mastodon_client
         self.bluesky = bluesky_client
         self.sync_status_manager = sync_status_manager
-        self.toots_file = 'mastodon_toots.json'  # 用于保存Mastodon嘟文的文件
+        # 保存已处理到的最新嘟文ID（since_id），下次只获取更新的嘟文
+        self.cursor_store = cursor_store or SyncCursorStore()
+        # 并行处理同一嘟文的多个附件
+        self.media_pipeline = media_pipeline or MediaPipeline()
+        # 按内容哈希缓存转码结果和已上传的blob
+        self.media_cache = media_cache or MediaCache()
+        # 共享连接池的媒体下载器
+        self.media_fetcher = media_fetcher or MediaFetcher()
+        # 同步后附加的来源说明，默认从环境变量读取
+        self.from_mastodon_at = os.environ.get('FROM_MASTODON_AT', '') if from_mastodon_at is None else from_mastodon_at
+        # 超长嘟文拆分成Bluesky帖子串，而不是截断，默认从环境变量读取
+        if split_threads is None:
+            split_threads = os.environ.get('BLUESKY_THREAD_SPLIT', '').lower() in ('1', 'true', 'yes')
+        self.split_threads = split_threads
+        # 积压的嘟文达到阈值时通过 applyWrites 批量创建帖子
+        self.batch_writer = batch_writer or BlueskyBatchWriter(bluesky_client)
+        self.batch_threshold = BLUESKY_BATCH_THRESHOLD if batch_threshold is None else batch_threshold
+        # 同步失败的嘟文进入持久化的重试队列，按退避时间单独重试，不阻塞高水位
+        self.retry_queue = RetryQueue() if retry_queue is None else retry_queue
+        # 获取到的原帖写入压缩的JSONL归档（PostArchive），为None时不归档
+        self.archive = archive
+        # 后面嘟文的转换和媒体上传与前面嘟文的发布重叠，发布仍按顺序进行
+        self.pipeline = pipeline or SyncPipeline()
+        # 上一轮 sync 是否完整：获取嘟文或批量写入中断时为False，未处理的嘟文要靠下一轮从高水位重新获取
+        self.round_complete = True
+
+    def fetch_new_statuses(self, account):
+        # 获取上次处理之后发布的所有嘟文，按时间从旧到新排列
+        since_id = self.cursor_store.get('mastodon_since_id')
+        if since_id is None:
+            # 首次运行只获取最近的嘟文
+            statuses = self.mastodon.account_statuses(account.id, limit=MASTODON_INITIAL_FETCH_LIMIT)
+            return sorted(statuses, key=lambda status: int(status.id))
+
+        statuses = []
+        min_id = since_id
+        while True:
+            # min_id 返回紧接在该ID之后的一页，沿着它向新的方向翻页直到追上最新
+            page = self.mastodon.account_statuses(account.id, min_id=min_id, limit=MASTODON_PAGE_LIMIT)
+            if not page:
+                break
+            statuses.extend(page)
+            min_id = max(int(status.id) for status in page)
+            if len(page) < MASTODON_PAGE_LIMIT:
+                break
+        return sorted(statuses, key=lambda status: int(status.id))
 
     def sync(self):
+        # 返回本轮的统计：获取、同步、跳过和失败的帖子数
+        stats = {'fetched': 0, 'synced': 0, 'skipped': 0, 'failed': 0, 'deferred': 0}
+        self.round_complete = True
+        self.retry_failed(stats)
         try:
             # 获取Mastodon账户信息
             account = self.mastodon.account_verify_credentials()
-            # 获取最近的10条Mastodon嘟文
-            mastodon_posts = self.mastodon.account_statuses(account.id, limit=20)
-            logging.info(f"从Mastodon用户 {account.username} 获取了 {len(mastodon_posts)} 条嘟文")
-            
-            synced_count = 0
-            skipped_count = 0
-            for post in mastodon_posts:
-                # 记录每条嘟文的基本信息
-                logging.info(f"正在处理Mastodon嘟文 {post.id}:")
-                logging.info(f"  内容: {post.content[:100]}...")
-                logging.info(f"  创建时间: {post.created_at}")
-                logging.info(f"  URL: {post.url}")
-                logging.info(f"  媒体附件数: {len(post.media_attachments)}")
-                
-                # self.save_toot(post)  # 保存嘟文到本地文件
-                
-                # 跳过回复、转发、提及或包含链接的嘟文
-                if post.in_reply_to_id is not None or post.reblog is not None or post.mentions or post.visibility != 'public':
-                    logging.info(f"跳过Mastodon嘟文 {post.id} (回复、转发、提及或非公开){post.in_reply_to_id}/{post.reblog}/{post.mentions}/{post.visibility}")
-                    skipped_count += 1
-                    continue
-                
-                # 如果嘟文未同步，则进行同步
-                if not self.sync_status_manager.is_synced(post.id, 'mastodon_to_bluesky'):
-                    bluesky_post = self.convert_mastodon_to_bluesky(post)
-                    logging.info(f"正在同步Mastodon嘟文 {post.id} 到Bluesky")
-                    logging.info(f"Bluesky帖子内容: {bluesky_post}")
-                    create_response = self.bluesky.com.atproto.repo.create_record({
-                        'repo': self.bluesky.me.did,
-                        'collection': 'app.bsky.feed.post',
-                        'record': bluesky_post
-                    })
-                    logging.info(f"Bluesky创建记录响应: {create_response}")
-                    self.sync_status_manager.mark_as_synced(post.id, create_response.cid, 'mastodon_to_bluesky')
-                    logging.info(f"成功同步Mastodon嘟文 {post.id} 到Bluesky")
-                    synced_count += 1
-                else:
-                    logging.info(f"Mastodon嘟文 {post.id} 已同步，跳过")
-                    skipped_count += 1
+            # 获取上次同步之后的新嘟文
+            with metrics.fetch_seconds.time(direction='mastodon_to_bluesky'):
+                mastodon_posts = self.fetch_new_statuses(account)
+            logging.info(f"从Mastodon用户 {account.username} 获取了 {len(mastodon_posts)} 条新嘟文")
+            stats['fetched'] = len(mastodon_posts)
             
-            logging.info(f"Mastodon同步摘要: 同步了 {synced_count} 条嘟文, 跳过了 {skipped_count} 条嘟文")
+            since_id = self.cursor_store.get('mastodon_since_id')
+            if self.batch_threshold and len(mastodon_posts) >= self.batch_threshold:
+                since_id = self.sync_backlog(mastodon_posts, stats, since_id)
+            else:
+                def publish(post, prepared):
+                    nonlocal since_id
+                    # 失败的嘟文进入重试队列，高水位照常推进
+                    self.publish_or_defer(post, prepared, stats)
+                    since_id = str(post.id)
+
+                self.pipeline.run(mastodon_posts, self.prepare_unless_queued, publish)
+
+            if since_id is not None:
+                self.cursor_store.set('mastodon_since_id', since_id)
+            logging.info(f"Mastodon同步摘要: 同步了 {stats['synced']} 条嘟文, 跳过了 {stats['skipped']} 条嘟文, "
+                         f"失败 {stats['failed']} 条嘟文, 进入重试队列 {stats['deferred']} 条嘟文")
         except Exception as e:
+            # 获取或批量发布中断时高水位不推进，计为一次失败，调用方据此安排重试
+            stats['failed'] += 1
+            self.round_complete = False
             logging.error(f"同步Mastodon到Bluesky时出错: {str(e)}")
             logging.exception("异常详情:")
+        return stats
 
-    def save_toot(self, toot):
-        # 保存Mastodon嘟文到本地JSON文件
+    def sync_or_defer(self, post, stats):
+        """
+        同步单条嘟文，失败时放入重试队列而不是抛出异常
+        :param stats: 统计，原地更新
+        """
+        self.publish_or_defer(post, lambda: self.prepare_unless_queued(post), stats)
+
+    def prepare_unless_queued(self, post):
+        # 已在重试队列中的嘟文按退避时间重试，这里返回 False；不需要同步时返回 None
+        if self.retry_queue.contains('mastodon_to_bluesky', post.id):
+            return False
+        return self.prepare_post(post)
+
+    def publish_or_defer(self, post, prepared, stats):
+        """
+        发布已转换的嘟文，转换或发布失败时放入重试队列而不是抛出异常
+        :param prepared: 返回 prepare_unless_queued 结果的函数，转换失败时抛出异常
+        :param stats: 统计，原地更新
+        """
         try:
-            toots = []
-            if os.path.exists(self.toots_file):
-                with open(self.toots_file, 'r', encoding='utf-8') as f:
-                    toots = json.load(f)
-            
-            toot_data = {
-                'id': toot.id,
-                'created_at': toot.created_at.isoformat(),
-                'content': toot.content,
-                'url': toot.url,
-                'media_attachments': [
-                    {'type': m.type, 'url': m.url} for m in toot.media_attachments
-                ],
-                'language': toot.language,
-            }
-            toots.append(toot_data)
-            
-            with open(self.toots_file, 'w', encoding='utf-8') as f:
-                json.dump(toots, f, ensure_ascii=False, indent=2)
-            
-            logging.info(f"保存了详细的嘟文 {toot.id} 到 {self.toots_file}")
+            bluesky_posts = prepared()
+            if bluesky_posts and self.publish_post(post, bluesky_posts):
+                stats['synced'] += 1
+            else:
+                stats['skipped'] += 1
         except Exception as e:
-            logging.error(f"保存嘟文 {toot.id} 到文件时出错: {str(e)}")
+            logging.error(f"同步Mastodon嘟文 {post.id} 时出错: {str(e)}")
+            logging.exception("异常详情:")
+            stats['deferred' if self.defer(post, e) else 'failed'] += 1
 
-    def compress_image(self, image_data, max_size_kb=950):
-        # 压缩图片，同时清除元数据
-        img = Image.open(io.BytesIO(image_data))
-        
-        # 清除元数据
-        data = list(img.getdata())
-        img_without_exif = Image.new(img.mode, img.size)
-        img_without_exif.putdata(data)
+    def defer(self, post, error):
+        # 把同步失败的嘟文放入重试队列，重试时按ID重新获取，重试次数用尽移入死信时返回None
+        return self.retry_queue.add('mastodon_to_bluesky', post.id, error)
 
-        if img_without_exif.mode != 'RGB':
-            img_without_exif = img_without_exif.convert('RGB')
-        
-        quality = 95
-        while True:
-            buffer = io.BytesIO()
-            img_without_exif.save(buffer, format="JPEG", quality=quality)
-            size = buffer.getbuffer().nbytes
-            if size <= max_size_kb * 1024 or quality <= 20:
-                logging.info(f"压缩后的图片大小: {size} 字节, 质量: {quality}")
-                return buffer.getvalue()
-            quality -= 5
-            logging.info(f"图片仍然过大 ({size} 字节), 降低质量至 {quality}")
+    def retry_failed(self, stats=None):
+        """
+        重试队列中已到时间的嘟文：重新获取嘟文后再次同步，成功或嘟文已删除时移出队列，失败时按退避时间重新排队
+        上一次已上传的图片blob保存在媒体缓存中，重试时直接复用
+        :param stats: 统计，原地更新
+        :return: 统计
+        """
+        stats = stats if stats is not None else {'fetched': 0, 'synced': 0, 'skipped': 0, 'failed': 0, 'deferred': 0}
+        for item in self.retry_queue.take_due('mastodon_to_bluesky'):
+            post_id = item['post_id']
+            logging.info(f"第 {item['attempts'] + 1} 次尝试同步Mastodon嘟文 {post_id}")
+            try:
+                post = self.mastodon.status(post_id)
+            except MastodonNotFoundError:
+                logging.info(f"Mastodon嘟文 {post_id} 已删除，移出重试队列")
+                self.retry_queue.done('mastodon_to_bluesky', post_id)
+                continue
+            except Exception as e:
+                stats['deferred' if self.retry_queue.add('mastodon_to_bluesky', post_id, e) else 'failed'] += 1
+                continue
+            try:
+                if self.sync_post(post):
+                    stats['synced'] += 1
+                else:
+                    stats['skipped'] += 1
+            except Exception as e:
+                logging.error(f"重试同步Mastodon嘟文 {post_id} 时出错: {str(e)}")
+                stats['deferred' if self.retry_queue.add('mastodon_to_bluesky', post_id, e) else 'failed'] += 1
+                continue
+            self.retry_queue.done('mastodon_to_bluesky', post_id)
+        return stats
+
+    def sync_backlog(self, posts, stats, since_id):
+        """
+        补同步积压的嘟文：按创建时间排序后分批通过 applyWrites 创建帖子，每批提交后一次性记录到同步状态
+        拆分成帖子串的嘟文需要前一条的CID作为回复目标，先提交之前的批次，再单独逐条发布
+        单条嘟文转换失败（例如图片上传失败）时放入重试队列并继续；批量写入失败时停止，
+        保证Bluesky上的帖子顺序与嘟文的创建顺序一致，未提交的嘟文下一轮重新获取
+        :param posts: 按ID从旧到新排列的嘟文
+        :param stats: 本轮的统计，原地更新
+        :param since_id: 当前的高水位
+        :return: 推进后的高水位
+        """
+        posts = sorted(posts, key=lambda post: post.created_at)
+        logging.info(f"积压 {len(posts)} 条嘟文，以每批 {self.batch_writer.batch_size} 条批量写入Bluesky")
+        # 已转换、等待提交的 (嘟文, 帖子记录)，跳过或放入重试队列的嘟文记录为 None，提交后高水位才越过它们
+        pending = []
+
+        def advance(current, post):
+            return str(post.id) if current is None or int(post.id) > int(current) else current
+
+        def flush():
+            nonlocal since_id
+            if not pending:
+                return
+            to_create = [(post, record) for post, record in pending if record is not None]
+            if to_create:
+                published = self.publish_batch(to_create)
+                stats['synced'] += published
+                stats['skipped'] += len(to_create) - published
+            for post, _ in pending:
+                since_id = advance(since_id, post)
+            pending.clear()
+
+        def collect(post, prepared):
+            nonlocal since_id
+            try:
+                bluesky_posts = prepared()
+            except Exception as e:
+                logging.error(f"转换Mastodon嘟文 {post.id} 时出错: {str(e)}")
+                logging.exception("异常详情:")
+                stats['deferred' if self.defer(post, e) else 'failed'] += 1
+                pending.append((post, None))
+                return
+            if bluesky_posts and len(bluesky_posts) > 1:
+                flush()
+                stats['synced' if self.publish_post(post, bluesky_posts) else 'skipped'] += 1
+                since_id = advance(since_id, post)
+                return
+            if not bluesky_posts:
+                stats['skipped'] += 1
+            pending.append((post, bluesky_posts[0] if bluesky_posts else None))
+            if sum(1 for _, record in pending if record is not None) >= self.batch_writer.batch_size:
+                flush()
 
-    def download_image(self, image_url):
-        # 从URL下载图片
         try:
-            response = requests.get(image_url)
-            if response.status_code == 200:
-                return response.content
-            else:
-                logging.error(f"下载图片失败，状态码: {response.status_code}")
-                return None
+            # 后面嘟文的转换与前面批次的提交重叠，提交顺序不变
+            self.pipeline.run(posts, self.prepare_unless_queued, collect)
+            flush()
         except Exception as e:
-            logging.error(f"下载图片时出错: {str(e)}")
+            logging.error(f"批量同步Mastodon嘟文时出错: {str(e)}")
+            logging.exception("异常详情:")
+            stats['failed'] += sum(1 for _, record in pending if record is not None) or 1
+            self.round_complete = False
+        return since_id
+
+    def publish_batch(self, entries):
+        """
+        在一次 applyWrites 中发布多条嘟文，并批量记录同步状态
+        发布前预留这些嘟文，请求期间不持有同步状态的锁；其他线程正在发布或已经同步的嘟文不再发布
+        :return: 发布的嘟文数
+        """
+        ledger = self.sync_status_manager
+        # 预留之前等待另一方向正在发布的帖子，持有预留时不再等待，两个方向不会互相等待
+        entries = [(post, record) for post, record in entries if not ledger.is_synced(post.id, 'mastodon_to_bluesky')]
+        reserved = [(post, record) for post, record in entries if ledger.reserve(post.id, 'mastodon_to_bluesky')]
+        try:
+            entries = [(post, record) for post, record in reserved
+                       if not ledger.is_synced(post.id, 'mastodon_to_bluesky', wait=False)]
+            if not entries:
+                return 0
+            with metrics.post_seconds.time(platform='bluesky'):
+                created = self.batch_writer.create_records([record for _, record in entries])
+            ledger.mark_many_as_synced(
+                [(post.id, cid, {'origin': 'mastodon', 'hash': mastodon_content_hash(post), 'uri': uri})
+                 for (post, _), (uri, cid) in zip(entries, created)], 'mastodon_to_bluesky')
+        finally:
+            for post, _ in reserved:
+                ledger.release(post.id, 'mastodon_to_bluesky')
+        for post, _ in entries:
+            for attachment in post.media_attachments:
+                self.media_cache.mark_attached('bluesky', attachment.url)
+        logging.info(f"批量同步了 {len(entries)} 条Mastodon嘟文到Bluesky（{entries[0][0].id} - {entries[-1][0].id}）")
+        return len(entries)
+
+    def sync_post(self, post):
+        # 同步单条嘟文，返回是否进行了同步
+        bluesky_posts = self.prepare_post(post)
+        if bluesky_posts is None:
+            return False
+        return self.publish_post(post, bluesky_posts)
+
+    def prepare_post(self, post):
+        """
+        检查嘟文是否需要同步，需要时转换为Bluesky帖子（包括上传图片）
+        :return: 帖子记录列表，不需要同步时返回 None
+        """
+        # 记录每条嘟文的基本信息（调试级别，INFO日志不输出逐条的内容）
+        logging.debug(f"正在处理Mastodon嘟文 {post.id}:")
+        logging.debug(f"  内容: {post.content[:100]}...")
+        logging.debug(f"  创建时间: {post.created_at}")
+        logging.debug(f"  URL: {post.url}")
+        logging.debug(f"  媒体附件数: {len(post.media_attachments)}")
+        
+        if self.archive is not None:
+            self.archive.append('mastodon', mastodon_record(post))
+        
+        if not self.is_eligible(post):
+            return None
+        
+        # 如果嘟文已同步，则跳过；只发布了一部分的帖子串继续发布
+        if self.is_published(post.id):
+            logging.debug(f"Mastodon嘟文 {post.id} 已同步，跳过")
             return None
 
-    def upload_image_to_bluesky(self, image_data, max_retries=5, timeout=30):
-        # 上传图片到Bluesky，包含重试机制
-        for attempt in range(max_retries):
+        return self.convert_mastodon_to_bluesky(post)
+
+    def is_eligible(self, post):
+        # 跳过回复、转发、提及或非公开的嘟文
+        if post.in_reply_to_id is not None or post.reblog is not None or post.mentions or post.visibility != 'public':
+            logging.debug(f"跳过Mastodon嘟文 {post.id} (回复、转发、提及或非公开){post.in_reply_to_id}/{post.reblog}/{post.mentions}/{post.visibility}")
+            return False
+        return True
+
+    def published_parts(self, post_id):
+        """
+        拆分成帖子串的嘟文已发布的片段，每条片段的元数据记录了序号（part）和总条数（parts）
+        :return: ({序号: {'uri', 'cid'}}, 总条数)，不是帖子串时总条数为None
+        """
+        parts = {}
+        total = None
+        for _, cid, meta in self.sync_status_manager.get_entries(post_id, 'mastodon_to_bluesky'):
+            if meta and 'part' in meta:
+                parts[meta['part']] = {'uri': meta['uri'], 'cid': cid}
+                total = meta['parts']
+        return parts, total
+
+    def is_published(self, post_id, wait=True):
+        # 已同步，且不是只发布了一部分的帖子串；wait 的含义同 SyncStatusManager.is_synced
+        if not self.sync_status_manager.is_synced(post_id, 'mastodon_to_bluesky', wait=wait):
+            return False
+        parts, total = self.published_parts(post_id)
+        return total is None or len(parts) >= total
+
+    def publish_post(self, post, bluesky_posts):
+        """
+        逐条发布一条嘟文对应的帖子（或帖子串）
+        发布前预留嘟文，直到全部标记后才释放，另一方向在此期间不会把新帖子当作未同步的帖子同步回来；
+        请求期间不持有同步状态的锁。帖子串中的每一条都单独记录，中途失败后重试时从第一条未发布的片段继续
+        :return: 是否发布了帖子，其他线程正在发布该嘟文或嘟文已同步时返回False
+        """
+        logging.debug(f"正在同步Mastodon嘟文 {post.id} 到Bluesky" + (f"（拆分为 {len(bluesky_posts)} 条帖子）" if len(bluesky_posts) > 1 else ""))
+        logging.debug(f"Bluesky帖子内容: {bluesky_posts}")
+        # 预留之前等待另一方向正在发布的帖子，预留之后只查询记录
+        if self.is_published(post.id):
+            logging.debug(f"Mastodon嘟文 {post.id} 已同步，跳过")
+            return False
+        with self.sync_status_manager.publishing(post.id, 'mastodon_to_bluesky') as reserved:
+            if not reserved or self.is_published(post.id, wait=False):
+                logging.debug(f"Mastodon嘟文 {post.id} 已同步或正在同步，跳过")
+                return False
+            return self.publish_reserved(post, bluesky_posts)
+
+    def publish_reserved(self, post, bluesky_posts):
+        """
+        发布已由当前线程预留的嘟文，不检查也不等待同步状态，供 publish_post 和编辑同步调用
+        :return: True
+        """
+        content_hash = mastodon_content_hash(post)
+        root = None
+        parent = None
+        done, _ = self.published_parts(post.id)
+        start = 0
+        while start in done:
+            start += 1
+        if start:
+            logging.info(f"继续发布Mastodon嘟文 {post.id} 的帖子串，已发布 {start}/{len(bluesky_posts)} 条")
+            root = done[0]
+            parent = done[start - 1]
+        for index in range(start, len(bluesky_posts)):
+            bluesky_post = bluesky_posts[index]
+            if root is not None:
+                bluesky_post['reply'] = {'root': root, 'parent': parent}
             try:
-                logging.info(f"第 {attempt + 1} 次尝试上传图片到Bluesky")
+                with metrics.post_seconds.time(platform='bluesky'):
+                    create_response = self.bluesky.com.atproto.repo.create_record({
+                        'repo': self.bluesky.me.did,
+                        'collection': 'app.bsky.feed.post',
+                        'record': bluesky_post
+                    })
+            except Exception:
+                if index > 0:
+                    logging.warning(f"Mastodon嘟文 {post.id} 的帖子串只发布了 {index}/{len(bluesky_posts)} 条")
+                raise
+            meta = {'origin': 'mastodon', 'hash': content_hash, 'uri': create_response.uri}
+            if len(bluesky_posts) > 1:
+                meta.update(part=index, parts=len(bluesky_posts))
+            self.sync_status_manager.mark_as_synced(post.id, create_response.cid, 'mastodon_to_bluesky', meta=meta)
+            logging.debug(f"Bluesky创建记录响应: {create_response}")
+            parent = {'uri': create_response.uri, 'cid': create_response.cid}
+            root = root or parent
+        for attachment in post.media_attachments:
+            self.media_cache.mark_attached('bluesky', attachment.url)
+        logging.debug(f"成功同步Mastodon嘟文 {post.id} 到Bluesky")
+        return True
+
+    def compress_image(self, image_data, max_size_kb=950):
+        # 压缩图片，同时清除元数据
+        with metrics.transcode_seconds.time(platform='bluesky'):
+            return transcode_image(image_data, max_bytes=max_size_kb * 1024)
+
+    def download_image(self, image_url):
+        # 从URL下载图片
+        result = self.media_fetcher.fetch(image_url)
+        return result.data if result is not None else None
+
+    def upload_image_to_bluesky(self, image_data, timeout=30, size=None):
+        # 上传图片到Bluesky；失败时不在这里等待重试，整条嘟文进入重试队列按退避时间重试
+        # image_data 也可以是打开的文件，请求体按块从文件读取，此时 size 为文件大小
+        try:
+            with metrics.upload_seconds.time(platform='bluesky'):
                 upload_response = self.bluesky.com.atproto.repo.upload_blob(image_data, timeout=timeout)
-                if hasattr(upload_response, 'blob'):
-                    logging.info(f"成功上传图片，blob: {upload_response.blob}")
-                    return upload_response.blob
-                else:
-                    logging.error(f"上传响应不包含blob: {upload_response}")
-            except Exception as e:
-                logging.error(f"上传图片到Bluesky时出错: {str(e)}")
-                logging.exception("异常详情:")
-            if attempt < max_retries - 1:
-                wait_time = 2 ** attempt
-                logging.info(f"等待 {wait_time} 秒后进行下一次尝试")
-                time.sleep(wait_time)
-        logging.error(f"经过 {max_retries} 次尝试后仍未能上传图片")
+            if hasattr(upload_response, 'blob'):
+                metrics.uploaded_bytes_total.inc(len(image_data) if size is None else size, platform='bluesky')
+                logging.debug(f"成功上传图片，blob: {upload_response.blob}")
+                return upload_response.blob
+            logging.error(f"上传响应不包含blob: {upload_response}")
+        except Exception as e:
+            logging.error(f"上传图片到Bluesky时出错: {str(e)}")
+            logging.exception("异常详情:")
         return None
 
+    def cached_blob(self, content_hash):
+        # 同一内容已上传且blob尚未被回收时直接复用
+        ref = self.media_cache.get_remote('bluesky', content_hash)
+        if ref is None:
+            return None
+        logging.debug(f"复用已上传的图片blob: {content_hash}")
+        return BlobRef.model_validate(ref)
+
     def process_and_upload_image(self, image_url):
         # 处理并上传图片的完整流程
-        image_data = self.download_image(image_url)
-        if image_data is None:
+        cached = self.media_cache.url_entry(image_url) or {}
+        content_hash = cached.get('hash')
+        compressed_image = None
+        if content_hash is not None:
+            blob = self.cached_blob(content_hash)
+            if blob is not None:
+                return blob
+            compressed_image = self.media_cache.get_transcoded(content_hash, 'bluesky')
+
+        # 已有转码结果时发送条件请求，源图片未变化就不必重新下载
+        if compressed_image is not None:
+            result = self.media_fetcher.fetch(image_url, etag=cached.get('etag'), last_modified=cached.get('last_modified'))
+        else:
+            result = self.media_fetcher.fetch(image_url)
+        if result is None:
             return None
 
-        logging.info(f"成功下载图片，大小: {len(image_data)} 字节")
+        if result.not_modified:
+            logging.debug(f"图片未变化，使用缓存的转码结果: {image_url}")
+        else:
+            image_data = result.data
+            logging.debug(f"成功下载图片，大小: {len(image_data)} 字节")
+            content_hash = self.media_cache.content_hash(image_data)
+            self.media_cache.remember_url(image_url, content_hash, result.etag, result.last_modified)
+            blob = self.cached_blob(content_hash)
+            if blob is not None:
+                return blob
+
+            compressed_image = self.media_cache.get_transcoded(content_hash, 'bluesky')
+            if compressed_image is None:
+                # 压缩期间占用内存额度，避免多个大图同时解码
+                with self.media_pipeline.reserve(len(image_data)):
+                    compressed_image = self.compress_image(image_data)
+                self.media_cache.put_transcoded(content_hash, 'bluesky', compressed_image)
+            del image_data
 
-        compressed_image = self.compress_image(image_data)
         compressed_size = len(compressed_image)
-        logging.info(f"压缩后的图片大小: {compressed_size} 字节")
+        logging.debug(f"压缩后的图片大小: {compressed_size} 字节")
 
-        if compressed_size > 976.56 * 1024:
+        if compressed_size > BLUESKY_IMAGE_MAX_BYTES:
             logging.error(f"压缩后的图片仍然过大: {compressed_size} 字节")
             return None
 
-        return self.upload_image_to_bluesky(compressed_image)
+        with self.media_pipeline.reserve(compressed_size):
+            blob = self.upload_image_to_bluesky(compressed_image)
+        if blob is not None:
+            self.media_cache.put_remote('bluesky', content_hash, blob.model_dump(by_alias=True, mode='json'))
+        return blob
+
+    def process_and_upload_video(self, video_url):
+        """
+        流式下载视频（包括Mastodon转换为MP4的GIF动图）并上传为blob，只在超过Bluesky的大小上限时转码
+        :return: blob，失败时返回None
+        """
+        content_hash = self.media_cache.lookup_url(video_url)
+        if content_hash is not None:
+            blob = self.cached_blob(content_hash)
+            if blob is not None:
+                return blob
+
+        fetched = self.media_fetcher.fetch_to_file(video_url, max_bytes=MEDIA_MAX_VIDEO_DOWNLOAD_MB * 1024 * 1024)
+        if fetched is None:
+            return None
+        transcoded = None
+        try:
+            content_hash = fetched.content_hash
+            self.media_cache.remember_url(video_url, content_hash)
+            blob = self.cached_blob(content_hash)
+            if blob is not None:
+                return blob
+
+            path, size = fetched.path, fetched.size
+            max_bytes = BLUESKY_VIDEO_MAX_MB * 1024 * 1024
+            if size > max_bytes or media_kind(sniff_mime(fetched.head)) != 'video':
+                # 过大的视频和非MP4/MOV/WebM的动图转码为MP4
+                with metrics.transcode_seconds.time(platform='bluesky'):
+                    transcoded = transcode_video(path, max_bytes)
+                path, size = transcoded, os.path.getsize(transcoded)
+            logging.debug(f"上传视频，大小: {size} 字节")
+
+            # 直接把文件作为请求体分块上传，视频不整个读入内存，因此不占用媒体内存额度
+            with open(path, 'rb') as f:
+                blob = self.upload_image_to_bluesky(f, timeout=max(30, size // (256 * 1024)), size=size)
+            if blob is not None:
+                self.media_cache.put_remote('bluesky', content_hash, blob.model_dump(by_alias=True, mode='json'))
+            return blob
+        except Exception as e:
+            logging.error(f"处理视频时出错: {str(e)}")
+            return None
+        finally:
+            fetched.close()
+            if transcoded is not None:
+                os.remove(transcoded)
+
+    @staticmethod
+    def aspect_ratio(attachment):
+        # 附件的原始宽高，Bluesky据此在加载前预留视频的显示区域
+        original = (getattr(attachment, 'meta', None) or {}).get('original') or {}
+        width, height = original.get('width'), original.get('height')
+        if width and height:
+            return {'width': int(width), 'height': int(height)}
+        return None
 
     def convert_mastodon_to_bluesky(self, mastodon_post):
-        # 将Mastodon嘟文转换为Bluesky帖子格式
-        # 处理html标签
-        text = re.sub(r'<br\s*/?>', '\n', mastodon_post.content, flags=re.IGNORECASE)
-        text = re.sub(r'</p>', '\n', text, flags=re.IGNORECASE)
-        text = re.sub(r'<[^>]+>', '', text)
-        
-        # 处理HTML实体
-        text = re.sub(r'&nbsp;', ' ', text)
-        text = re.sub(r'&amp;', '&', text)
-        text = re.sub(r'&lt;', '<', text)
-        text = re.sub(r'&gt;', '>', text)
-        
-        # 移除多余的空白行
-        # text = re.sub(r'\n\s*\n', '\n\n', text)
+        # 将Mastodon嘟文转换为Bluesky帖子格式，返回帖子列表（不拆分时只有一条）
+        # 把HTML转换为纯文本，链接和话题标签转换为Bluesky的facets
+        text, facets = html_to_text(mastodon_post.content)
 
-        # 检查字数是否超过300字
-        from_mastodon_at = os.environ.get('FROM_MASTODON_AT', '')
-        
-        if from_mastodon_at:
-            if len(text) > 300 - len('\n\nfrom mastodon '+from_mastodon_at):
-                text = text[:300 - len('...'+'\n\nfrom mastodon '+from_mastodon_at)] + '...' + '\n\nfrom mastodon ' + from_mastodon_at
-            else:
-                text = text + '\n\nfrom mastodon ' + from_mastodon_at
+        # Bluesky按字素数（300）和UTF-8字节数（3000）限制正文长度，超出时截断或拆分成帖子串
+        from_mastodon_at = self.from_mastodon_at
+        suffix = '\n\nfrom mastodon ' + from_mastodon_at if from_mastodon_at else ''
+        if self.split_threads:
+            parts = split_thread(text, facets, suffix=suffix)
         else:
-            if len(text) > 300:
-                text = text[:300 - len('...')] + '...'
-        
-        bluesky_post = {
-            '$type': 'app.bsky.feed.post',
-            'text': text,
-            'createdAt': mastodon_post.created_at.isoformat(),
-            'langs': [mastodon_post.language] if mastodon_post.language else []
-        }
-
-        # 处理图片附件
-        if mastodon_post.media_attachments:
+            parts = [truncate(text, facets, suffix=suffix)]
+
+        bluesky_posts = []
+        for text, facets in parts:
+            bluesky_post = {
+                '$type': 'app.bsky.feed.post',
+                'text': text,
+                'createdAt': mastodon_post.created_at.isoformat(),
+                'langs': [mastodon_post.language] if mastodon_post.language else []
+            }
+            if facets:
+                bluesky_post['facets'] = facets
+            bluesky_posts.append(bluesky_post)
+        # 图片附加在帖子串的第一条上
+        bluesky_post = bluesky_posts[0]
+
+        # 处理媒体附件；Mastodon的一条嘟文只能有多张图片或一个视频/GIF动图，Bluesky也一样
+        videos = [attachment for attachment in mastodon_post.media_attachments if attachment.type in ('video', 'gifv')]
+        if videos:
+            video = videos[0]
+            blob = self.process_and_upload_video(video.url)
+            if not blob:
+                # 不发布缺少视频的帖子，已上传的视频保存在媒体缓存中，重试时复用
+                raise MediaUploadError(f"视频处理或上传失败: {video.url}")
+            bluesky_post['embed'] = {
+                '$type': 'app.bsky.embed.video',
+                'video': blob,
+                'alt': video.description or '',
+            }
+            aspect_ratio = self.aspect_ratio(video)
+            if aspect_ratio:
+                bluesky_post['embed']['aspectRatio'] = aspect_ratio
+        elif mastodon_post.media_attachments:
             images = []
-            for attachment in mastodon_post.media_attachments:
-                if attachment.type == 'image':
-                    blob = self.process_and_upload_image(attachment.url)
-                    if blob:
-                        images.append({
-                            'alt': attachment.description or '',
-                            'image': blob
-                        })
+            attachments = [attachment for attachment in mastodon_post.media_attachments if attachment.type == 'image']
+            # 并行处理所有图片，结果保持附件的原始顺序
+            blobs = self.media_pipeline.map(lambda attachment: self.process_and_upload_image(attachment.url), attachments)
+            for attachment, blob in zip(attachments, blobs):
+                if not blob:
+                    # 不发布缺少图片的帖子，已上传的图片保存在媒体缓存中，重试时复用
+                    raise MediaUploadError(f"图片处理或上传失败: {attachment.url}")
+                images.append({
+                    'alt': attachment.description or '',
+                    'image': blob
+                })
             if images:
                 bluesky_post['embed'] = {
                     '$type': 'app.bsky.embed.images',
                     'images': images
                 }
 
-        return bluesky_post
+        return bluesky_posts
@@ -0,0 +1,205 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+
+# 转码结果缓存的磁盘占用上限（MB）
+MEDIA_CACHE_MAX_MB = int(os.environ.get('MEDIA_CACHE_MAX_MB', 256))
+# 已上传但尚未被帖子引用的Bluesky blob的有效期（秒），过期后PDS会回收
+MEDIA_CACHE_BLUESKY_TTL = int(os.environ.get('MEDIA_CACHE_BLUESKY_TTL', 3600))
+# 已被帖子引用的Bluesky blob在缓存中保留的时间（秒）
+MEDIA_CACHE_BLUESKY_ATTACHED_TTL = int(os.environ.get('MEDIA_CACHE_BLUESKY_ATTACHED_TTL', 7 * 86400))
+# 已上传但尚未附加到嘟文的Mastodon媒体的有效期（秒），Mastodon默认一天后清理
+MEDIA_CACHE_MASTODON_TTL = int(os.environ.get('MEDIA_CACHE_MASTODON_TTL', 20 * 3600))
+# 最多记住的源URL数
+MEDIA_CACHE_MAX_URLS = 10000
+
+class MediaCache:
+    def __init__(self, directory='data/media_cache', max_bytes=None):
+        """
+        初始化基于内容哈希的媒体缓存
+        缓存三类信息：源URL到内容哈希的映射、转码后的图片字节，以及上传后各平台返回的引用
+        （Bluesky 的 blob、Mastodon 的 media id）
+        :param directory: 缓存目录
+        :param max_bytes: 转码结果的磁盘占用上限，超过后按最近最少使用淘汰
+        """
+        self.directory = directory
+        self.blob_dir = os.path.join(directory, 'blobs')
+        self.index_file = os.path.join(directory, 'index.json')
+        self.max_bytes = MEDIA_CACHE_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+        self._lock = threading.RLock()
+        self.index = self.load_index()
+
+    def load_index(self):
+        """
+        从文件加载缓存索引
+        :return: 缓存索引
+        """
+        index = {'urls': {}, 'blobs': {}, 'remote': {}}
+        if os.path.exists(self.index_file):
+            try:
+                with open(self.index_file, 'r', encoding='utf-8') as f:
+                    index.update(json.load(f))
+            except json.JSONDecodeError:
+                logging.warning(f"无法加载 {self.index_file}。创建新的媒体缓存。")
+        return index
+
+    def save_index(self):
+        """
+        将缓存索引保存到文件
+        """
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_filename = f'{self.index_file}.tmp'
+            with open(tmp_filename, 'w', encoding='utf-8') as f:
+                json.dump(self.index, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_filename, self.index_file)
+        except Exception as e:
+            logging.error(f"保存媒体缓存索引失败: {str(e)}")
+
+    @staticmethod
+    def content_hash(data):
+        return hashlib.sha256(data).hexdigest()
+
+    def lookup_url(self, url):
+        """
+        查找源URL对应的内容哈希
+        :param url: 源URL
+        :return: 内容哈希，未知时返回None
+        """
+        entry = self.url_entry(url)
+        return entry['hash'] if entry else None
+
+    def url_entry(self, url):
+        """
+        获取源URL的缓存记录，包含内容哈希以及用于条件请求的 etag / last_modified
+        :return: 字典，未知时返回None
+        """
+        with self._lock:
+            entry = self.index['urls'].get(url)
+            return dict(entry) if entry else None
+
+    def remember_url(self, url, content_hash, etag=None, last_modified=None):
+        """
+        记录源URL对应的内容哈希和响应的校验信息
+        """
+        with self._lock:
+            self.index['urls'][url] = {'hash': content_hash, 'time': time.time(),
+                                       'etag': etag, 'last_modified': last_modified}
+            if len(self.index['urls']) > MEDIA_CACHE_MAX_URLS:
+                oldest = sorted(self.index['urls'].items(), key=lambda item: item[1]['time'])
+                for old_url, _ in oldest[:len(oldest) - MEDIA_CACHE_MAX_URLS]:
+                    del self.index['urls'][old_url]
+            self.save_index()
+
+    def _blob_path(self, key):
+        return os.path.join(self.blob_dir, key)
+
+    def get_transcoded(self, content_hash, variant):
+        """
+        获取缓存的转码结果
+        :param content_hash: 源内容哈希
+        :param variant: 转码方式，例如 'bluesky'
+        :return: 转码后的字节，未缓存时返回None
+        """
+        key = f'{content_hash}.{variant}'
+        with self._lock:
+            entry = self.index['blobs'].get(key)
+            if entry is None:
+                return None
+            try:
+                with open(self._blob_path(key), 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                del self.index['blobs'][key]
+                self.save_index()
+                return None
+            entry['atime'] = time.time()
+            return data
+
+    def put_transcoded(self, content_hash, variant, data):
+        """
+        缓存转码结果，超过磁盘占用上限时淘汰最久未使用的条目
+        """
+        if len(data) > self.max_bytes:
+            return
+        key = f'{content_hash}.{variant}'
+        with self._lock:
+            os.makedirs(self.blob_dir, exist_ok=True)
+            with open(self._blob_path(key), 'wb') as f:
+                f.write(data)
+            self.index['blobs'][key] = {'size': len(data), 'atime': time.time()}
+            self._evict()
+            self.save_index()
+
+    def _evict(self):
+        total = sum(entry['size'] for entry in self.index['blobs'].values())
+        if total <= self.max_bytes:
+            return
+        for key, entry in sorted(self.index['blobs'].items(), key=lambda item: item[1]['atime']):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._blob_path(key))
+            except FileNotFoundError:
+                pass
+            del self.index['blobs'][key]
+            total -= entry['size']
+            logging.debug(f"媒体缓存已满，淘汰 {key}")
+
+    def get_remote(self, platform, content_hash):
+        """
+        获取内容在某个平台上尚未过期的上传结果
+        :param platform: 'bluesky' 或 'mastodon'
+        :param content_hash: 内容哈希
+        :return: 上传时保存的引用，未缓存或已过期时返回None
+        """
+        key = f'{platform}:{content_hash}'
+        with self._lock:
+            entry = self.index['remote'].get(key)
+            if entry is None:
+                return None
+            if entry['expires'] <= time.time():
+                del self.index['remote'][key]
+                self.save_index()
+                return None
+            return entry['ref']
+
+    def put_remote(self, platform, content_hash, ref, ttl=None):
+        """
+        记录内容在某个平台上的上传结果
+        :param ref: 可序列化为JSON的引用
+        :param ttl: 有效期（秒），默认使用平台回收未引用媒体的时间
+        """
+        if ttl is None:
+            ttl = MEDIA_CACHE_BLUESKY_TTL if platform == 'bluesky' else MEDIA_CACHE_MASTODON_TTL
+        with self._lock:
+            self.index['remote'][f'{platform}:{content_hash}'] = {'ref': ref, 'expires': time.time() + ttl}
+            self.save_index()
+
+    def forget_remote(self, platform, content_hash):
+        with self._lock:
+            if self.index['remote'].pop(f'{platform}:{content_hash}', None) is not None:
+                self.save_index()
+
+    def mark_attached(self, platform, url):
+        """
+        媒体已被发布的帖子引用后调用
+        Bluesky 的 blob 被引用后可以在新帖子中继续使用；Mastodon 的媒体只能附加到一条嘟文，因此直接丢弃
+        :param url: 媒体的源URL
+        """
+        content_hash = self.lookup_url(url)
+        if content_hash is None:
+            return
+        with self._lock:
+            key = f'{platform}:{content_hash}'
+            entry = self.index['remote'].get(key)
+            if entry is None:
+                return
+            if platform == 'bluesky':
+                entry['expires'] = max(entry['expires'], time.time() + MEDIA_CACHE_BLUESKY_ATTACHED_TTL)
+                self.save_index()
+            else:
+                self.forget_remote(platform, content_hash)
@@ -0,0 +1,199 @@
+import os
+import hashlib
+import logging
+import tempfile
+import threading
+import requests
+import metrics
+from requests.adapters import HTTPAdapter
+
+# 连接和读取超时（秒）
+MEDIA_CONNECT_TIMEOUT = float(os.environ.get('MEDIA_CONNECT_TIMEOUT', 5))
+MEDIA_READ_TIMEOUT = float(os.environ.get('MEDIA_READ_TIMEOUT', 30))
+# 单个媒体文件的下载大小上限（MB）
+MEDIA_MAX_DOWNLOAD_MB = int(os.environ.get('MEDIA_MAX_DOWNLOAD_MB', 50))
+# 保持连接的主机数和每个主机的连接数
+MEDIA_POOL_HOSTS = 10
+MEDIA_POOL_SIZE = 8
+CHUNK_SIZE = 64 * 1024
+
+class MediaTooLargeError(Exception):
+    pass
+
+class FetchResult:
+    def __init__(self, url, data=None, not_modified=False, etag=None, last_modified=None, content_type=None):
+        """
+        一次媒体下载的结果
+        :param data: 响应内容，条件请求命中（304）时为None
+        :param not_modified: 条件请求是否命中
+        """
+        self.url = url
+        self.data = data
+        self.not_modified = not_modified
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_type = content_type
+
+class FileFetchResult:
+    def __init__(self, url, path, size, content_hash, head, content_type=None):
+        """
+        流式下载到临时文件的结果，用完后调用 close() 删除临时文件
+        :param path: 临时文件路径
+        :param content_hash: 内容的sha256，与 MediaCache.content_hash 一致
+        :param head: 文件开头的字节，用于识别真实的文件类型
+        """
+        self.url = url
+        self.path = path
+        self.size = size
+        self.content_hash = content_hash
+        self.head = head
+        self.content_type = content_type
+
+    def close(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+class MediaFetcher:
+    def __init__(self, connect_timeout=None, read_timeout=None, max_bytes=None):
+        """
+        初始化共享的媒体下载器：按主机保持连接池，带超时、流式下载和大小上限，支持条件请求
+        :param connect_timeout: 连接超时（秒）
+        :param read_timeout: 读取超时（秒）
+        :param max_bytes: 单个文件的下载大小上限（字节）
+        """
+        self.timeout = (connect_timeout or MEDIA_CONNECT_TIMEOUT, read_timeout or MEDIA_READ_TIMEOUT)
+        self.max_bytes = max_bytes or MEDIA_MAX_DOWNLOAD_MB * 1024 * 1024
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(pool_connections=MEDIA_POOL_HOSTS, pool_maxsize=MEDIA_POOL_SIZE)
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self._not_modified = 0
+        self._last_pool_totals = (0, 0)
+
+    def fetch(self, url, etag=None, last_modified=None, max_bytes=None):
+        """
+        下载媒体文件
+        :param url: 媒体URL
+        :param etag: 上次下载时的ETag，提供时发送条件请求
+        :param last_modified: 上次下载时的Last-Modified，提供时发送条件请求
+        :param max_bytes: 本次下载的大小上限，默认使用全局上限
+        :return: FetchResult，下载失败时返回None
+        """
+        max_bytes = max_bytes or self.max_bytes
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+        try:
+            with self.session.get(url, headers=headers, timeout=self.timeout, stream=True) as response:
+                if response.status_code == 304:
+                    with self._lock:
+                        self._not_modified += 1
+                    return FetchResult(url, not_modified=True, etag=etag, last_modified=last_modified)
+                if response.status_code != 200:
+                    logging.error(f"下载媒体失败，状态码: {response.status_code}")
+                    return None
+                content_length = response.headers.get('Content-Length')
+                if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+                    raise MediaTooLargeError(f"媒体文件过大: {content_length} 字节")
+                data = self._read_limited(response, max_bytes)
+                return FetchResult(
+                    url,
+                    data=data,
+                    etag=response.headers.get('ETag'),
+                    last_modified=response.headers.get('Last-Modified'),
+                    content_type=response.headers.get('Content-Type'),
+                )
+        except Exception as e:
+            logging.error(f"下载媒体时出错: {str(e)}")
+            return None
+
+    def fetch_to_file(self, url, max_bytes=None, head_bytes=64):
+        """
+        把较大的媒体文件（视频、GIF）流式下载到临时文件，不在内存中保留完整内容
+        下载的同时计算内容哈希并保留文件开头的字节
+        :param url: 媒体URL
+        :param max_bytes: 本次下载的大小上限，默认使用全局上限
+        :param head_bytes: 保留的开头字节数
+        :return: FileFetchResult，下载失败时返回None
+        """
+        max_bytes = max_bytes or self.max_bytes
+        fd, path = tempfile.mkstemp(suffix='.media')
+        try:
+            with os.fdopen(fd, 'wb') as f, self.session.get(url, timeout=self.timeout, stream=True) as response:
+                if response.status_code != 200:
+                    raise IOError(f"状态码: {response.status_code}")
+                content_length = response.headers.get('Content-Length')
+                if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+                    raise MediaTooLargeError(f"媒体文件过大: {content_length} 字节")
+                digest = hashlib.sha256()
+                head = b''
+                size = 0
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > max_bytes:
+                        raise MediaTooLargeError(f"媒体文件超过 {max_bytes} 字节，已中止下载")
+                    if len(head) < head_bytes:
+                        head += chunk[:head_bytes - len(head)]
+                    digest.update(chunk)
+                    f.write(chunk)
+                content_type = response.headers.get('Content-Type')
+            with self._lock:
+                self._bytes += size
+            metrics.downloaded_bytes_total.inc(size)
+            return FileFetchResult(url, path, size, digest.hexdigest(), head, content_type)
+        except Exception as e:
+            logging.error(f"下载媒体时出错: {str(e)}")
+            os.remove(path)
+            return None
+
+    def _read_limited(self, response, max_bytes):
+        buffer = bytearray()
+        for chunk in response.iter_content(CHUNK_SIZE):
+            buffer.extend(chunk)
+            if len(buffer) > max_bytes:
+                raise MediaTooLargeError(f"媒体文件超过 {max_bytes} 字节，已中止下载")
+        with self._lock:
+            self._bytes += len(buffer)
+        metrics.downloaded_bytes_total.inc(len(buffer))
+        return bytes(buffer)
+
+    def _pool_totals(self):
+        connections = requests_sent = 0
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                connections += pool.num_connections
+                requests_sent += pool.num_requests
+        return connections, requests_sent
+
+    def pop_stats(self):
+        """
+        返回自上次调用以来的下载统计并清零
+        :return: 字典，包含下载字节数、请求数、新建连接数、复用连接数和条件请求命中数
+        """
+        with self._lock:
+            connections, requests_sent = self._pool_totals()
+            last_connections, last_requests = self._last_pool_totals
+            self._last_pool_totals = (connections, requests_sent)
+            new_connections = max(0, connections - last_connections)
+            sent = max(0, requests_sent - last_requests)
+            stats = {
+                'bytes': self._bytes,
+                'requests': sent,
+                'new_connections': new_connections,
+                'reused_connections': max(0, sent - new_connections),
+                'not_modified': self._not_modified,
+            }
+            self._bytes = 0
+            self._not_modified = 0
+            return stats
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,72 @@
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+# 同时处理（下载、压缩、上传）的媒体文件数
+MEDIA_WORKERS = int(os.environ.get('MEDIA_WORKERS', 4))
+# 同时驻留在内存中的媒体数据上限（MB）
+MEDIA_MAX_INFLIGHT_MB = int(os.environ.get('MEDIA_MAX_INFLIGHT_MB', 64))
+
+
+class MediaUploadError(Exception):
+    # 帖子的媒体没有全部处理或上传成功；帖子不会缺少媒体发布，而是进入重试队列
+    pass
+
+class MediaPipeline:
+    def __init__(self, max_workers=None, max_inflight_bytes=None):
+        """
+        初始化媒体处理流水线：一个有界线程池，让同一帖子的多个附件并行下载、转码和上传
+        :param max_workers: 最大并发数
+        :param max_inflight_bytes: 同时驻留在内存中的媒体数据上限（字节）
+        """
+        self.max_workers = max_workers or MEDIA_WORKERS
+        self.max_inflight_bytes = max_inflight_bytes or MEDIA_MAX_INFLIGHT_MB * 1024 * 1024
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='media')
+        self._inflight_bytes = 0
+        self._budget = threading.Condition()
+
+    def map(self, func, items):
+        """
+        并行处理所有条目，结果顺序与输入顺序一致
+        单个条目处理失败时对应结果为None，不影响其他条目
+        :param func: 处理单个条目的函数
+        :param items: 条目列表
+        :return: 结果列表
+        """
+        items = list(items)
+        if len(items) <= 1:
+            return [self._call(func, item) for item in items]
+        futures = [self.executor.submit(self._call, func, item) for item in items]
+        return [future.result() for future in futures]
+
+    @staticmethod
+    def _call(func, item):
+        try:
+            return func(item)
+        except Exception as e:
+            logging.error(f"处理媒体时出错: {str(e)}")
+            logging.exception("异常详情:")
+            return None
+
+    @contextmanager
+    def reserve(self, nbytes):
+        """
+        为一段媒体数据预留内存额度，额度不足时等待其他任务释放
+        单个文件超过总额度时，只要当前没有其他任务占用额度就允许执行
+        :param nbytes: 需要预留的字节数
+        """
+        with self._budget:
+            while self._inflight_bytes > 0 and self._inflight_bytes + nbytes > self.max_inflight_bytes:
+                self._budget.wait()
+            self._inflight_bytes += nbytes
+        try:
+            yield
+        finally:
+            with self._budget:
+                self._inflight_bytes -= nbytes
+                self._budget.notify_all()
+
+    def close(self):
+        self.executor.shutdown(wait=True)
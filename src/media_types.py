@@ -0,0 +1,75 @@
+import os
+
+# Bluesky单张图片的大小上限（字节）
+BLUESKY_IMAGE_MAX_BYTES = int(976.56 * 1024)
+# Bluesky视频的大小上限（MB）
+BLUESKY_VIDEO_MAX_MB = int(os.environ.get('BLUESKY_VIDEO_MAX_MB', 50))
+# Mastodon图片和视频的大小上限（MB），与实例的设置一致
+MASTODON_IMAGE_MAX_MB = int(os.environ.get('MASTODON_IMAGE_MAX_MB', 16))
+MASTODON_VIDEO_MAX_MB = int(os.environ.get('MASTODON_VIDEO_MAX_MB', 99))
+# 视频和GIF的下载上限（MB），超过目标平台上限的文件下载后再转码
+MEDIA_MAX_VIDEO_DOWNLOAD_MB = int(os.environ.get('MEDIA_MAX_VIDEO_DOWNLOAD_MB', 200))
+
+# 识别文件类型需要的开头字节数
+SNIFF_BYTES = 64
+
+EXTENSIONS = {
+    'image/jpeg': 'jpg',
+    'image/png': 'png',
+    'image/gif': 'gif',
+    'image/webp': 'webp',
+    'image/heic': 'heic',
+    'image/avif': 'avif',
+    'video/mp4': 'mp4',
+    'video/quicktime': 'mov',
+    'video/webm': 'webm',
+}
+
+
+def sniff_mime(head):
+    """
+    按文件开头的字节识别媒体类型，不依赖服务器返回的 Content-Type
+    :param head: 文件开头的至少 SNIFF_BYTES 个字节
+    :return: MIME类型，无法识别时返回None
+    """
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    if head[:4] == b'\x1a\x45\xdf\xa3':
+        return 'video/webm'
+    if head[4:8] == b'ftyp':
+        brand = head[8:12]
+        if brand in (b'heic', b'heix', b'mif1', b'msf1'):
+            return 'image/heic'
+        if brand in (b'avif', b'avis'):
+            return 'image/avif'
+        if brand == b'qt  ':
+            return 'video/quicktime'
+        return 'video/mp4'
+    return None
+
+
+def media_kind(mime):
+    """
+    媒体的种类：静态图片、GIF动图或视频
+    :return: 'image'、'gif'、'video'，不支持的类型返回None
+    """
+    if not mime:
+        return None
+    mime = mime.split(';', 1)[0].strip().lower()
+    if mime == 'image/gif':
+        return 'gif'
+    if mime.startswith('image/'):
+        return 'image'
+    if mime.startswith('video/'):
+        return 'video'
+    return None
+
+
+def file_extension(mime):
+    return EXTENSIONS.get(mime, 'bin')
@@ -0,0 +1,259 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 指标HTTP服务的端口，0 表示不启动
+METRICS_PORT = int(os.environ.get('METRICS_PORT', 0))
+# 指标HTTP服务监听的地址
+METRICS_HOST = os.environ.get('METRICS_HOST', '127.0.0.1')
+# 每轮同步后把指标写入该JSON文件，为空时不写
+METRICS_JSON_FILE = os.environ.get('METRICS_JSON_FILE', '')
+
+# 耗时直方图的默认分桶上界（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def format_labels(label_names, values, extra=None):
+    pairs = list(zip(label_names, values)) + (extra or [])
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class Counter:
+    def __init__(self, name, documentation, label_names=()):
+        """
+        只增不减的计数器，按标签分别计数
+        :param name: 指标名
+        :param documentation: 说明，输出在 # HELP 中
+        :param label_names: 标签名
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{format_labels(self.label_names, key)} {format_value(value)}')
+        return lines
+
+    def snapshot(self):
+        with self._lock:
+            return [{'labels': dict(zip(self.label_names, key)), 'value': value}
+                    for key, value in sorted(self._values.items())]
+
+
+class Histogram:
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        """
+        耗时等数值的分布，按标签分别统计各分桶的累计次数、总和与次数
+        :param buckets: 分桶上界，升序
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[index] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        # 记录代码块的耗时（秒），代码块抛出异常时同样记录
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        with self._lock:
+            entry = self._values.get(tuple(str(labels[name]) for name in self.label_names))
+            return sum(entry[0]) if entry else 0
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    labels = format_labels(self.label_names, key, [('le', format_value(bound))])
+                    lines.append(f'{self.name}_bucket{labels} {cumulative}')
+                lines.append(f'{self.name}_sum{format_labels(self.label_names, key)} {format_value(total)}')
+                lines.append(f'{self.name}_count{format_labels(self.label_names, key)} {cumulative}')
+        return lines
+
+    def snapshot(self):
+        with self._lock:
+            return [{'labels': dict(zip(self.label_names, key)), 'count': sum(counts), 'sum': total,
+                     'buckets': dict(zip([format_value(bound) for bound in self.buckets + (float('inf'),)], counts))}
+                    for key, (counts, total) in sorted(self._values.items())]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        """
+        进程内的指标集合，按Prometheus文本格式或JSON输出
+        多账户模式下所有账户的指标累计在一起
+        """
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric_class, name, documentation, label_names, **kwargs):
+        with self._lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = metric_class(name, documentation, label_names, **kwargs)
+                self.metrics[name] = metric
+            return metric
+
+    def counter(self, name, documentation, label_names=()):
+        return self._register(Counter, name, documentation, label_names)
+
+    def histogram(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, label_names, buckets=buckets)
+
+    def render(self):
+        # Prometheus文本格式（0.0.4）
+        with self._lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self.metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    def dump_json(self, filename=None):
+        """
+        把当前的指标写入JSON文件（先写临时文件再替换）
+        :param filename: 文件名，默认使用 METRICS_JSON_FILE，为空时不写
+        """
+        filename = filename or METRICS_JSON_FILE
+        if not filename:
+            return
+        try:
+            directory = os.path.dirname(filename)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_filename = f'{filename}.tmp'
+            with open(tmp_filename, 'w', encoding='utf-8') as f:
+                json.dump({'time': time.time(), 'metrics': self.snapshot()}, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_filename, filename)
+        except Exception as e:
+            logging.error(f"写入指标文件失败: {str(e)}")
+
+    def start_http_server(self, port=None, host=None):
+        """
+        在后台线程中启动指标HTTP服务：/metrics 输出Prometheus文本格式，/metrics.json 输出JSON
+        :param port: 端口，默认使用 METRICS_PORT，为0时不启动
+        :return: HTTP服务，未启动时返回None
+        """
+        port = METRICS_PORT if port is None else port
+        if not port:
+            return None
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                path = self.path.split('?', 1)[0]
+                if path == '/metrics':
+                    body = registry.render().encode('utf-8')
+                    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+                elif path == '/metrics.json':
+                    body = json.dumps(registry.snapshot(), ensure_ascii=False).encode('utf-8')
+                    content_type = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer((host or METRICS_HOST, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+        logging.info(f"指标服务已启动: http://{server.server_address[0]}:{server.server_address[1]}/metrics")
+        return server
+
+
+# 进程内共用的指标
+registry = MetricsRegistry()
+
+posts_total = registry.counter(
+    'sync_posts_total', '按同步方向和结果统计的帖子数（fetched、synced、skipped、failed、deferred）', ('direction', 'result'))
+downloaded_bytes_total = registry.counter(
+    'sync_media_downloaded_bytes_total', '下载的媒体字节数')
+uploaded_bytes_total = registry.counter(
+    'sync_media_uploaded_bytes_total', '上传到各平台的媒体字节数', ('platform',))
+retries_total = registry.counter(
+    'sync_retries_total', '重试队列的事件数（scheduled、attempted、dead_lettered）', ('direction', 'event'))
+fetch_seconds = registry.histogram(
+    'sync_fetch_seconds', '获取新帖子的耗时（秒）', ('direction',))
+transcode_seconds = registry.histogram(
+    'sync_transcode_seconds', '图片转码的耗时（秒）', ('platform',))
+upload_seconds = registry.histogram(
+    'sync_upload_seconds', '媒体上传的耗时（秒）', ('platform',))
+post_seconds = registry.histogram(
+    'sync_post_seconds', '发布帖子的单次请求耗时（秒）', ('platform',))
+rate_limit_wait_seconds = registry.histogram(
+    'sync_rate_limit_wait_seconds', '为避免超过速率限制而等待的时间（秒）', ('platform', 'endpoint'))
+rate_limited_total = registry.counter(
+    'sync_rate_limited_total', '收到429响应的次数', ('platform', 'endpoint'))
+cycle_seconds = registry.histogram(
+    'sync_cycle_seconds', '一轮同步的总耗时（秒）', buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600))
+
+
+def record_sync_stats(direction, stats):
+    """
+    把同步器返回的统计计入帖子计数器
+    :param direction: 同步方向 ('mastodon_to_bluesky' 或 'bluesky_to_mastodon')
+    :param stats: 同步器的统计字典
+    """
+    for result, count in stats.items():
+        if count:
+            posts_total.inc(count, direction=direction, result=result)
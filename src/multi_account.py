@@ -0,0 +1,163 @@
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from http.cookiejar import DefaultCookiePolicy
+from urllib.parse import urlparse
+import httpx
+import requests
+import metrics
+from requests.adapters import HTTPAdapter
+from sync_tool import SyncTool
+from media_pipeline import MediaPipeline
+from sync_pipeline import SYNC_PIPELINE_DEPTH
+from media_fetcher import MediaFetcher
+from adaptive_scheduler import AdaptivePollScheduler
+from jetstream_consumer import JetstreamConsumer
+from sync_cursor_store import SyncCursorStore
+from account_config import load_accounts
+
+# 同时进行同步的账户数
+ACCOUNT_WORKERS = int(os.environ.get('ACCOUNT_WORKERS', 4))
+# 每个Mastodon实例保持的连接数
+MASTODON_POOL_SIZE = 8
+# 所有账户共用的Jetstream事件游标文件
+JETSTREAM_CURSOR_FILE = os.environ.get('JETSTREAM_CURSOR_FILE', os.path.join('data', 'jetstream_cursor.json'))
+
+class SharedResources:
+    def __init__(self):
+        """
+        多账户模式下各账户共用的资源：同步方向、帖子流水线和媒体的线程池，媒体下载器，以及按实例主机共用的HTTP连接池
+        线程数只取决于同时同步的账户数（ACCOUNT_WORKERS），不随账户总数增长
+        """
+        self.media_pipeline = MediaPipeline()
+        self.media_fetcher = MediaFetcher()
+        # 每个正在同步的账户两个方向各占一个线程
+        self.direction_executor = ThreadPoolExecutor(max_workers=2 * ACCOUNT_WORKERS, thread_name_prefix='sync')
+        # 每个方向最多提前转换 SYNC_PIPELINE_DEPTH 条帖子
+        self.prepare_executor = None
+        if SYNC_PIPELINE_DEPTH > 1:
+            self.prepare_executor = ThreadPoolExecutor(max_workers=2 * ACCOUNT_WORKERS * SYNC_PIPELINE_DEPTH,
+                                                       thread_name_prefix='prepare')
+        self._mastodon_sessions = {}
+        self._bluesky_http_client = None
+        self._jetstream = None
+        self._lock = threading.Lock()
+
+    def mastodon_session(self, api_base_url):
+        """
+        获取某个Mastodon实例的共用会话，同一实例上的账户复用连接
+        访问令牌由Mastodon.py在每次请求时单独附加；会话拒绝所有Cookie，避免账户之间串用
+        """
+        host = urlparse(api_base_url).netloc
+        with self._lock:
+            session = self._mastodon_sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MASTODON_POOL_SIZE)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._mastodon_sessions[host] = session
+            return session
+
+    def bluesky_http_client(self):
+        """
+        获取所有Bluesky客户端共用的httpx客户端，httpx按主机维护连接池
+        """
+        with self._lock:
+            if self._bluesky_http_client is None:
+                self._bluesky_http_client = httpx.Client(follow_redirects=True)
+            return self._bluesky_http_client
+
+    def jetstream_consumer(self):
+        """
+        获取所有账户共用的Jetstream消费者，一个连接接收所有订阅账户的帖子，游标保存在 JETSTREAM_CURSOR_FILE
+        """
+        with self._lock:
+            if self._jetstream is None:
+                self._jetstream = JetstreamConsumer(SyncCursorStore(JETSTREAM_CURSOR_FILE))
+            return self._jetstream
+
+    def close(self):
+        if self._jetstream is not None:
+            self._jetstream.close()
+        self.direction_executor.shutdown(wait=True)
+        if self.prepare_executor is not None:
+            self.prepare_executor.shutdown(wait=True)
+        self.media_pipeline.close()
+        self.media_fetcher.close()
+        for session in self._mastodon_sessions.values():
+            session.close()
+        if self._bluesky_http_client is not None:
+            self._bluesky_http_client.close()
+
+class MultiAccountRunner:
+    def __init__(self, config_file, interval):
+        """
+        多账户调度器：用有界线程池轮流同步配置文件中的所有账户
+        每个账户同一时间最多占用一个工作线程，到期最久的账户优先执行，慢账户不会拖住其他账户
+        :param config_file: 多账户配置文件
+        :param interval: 每个账户的初始同步间隔（秒），之后由自适应调度器调整
+        """
+        self.accounts = {account['name']: account for account in load_accounts(config_file)}
+        self.interval = interval
+        self.shared = SharedResources()
+        self.sync_tools = {}
+        # 每个账户各自根据活跃程度调整同步间隔
+        self.schedulers = {name: AdaptivePollScheduler(base_interval=interval, name=name) for name in self.accounts}
+        self.executor = ThreadPoolExecutor(max_workers=ACCOUNT_WORKERS, thread_name_prefix='account')
+        logging.info(f"多账户模式：共 {len(self.accounts)} 个账户，最多同时同步 {ACCOUNT_WORKERS} 个")
+
+    def run_account(self, name):
+        # 同步单个账户并返回到下一轮同步的等待时间；客户端只在首次或上一轮出错后构建
+        start = time.monotonic()
+        sync_tool = self.sync_tools.get(name)
+        new_posts = 0
+        rate_limits = None
+        try:
+            if sync_tool is None:
+                sync_tool = SyncTool(self.accounts[name], shared=self.shared)
+                self.sync_tools[name] = sync_tool
+            new_posts = sync_tool.run()
+            rate_limits = sync_tool.rate_limit_status()
+            logging.info(f"账户 {name} 同步成功，耗时 {time.monotonic() - start:.2f} 秒")
+        except Exception as e:
+            logging.error(f"账户 {name} 同步失败: {str(e)}")
+            if sync_tool is not None:
+                sync_tool.close()
+            self.sync_tools.pop(name, None)
+        metrics.registry.dump_json()
+        return self.schedulers[name].next_interval(new_posts, rate_limits)
+
+    def run_forever(self):
+        next_run = {name: time.monotonic() for name in self.accounts}
+        running = {}
+        while True:
+            now = time.monotonic()
+            busy = set(running.values())
+            due = sorted((when, name) for name, when in next_run.items() if when <= now and name not in busy)
+            for _, name in due:
+                running[self.executor.submit(self.run_account, name)] = name
+
+            idle = [when for name, when in next_run.items() if name not in running.values()]
+            timeout = max(0.0, min(idle) - time.monotonic()) if idle else None
+            if not running:
+                time.sleep(timeout or 0)
+                continue
+            done, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    interval = future.result()
+                except Exception as e:
+                    logging.error(f"账户 {name} 调度出错: {str(e)}")
+                    interval = self.schedulers[name].max_interval
+                next_run[name] = time.monotonic() + interval
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        for sync_tool in self.sync_tools.values():
+            sync_tool.close()
+        self.shared.close()
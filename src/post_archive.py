@@ -0,0 +1,335 @@
+if __name__ == '__main__':
+    # 作为命令行工具运行时加载环境变量；被同步工具导入时由入口脚本负责
+    from dotenv import load_dotenv
+    load_dotenv()
+
+import os
+import sys
+import gzip
+import json
+import zlib
+import logging
+import argparse
+import threading
+from datetime import datetime
+from types import SimpleNamespace
+
+# 单个归档分段的大小上限（MB），超过后写入新的分段
+ARCHIVE_SEGMENT_MB = int(os.environ.get('ARCHIVE_SEGMENT_MB', 64))
+# 缓冲多少条记录后压缩为一个gzip块写入分段
+ARCHIVE_FLUSH_RECORDS = int(os.environ.get('ARCHIVE_FLUSH_RECORDS', 200))
+
+PLATFORMS = ('mastodon', 'bluesky')
+# 补全历史时每页获取的帖子数（各平台的单页上限）
+BACKFILL_PAGE_LIMITS = {'mastodon': 40, 'bluesky': 100}
+
+
+def json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"无法序列化 {type(value).__name__}")
+
+
+def mastodon_record(status):
+    """
+    把嘟文转换为归档记录，转发的嘟文不是本账户的内容，返回None
+    :return: (post_id, 排序键, 数据)
+    """
+    if status.get('reblog') is not None:
+        return None
+    created_at = status['created_at']
+    return str(status['id']), created_at.isoformat() if isinstance(created_at, datetime) else str(created_at), status
+
+
+def bluesky_record(item):
+    """
+    把作者动态中的条目转换为归档记录，转发和不带完整视图的帖子（例如Jetstream事件）返回None
+    :return: (post_id, 排序键, 数据)
+    """
+    post_view = item.post
+    if getattr(item, 'reason', None) is not None or not hasattr(post_view, 'model_dump'):
+        return None
+    return post_view.cid, post_view.indexed_at, post_view.model_dump(by_alias=True, mode='json', exclude_none=True)
+
+
+def load_mastodon_status(data):
+    # 与 Mastodon.py 解析API响应时一样，把时间字段解析为datetime，字典支持属性访问
+    from mastodon import Mastodon
+    return json.loads(json.dumps(data), object_hook=Mastodon._Mastodon__json_hooks)
+
+
+def load_bluesky_item(data):
+    # 还原为与作者动态条目相同结构的对象
+    from atproto_client import models
+    return SimpleNamespace(post=models.AppBskyFeedDefs.PostView.model_validate(data), reason=None)
+
+
+class PostArchive:
+    def __init__(self, directory='data/archive', segment_bytes=None, flush_records=None):
+        """
+        原帖的只追加归档：每个平台一组gzip压缩的JSONL分段，按大小轮转
+        记录先在内存中缓冲，每 flush_records 条压缩为一个gzip块追加到分段末尾；
+        索引文件按 post_id 记录所在的分段和块的偏移，读取单条记录时只解压一个块
+        :param directory: 归档目录
+        :param segment_bytes: 单个分段的大小上限（字节）
+        :param flush_records: 每个gzip块的记录数
+        """
+        self.directory = directory
+        self.segment_bytes = segment_bytes or ARCHIVE_SEGMENT_MB * 1024 * 1024
+        self.flush_records = flush_records or ARCHIVE_FLUSH_RECORDS
+        os.makedirs(self.directory, exist_ok=True)
+        self.index_file = os.path.join(self.directory, 'index.tsv')
+        self.state_file = os.path.join(self.directory, 'backfill.json')
+        # (platform, post_id) -> (排序键, 分段序号, 块偏移)
+        self.index = {}
+        self.segments = {platform: 0 for platform in PLATFORMS}
+        self.buffers = {platform: [] for platform in PLATFORMS}
+        self.buffered_ids = {platform: set() for platform in PLATFORMS}
+        self._lock = threading.Lock()
+        self.load_index()
+
+    def segment_path(self, platform, segment):
+        return os.path.join(self.directory, f'{platform}-{segment:05d}.jsonl.gz')
+
+    def load_index(self):
+        # 索引行: platform \t post_id \t 排序键 \t 分段序号 \t 块偏移；后写入的行覆盖先写入的行
+        if not os.path.exists(self.index_file):
+            return
+        with open(self.index_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.rstrip('\n').split('\t')
+                if len(parts) != 5:
+                    # 写入中断留下的不完整的行
+                    continue
+                platform, post_id, sort_key, segment, offset = parts
+                self.index[(platform, post_id)] = (sort_key, int(segment), int(offset))
+                self.segments[platform] = max(self.segments.get(platform, 0), int(segment))
+        logging.info(f"已加载归档索引: {len(self.index)} 条记录")
+
+    def contains(self, platform, post_id):
+        with self._lock:
+            return (platform, str(post_id)) in self.index or str(post_id) in self.buffered_ids[platform]
+
+    def count(self, platform):
+        with self._lock:
+            return sum(1 for key in self.index if key[0] == platform) + len(self.buffers[platform])
+
+    def append(self, platform, record):
+        """
+        追加一条记录，已归档的记录不重复写入
+        :param record: mastodon_record / bluesky_record 的返回值，为None时忽略
+        :return: 是否写入
+        """
+        if record is None:
+            return False
+        post_id, sort_key, data = record
+        with self._lock:
+            if (platform, post_id) in self.index or post_id in self.buffered_ids[platform]:
+                return False
+            self.buffers[platform].append((post_id, sort_key, data))
+            self.buffered_ids[platform].add(post_id)
+            if len(self.buffers[platform]) >= self.flush_records:
+                self._flush(platform)
+        return True
+
+    def flush(self):
+        # 把缓冲的记录写入分段，每轮同步结束和关闭时调用
+        with self._lock:
+            for platform in PLATFORMS:
+                self._flush(platform)
+
+    def _flush(self, platform):
+        buffer = self.buffers[platform]
+        if not buffer:
+            return
+        segment = self.segments[platform]
+        path = self.segment_path(platform, segment)
+        if os.path.exists(path) and os.path.getsize(path) >= self.segment_bytes:
+            segment += 1
+            self.segments[platform] = segment
+            path = self.segment_path(platform, segment)
+        lines = ''.join(json.dumps({'id': post_id, 'key': sort_key, 'data': data}, ensure_ascii=False, default=json_default) + '\n'
+                        for post_id, sort_key, data in buffer)
+        member = gzip.compress(lines.encode('utf-8'))
+        try:
+            # 先写数据再写索引，中断时最多留下一个没有索引的块，补全时会重新写入
+            with open(path, 'ab') as f:
+                offset = f.tell()
+                f.write(member)
+            with open(self.index_file, 'a', encoding='utf-8') as f:
+                f.write(''.join(f'{platform}\t{post_id}\t{sort_key}\t{segment}\t{offset}\n' for post_id, sort_key, _ in buffer))
+        except Exception as e:
+            logging.error(f"写入归档失败: {str(e)}")
+            return
+        for post_id, sort_key, _ in buffer:
+            self.index[(platform, post_id)] = (sort_key, segment, offset)
+        buffer.clear()
+        self.buffered_ids[platform].clear()
+
+    def read_member(self, platform, segment, offset):
+        """
+        解压一个gzip块
+        :return: post_id -> 记录数据
+        """
+        decompressor = zlib.decompressobj(wbits=31)
+        chunks = []
+        with open(self.segment_path(platform, segment), 'rb') as f:
+            f.seek(offset)
+            while not decompressor.eof:
+                data = f.read(64 * 1024)
+                if not data:
+                    break
+                chunks.append(decompressor.decompress(data))
+        records = {}
+        for line in b''.join(chunks).decode('utf-8').splitlines():
+            entry = json.loads(line)
+            records[entry['id']] = entry['data']
+        return records
+
+    def get(self, platform, post_id):
+        # 按 post_id 读取一条记录的数据，不存在时返回None
+        self.flush()
+        location = self.index.get((platform, str(post_id)))
+        if location is None:
+            return None
+        return self.read_member(platform, location[1], location[2]).get(str(post_id))
+
+    def iter_records(self, platform, since=None):
+        """
+        按排序键（发布时间）从旧到新遍历一个平台的所有记录，同一时间只解压一个块
+        :param since: 只返回排序键不早于该值的记录
+        :return: (post_id, 数据) 的迭代器
+        """
+        self.flush()
+        with self._lock:
+            entries = sorted((sort_key, post_id, segment, offset) for (entry_platform, post_id), (sort_key, segment, offset)
+                             in self.index.items() if entry_platform == platform and (since is None or sort_key >= since))
+        member_location = None
+        member = {}
+        for _, post_id, segment, offset in entries:
+            if member_location != (segment, offset):
+                member_location = (segment, offset)
+                member = self.read_member(platform, segment, offset)
+            if post_id in member:
+                yield post_id, member[post_id]
+
+    def backfill_state(self):
+        if not os.path.exists(self.state_file):
+            return {}
+        with open(self.state_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def save_backfill_state(self, state):
+        tmp_file = f'{self.state_file}.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp_file, self.state_file)
+
+    def close(self):
+        self.flush()
+
+
+def backfill(archive, sync_tool, platform):
+    """
+    从最新到最旧翻页获取账户的全部历史帖子并写入归档，每页写入后保存翻页位置，中断后从该位置继续
+    已经补全过的平台从最新的帖子开始，遇到整页都已归档时停止；内存中只保留当前一页
+    :return: 新写入的记录数
+    """
+    state = archive.backfill_state()
+    position = state.get(platform) or {}
+    refresh = bool(position.get('done'))
+    cursor = None if refresh else position.get('cursor')
+    limit = BACKFILL_PAGE_LIMITS[platform]
+    account_id = sync_tool.mastodon.account_verify_credentials()['id'] if platform == 'mastodon' else None
+    written = 0
+    while True:
+        if platform == 'mastodon':
+            page = sync_tool.mastodon.account_statuses(account_id, max_id=cursor, limit=limit)
+            records = [mastodon_record(status) for status in page]
+            cursor = str(page[-1]['id']) if page else None
+        else:
+            # 与同步时获取作者动态一样不包括回复
+            data = sync_tool.bluesky.get_author_feed(actor=sync_tool.bluesky.me.did, filter='posts_no_replies',
+                                                     limit=limit, cursor=cursor)
+            page = data.feed
+            records = [bluesky_record(item) for item in page]
+            cursor = data.cursor
+        added = sum(1 for record in records if archive.append(platform, record))
+        written += added
+        archive.flush()
+        done = not page or not cursor or (refresh and not added)
+        state[platform] = {'done': True} if done else {'cursor': cursor}
+        archive.save_backfill_state(state)
+        if done:
+            break
+        logging.info(f"{platform} 历史补全: 已写入 {written} 条")
+    logging.info(f"{platform} 历史补全完成: 新写入 {written} 条, 归档共 {archive.count(platform)} 条")
+    return written
+
+
+def resync(archive, sync_tool, platform, since=None):
+    """
+    以归档为输入，按发布时间从旧到新把尚未同步的原帖同步到另一平台，已同步的帖子由同步状态跳过
+    :return: 同步统计
+    """
+    stats = {'fetched': 0, 'synced': 0, 'skipped': 0, 'failed': 0, 'deferred': 0}
+    if platform == 'mastodon':
+        syncer, load = sync_tool.mastodon_to_bluesky_syncer, load_mastodon_status
+    else:
+        syncer, load = sync_tool.bluesky_to_mastodon_syncer, load_bluesky_item
+
+    def publish(post, prepared):
+        stats['fetched'] += 1
+        syncer.publish_or_defer(post, prepared, stats)
+
+    # 与正常同步一样经过流水线：后面帖子的媒体处理与前面帖子的发布重叠
+    syncer.pipeline.run((load(data) for _, data in archive.iter_records(platform, since=since)),
+                        syncer.prepare_unless_queued, publish)
+    logging.info(f"从归档重新同步 {platform}: 读取 {stats['fetched']} 条, 同步 {stats['synced']} 条, "
+                 f"跳过 {stats['skipped']} 条, 进入重试队列 {stats['deferred']} 条")
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='原帖归档：补全账户的全部历史，或以归档为输入重新同步')
+    parser.add_argument('command', choices=('backfill', 'resync', 'stats'))
+    parser.add_argument('--platform', choices=PLATFORMS + ('all',), default='all')
+    parser.add_argument('--since', help='resync 只处理发布时间不早于该值（ISO 8601）的帖子')
+    parser.add_argument('--account', help='多账户模式（设置了 ACCOUNTS_CONFIG）下要处理的账户名')
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(), format='%(asctime)s - %(levelname)s - %(message)s')
+
+    from sync_tool import SyncTool
+    from account_config import account_from_env, load_accounts
+    accounts_config = os.environ.get('ACCOUNTS_CONFIG', '')
+    if accounts_config:
+        accounts = {account['name']: account for account in load_accounts(accounts_config)}
+        if args.account not in accounts:
+            parser.error(f"请用 --account 指定账户: {', '.join(accounts)}")
+        account = accounts[args.account]
+    else:
+        account = account_from_env()
+    # 命令行工具不启动流式连接，归档由本命令写入
+    account = dict(account, mastodon_streaming=False, bluesky_jetstream=False, archive_posts=False)
+    archive = PostArchive(os.path.join(account.get('data_dir') or 'data', 'archive'))
+    platforms = PLATFORMS if args.platform == 'all' else (args.platform,)
+    if args.command == 'stats':
+        for platform in platforms:
+            print(f"{platform}: {archive.count(platform)} 条")
+        return 0
+
+    sync_tool = SyncTool(account)
+    try:
+        for platform in platforms:
+            if args.command == 'backfill':
+                backfill(archive, sync_tool, platform)
+            else:
+                resync(archive, sync_tool, platform, since=args.since)
+    finally:
+        archive.close()
+        sync_tool.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,276 @@
+import os
+import logging
+from mastodon import MastodonNotFoundError
+from mastodon_to_bluesky_sync import mastodon_content_hash, MASTODON_PAGE_LIMIT
+
+# 每轮检查最近的多少页原帖（Mastodon每页40条，Bluesky每批25条）
+RECONCILE_RECENT_PAGES = int(os.environ.get('RECONCILE_RECENT_PAGES', 1))
+# 每轮再沿着历史记录向前巡检多少页，巡检到最早的记录后从头开始
+RECONCILE_SWEEP_PAGES = int(os.environ.get('RECONCILE_SWEEP_PAGES', 1))
+# getPosts 单次最多查询的帖子数
+BLUESKY_GET_POSTS_LIMIT = 25
+# 每轮最多逐条确认的疑似删除的嘟文数
+MASTODON_DELETE_CHECKS = 20
+
+
+def rkey_from_uri(uri):
+    # at://did/collection/rkey
+    return uri.rsplit('/', 1)[-1]
+
+
+class PostReconciler:
+    def __init__(self, mastodon_to_bluesky_syncer, bluesky_to_mastodon_syncer, sync_status_manager, cursor_store):
+        """
+        把原帖的编辑和删除同步到另一平台上对应的帖子
+        只检查同步状态中带元数据（原帖所在平台、内容哈希、uri）的记录：
+        - Mastodon：按页获取本账户的嘟文，与记录的内容哈希对比找出编辑过的嘟文，记录中有、这一页的ID范围内却没有的嘟文逐条确认是否已删除
+        - Bluesky：用 getPosts 按 uri 批量查询，CID变化说明记录被修改，查询不到的逐条确认是否已删除
+        每轮只检查最近的原帖和历史记录中的一小段（巡检位置保存在同步游标中），不会重新获取全部历史帖子
+        :param mastodon_to_bluesky_syncer: MastodonToBlueskySyncer，复用其转换和发布流程
+        :param bluesky_to_mastodon_syncer: BlueskyToMastodonSyncer，复用其转换流程
+        :param sync_status_manager: 同步状态管理器
+        :param cursor_store: 同步游标存储，保存巡检位置
+        """
+        self.m2b = mastodon_to_bluesky_syncer
+        self.b2m = bluesky_to_mastodon_syncer
+        self.sync_status_manager = sync_status_manager
+        self.cursor_store = cursor_store
+        self._mastodon_account_id = None
+
+    @property
+    def mastodon(self):
+        return self.m2b.mastodon
+
+    @property
+    def bluesky(self):
+        # 重新登录后同步器会换用新的客户端
+        return self.m2b.bluesky
+
+    def reconcile(self):
+        """
+        检查一轮编辑和删除
+        :return: 统计：检查、编辑和删除的帖子数
+        """
+        stats = {'checked': 0, 'edited': 0, 'deleted': 0}
+        for name, check in (('Mastodon', self.reconcile_mastodon), ('Bluesky', self.reconcile_bluesky)):
+            try:
+                check(stats)
+            except Exception as e:
+                logging.error(f"检查{name}帖子的编辑和删除时出错: {str(e)}")
+                logging.exception("异常详情:")
+        if stats['edited'] or stats['deleted']:
+            logging.info(f"编辑和删除同步: 检查了 {stats['checked']} 条帖子, 同步了 {stats['edited']} 次编辑, {stats['deleted']} 次删除")
+        return stats
+
+    def reconcile_mastodon(self, stats):
+        if not self.sync_status_manager.origin_count('mastodon'):
+            return
+        if self._mastodon_account_id is None:
+            self._mastodon_account_id = self.mastodon.account_verify_credentials().id
+
+        # 最近的几页：第一页没有上界，比它更新的记录只可能是已删除的嘟文
+        max_id = None
+        for _ in range(RECONCILE_RECENT_PAGES):
+            max_id = self.check_mastodon_page(max_id, stats)
+            if max_id is None:
+                break
+
+        # 历史巡检从上次停下的位置继续，到达最早的嘟文后从头开始
+        sweep_max_id = self.cursor_store.get('reconcile_mastodon_max_id') or max_id
+        if sweep_max_id is None:
+            return
+        for _ in range(RECONCILE_SWEEP_PAGES):
+            sweep_max_id = self.check_mastodon_page(sweep_max_id, stats)
+            if sweep_max_id is None:
+                break
+        self.cursor_store.set('reconcile_mastodon_max_id', sweep_max_id)
+
+    def check_mastodon_page(self, max_id, stats):
+        """
+        检查 max_id 之前的一页嘟文
+        :return: 下一页的 max_id，已到最早的嘟文时返回None
+        """
+        page = self.mastodon.account_statuses(self._mastodon_account_id, max_id=max_id, limit=MASTODON_PAGE_LIMIT)
+        seen = set()
+        for status in page:
+            seen.add(str(status.id))
+            entries = [entry for entry in self.sync_status_manager.get_entries(status.id, 'mastodon_to_bluesky')
+                       if entry[2] is not None and entry[2].get('origin') == 'mastodon']
+            if not entries:
+                continue
+            stats['checked'] += 1
+            if entries[0][2].get('hash') != mastodon_content_hash(status):
+                if self.apply_mastodon_edit(status, entries):
+                    stats['edited'] += 1
+
+        # 这一页覆盖的ID范围内，同步状态中有而列表中没有的嘟文可能已被删除
+        last_page = len(page) < MASTODON_PAGE_LIMIT
+        low = 0 if last_page else min(int(status.id) for status in page)
+        if max_id is not None:
+            high = int(max_id) - 1
+        else:
+            latest = self.sync_status_manager.latest_origin_ids('mastodon', 1)
+            high = int(latest[0]) if latest else 0
+        missing = [mastodon_id for mastodon_id in self.sync_status_manager.origin_ids_between('mastodon', low, high)
+                   if mastodon_id not in seen]
+        for mastodon_id in missing[:MASTODON_DELETE_CHECKS]:
+            try:
+                self.mastodon.status(mastodon_id)
+            except MastodonNotFoundError:
+                if self.apply_mastodon_delete(mastodon_id):
+                    stats['deleted'] += 1
+        return None if last_page else str(low)
+
+    def apply_mastodon_edit(self, status, entries=None):
+        """
+        把编辑后的嘟文同步到Bluesky：Bluesky不支持编辑帖子，删除原来的帖子（或帖子串）后重新发布
+        编辑后不再符合同步条件（改为非公开、加入了提及等）的嘟文只删除原来的帖子，不重新发布
+        :return: 是否处理了编辑，嘟文正在由其他线程同步时返回False
+        """
+        entries = entries or self.sync_status_manager.get_entries(status.id, 'mastodon_to_bluesky')
+        eligible = self.m2b.is_eligible(status)
+        if eligible:
+            logging.info(f"Mastodon嘟文 {status.id} 已编辑，重新发布到Bluesky")
+            # 图片上传等耗时操作在预留嘟文之前完成；预留期间同步方向不会把删除后、重新发布前的嘟文当作新嘟文发布
+            bluesky_posts = self.m2b.convert_mastodon_to_bluesky(status)
+        else:
+            logging.info(f"Mastodon嘟文 {status.id} 编辑后不再同步，删除Bluesky上对应的帖子")
+        with self.sync_status_manager.publishing(status.id, 'mastodon_to_bluesky') as reserved:
+            if not reserved:
+                logging.info(f"Mastodon嘟文 {status.id} 正在同步，下次检查时再处理编辑")
+                return False
+            self.delete_bluesky_mirrors(entries)
+            if not eligible:
+                return True
+            try:
+                # 已持有预留，直接发布，不经过会等待另一方向的同步状态检查
+                self.m2b.publish_reserved(status, bluesky_posts)
+            except Exception as e:
+                # 原来的帖子已删除，交给重试队列重新发布
+                logging.error(f"重新发布编辑后的Mastodon嘟文 {status.id} 时出错: {str(e)}")
+                self.m2b.defer(status, e)
+        return True
+
+    def apply_mastodon_delete(self, mastodon_id):
+        entries = [entry for entry in self.sync_status_manager.get_entries(mastodon_id, 'mastodon_to_bluesky')
+                   if entry[2] is not None and entry[2].get('origin') == 'mastodon']
+        if not entries:
+            return False
+        logging.info(f"Mastodon嘟文 {mastodon_id} 已删除，删除Bluesky上对应的 {len(entries)} 条帖子")
+        with self.sync_status_manager.publishing(mastodon_id, 'mastodon_to_bluesky') as reserved:
+            if not reserved:
+                return False
+            self.delete_bluesky_mirrors(entries)
+        return True
+
+    def delete_bluesky_mirrors(self, entries):
+        for mastodon_id, bluesky_id, meta in entries:
+            if meta and meta.get('uri'):
+                self.bluesky.com.atproto.repo.delete_record({
+                    'repo': self.bluesky.me.did,
+                    'collection': 'app.bsky.feed.post',
+                    'rkey': rkey_from_uri(meta['uri']),
+                })
+            self.sync_status_manager.remove_synced(mastodon_id, bluesky_id)
+
+    def reconcile_bluesky(self, stats):
+        if not self.sync_status_manager.origin_count('bluesky'):
+            return
+        # 最近同步的几批，加上从巡检位置（同步后的嘟文ID，与同步顺序一致）之后的几批
+        recent = self.sync_status_manager.latest_origin_ids('bluesky', RECONCILE_RECENT_PAGES * BLUESKY_GET_POSTS_LIMIT)
+        sweep_size = RECONCILE_SWEEP_PAGES * BLUESKY_GET_POSTS_LIMIT
+        after = int(self.cursor_store.get('reconcile_bluesky_after') or 0)
+        sweep = self.sync_status_manager.origin_ids_between('bluesky', after + 1, limit=sweep_size)
+        # 巡检到最新的记录后从头开始
+        self.cursor_store.set('reconcile_bluesky_after', sweep[-1] if sweep_size and len(sweep) == sweep_size else None)
+
+        checked = set()
+        batch = []
+        for mastodon_id in recent + sweep:
+            if mastodon_id in checked:
+                continue
+            checked.add(mastodon_id)
+            for entry in self.sync_status_manager.get_entries(mastodon_id, 'mastodon_to_bluesky'):
+                if entry[2] is not None and entry[2].get('origin') == 'bluesky':
+                    batch.append(entry)
+            if len(batch) == BLUESKY_GET_POSTS_LIMIT:
+                self.check_bluesky_batch(batch, stats)
+                batch = []
+        if batch:
+            self.check_bluesky_batch(batch, stats)
+
+    def check_bluesky_batch(self, entries, stats):
+        posts = {post.uri: post for post in self.bluesky.get_posts([entry[2]['uri'] for entry in entries]).posts}
+        for entry in entries:
+            stats['checked'] += 1
+            post = posts.get(entry[2]['uri'])
+            if post is None:
+                # 查询不到的帖子也可能只是被屏蔽，到自己的仓库中确认记录已不存在
+                if not self.bluesky_record_exists(entry[2]['uri']):
+                    if self.apply_bluesky_delete(entry[2]['uri']):
+                        stats['deleted'] += 1
+            elif post.cid != entry[1]:
+                if self.apply_bluesky_edit(post):
+                    stats['edited'] += 1
+
+    def bluesky_record_exists(self, uri):
+        try:
+            self.bluesky.com.atproto.repo.get_record({
+                'repo': self.bluesky.me.did,
+                'collection': 'app.bsky.feed.post',
+                'rkey': rkey_from_uri(uri),
+            })
+            return True
+        except Exception as e:
+            if 'RecordNotFound' in str(e) or 'Could not locate record' in str(e):
+                return False
+            raise
+
+    def apply_bluesky_edit(self, post_view):
+        """
+        把修改后的Bluesky帖子同步到Mastodon：编辑对应的嘟文，并把同步记录换成新的CID
+        :param post_view: 帖子的最新版本（cid、uri、record、embed）
+        """
+        entry = self.sync_status_manager.get_entry_by_uri(post_view.uri)
+        if entry is None or len(entry) < 3 or entry[2].get('origin') != 'bluesky' or entry[1] == post_view.cid:
+            return False
+        mastodon_id, old_cid, meta = entry
+        logging.info(f"Bluesky帖子 {post_view.uri} 已修改，编辑Mastodon嘟文 {mastodon_id}")
+        text, media_ids = self.b2m.convert_bluesky_to_mastodon(post_view)
+        # 预留新的CID，同步方向在记录更新前不会把修改后的帖子当作新帖子发布
+        with self.sync_status_manager.publishing(post_view.cid, 'bluesky_to_mastodon') as reserved:
+            if not reserved:
+                return False
+            self.mastodon.status_update(mastodon_id, status=text, media_ids=media_ids or None)
+            self.sync_status_manager.remove_synced(mastodon_id, old_cid)
+            self.sync_status_manager.mark_as_synced(post_view.cid, mastodon_id, 'bluesky_to_mastodon', meta=meta)
+        for url, _ in self.b2m.media_sources(post_view):
+            self.b2m.media_cache.mark_attached('mastodon', url)
+        return True
+
+    def apply_bluesky_delete(self, uri):
+        entry = self.sync_status_manager.get_entry_by_uri(uri)
+        if entry is None or len(entry) < 3 or entry[2].get('origin') != 'bluesky':
+            return False
+        mastodon_id, bluesky_id, _ = entry
+        logging.info(f"Bluesky帖子 {uri} 已删除，删除Mastodon嘟文 {mastodon_id}")
+        with self.sync_status_manager.publishing(bluesky_id, 'bluesky_to_mastodon') as reserved:
+            if not reserved:
+                return False
+            try:
+                self.mastodon.status_delete(mastodon_id)
+            except MastodonNotFoundError:
+                pass
+            self.sync_status_manager.remove_synced(mastodon_id, bluesky_id)
+        return True
+
+    def handle_mastodon_update(self, status):
+        # 流式接口推送的嘟文编辑事件
+        entries = [entry for entry in self.sync_status_manager.get_entries(status.id, 'mastodon_to_bluesky')
+                   if entry[2] is not None and entry[2].get('origin') == 'mastodon']
+        if entries and entries[0][2].get('hash') != mastodon_content_hash(status):
+            self.apply_mastodon_edit(status, entries)
+
+    def handle_mastodon_delete(self, status_id):
+        # 流式接口推送的嘟文删除事件（包括关注对象的嘟文，不在同步状态中的直接忽略）
+        self.apply_mastodon_delete(status_id)
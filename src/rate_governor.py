@@ -0,0 +1,270 @@
+import os
+import time
+import logging
+import threading
+from urllib.parse import urlparse
+from email.utils import parsedate_to_datetime
+from datetime import datetime
+from atproto_client.exceptions import AtProtocolError
+from atproto_client.request import Request
+import metrics
+from adaptive_scheduler import RATE_LIMIT_RESERVE
+
+# 需要等待的时间超过该值（秒）时不再等待，直接抛出 RateLimitExceeded，帖子进入重试队列
+RATE_LIMIT_MAX_WAIT = float(os.environ.get('RATE_LIMIT_MAX_WAIT', 120))
+# 按剩余额度均匀发送时允许的突发请求数
+RATE_LIMIT_BURST = 5
+# 收到429但响应没有说明何时重试时的等待时间（秒）
+RATE_LIMIT_DEFAULT_BACKOFF = 60
+# 短于该值（秒）的等待忽略不计，避免时钟精度不足时反复等待极短的时间
+MIN_WAIT = 0.001
+
+ENDPOINT_CLASSES = ('read', 'write', 'media')
+
+
+class RateLimitExceeded(Exception):
+    def __init__(self, platform, endpoint, wait):
+        super().__init__(f"{platform} {endpoint} 请求的速率限制额度已用完，需要等待 {wait:.0f} 秒")
+        self.wait = wait
+
+
+def parse_reset(value, now):
+    """
+    解析速率限制的重置时间，支持Unix时间戳（Bluesky）、相对秒数和ISO 8601时间（Mastodon）
+    :return: 重置时间的时间戳，无法解析时返回None
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        number = float(value)
+        # 足够大的数字是时间戳，否则是距离现在的秒数
+        return number if number > 1e9 else now + number
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
+
+
+def parse_retry_after(value, now):
+    # Retry-After 可以是秒数或HTTP日期
+    if value is None:
+        return None
+    value = str(value).strip()
+    if value.isdigit():
+        return now + int(value)
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def header_int(headers, name):
+    value = headers.get(name)
+    return int(value) if value is not None and str(value).strip().isdigit() else None
+
+
+class TokenBucket:
+    def __init__(self):
+        """
+        单个平台、单类请求的令牌桶：按服务器返回的剩余额度和重置时间计算补充速率，
+        把剩余额度均匀分配到重置之前，不会在窗口结束前用完；额度低于保留值时等到重置
+        """
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        self.tokens = float(RATE_LIMIT_BURST)
+        self.capacity = float(RATE_LIMIT_BURST)
+        self.rate = None
+        self.updated = None
+        self.blocked_until = 0.0
+
+    def reserve(self):
+        return max(1, int((self.limit or 0) * RATE_LIMIT_RESERVE))
+
+    def wait_time(self, now):
+        # 发送下一个请求之前需要等待的秒数
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if self.remaining is None:
+            return 0.0
+        if self.reset is not None and now >= self.reset:
+            # 服务器的窗口已经重置，下一次响应会带来新的额度
+            self.remaining = self.limit
+            self.reset = None
+            self.rate = None
+            self.tokens = self.capacity
+            return 0.0
+        if self.remaining <= self.reserve() and self.reset is not None:
+            return self.reset - now
+        if self.rate:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return (1 - self.tokens) / self.rate
+        return 0.0
+
+    def consume(self):
+        self.tokens -= 1
+        if self.remaining is not None:
+            self.remaining -= 1
+
+    def observe(self, limit, remaining, reset, now):
+        # 以服务器返回的额度为准，重新计算补充速率
+        self.limit = limit if limit is not None else self.limit
+        self.remaining = remaining
+        self.reset = reset
+        if reset is not None and reset > now:
+            self.rate = max(remaining - self.reserve(), 0) / (reset - now) or None
+            self.capacity = float(max(1, min(RATE_LIMIT_BURST, remaining)))
+            self.tokens = min(self.tokens, self.capacity)
+            self.updated = now
+
+    def block(self, until):
+        self.blocked_until = max(self.blocked_until, until)
+        self.remaining = 0 if self.remaining is not None else None
+
+    def status(self, now):
+        reset = self.reset
+        remaining = self.remaining
+        if now < self.blocked_until:
+            reset = max(reset or 0, self.blocked_until)
+            remaining = 0
+        return {'remaining': remaining, 'limit': self.limit, 'reset': reset}
+
+
+class RateGovernor:
+    def __init__(self, clock=None, sleep=None, max_wait=None):
+        """
+        一个账户的出站请求调度：按平台和请求类别（读取、写入、媒体上传）分别维护令牌桶，
+        请求前按剩余额度控制节奏，响应后用 X-RateLimit-* / RateLimit-* 头更新，收到429时遵守 Retry-After
+        :param clock: 返回当前时间戳的函数，默认 time.time，测试时可传入模拟时钟
+        :param sleep: 等待函数，默认 time.sleep
+        :param max_wait: 单次最长等待（秒），超过时抛出 RateLimitExceeded
+        """
+        self.clock = clock or time.time
+        self.sleep = sleep or time.sleep
+        self.max_wait = RATE_LIMIT_MAX_WAIT if max_wait is None else max_wait
+        self.buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, platform, endpoint):
+        key = (platform, endpoint)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket()
+        return bucket
+
+    def acquire(self, platform, endpoint):
+        """
+        发送请求前调用，额度不足时等待；需要等待的时间超过上限时抛出 RateLimitExceeded
+        """
+        waited = 0.0
+        while True:
+            with self._lock:
+                bucket = self.bucket(platform, endpoint)
+                wait = bucket.wait_time(self.clock())
+                if wait < MIN_WAIT:
+                    bucket.consume()
+                    break
+            if wait > self.max_wait:
+                raise RateLimitExceeded(platform, endpoint, wait)
+            logging.debug(f"{platform} {endpoint} 请求等待 {wait:.2f} 秒以免超过速率限制")
+            self.sleep(wait)
+            waited += wait
+        if waited:
+            metrics.rate_limit_wait_seconds.observe(waited, platform=platform, endpoint=endpoint)
+
+    def observe(self, platform, endpoint, status_code, headers):
+        """
+        根据响应更新令牌桶
+        :param headers: 响应头（不区分大小写的字典或普通字典）
+        """
+        headers = {str(name).lower(): value for name, value in (headers or {}).items()}
+        now = self.clock()
+        prefix = 'x-ratelimit-' if 'x-ratelimit-remaining' in headers else 'ratelimit-'
+        remaining = header_int(headers, f'{prefix}remaining')
+        with self._lock:
+            bucket = self.bucket(platform, endpoint)
+            if remaining is not None:
+                bucket.observe(header_int(headers, f'{prefix}limit'), remaining,
+                               parse_reset(headers.get(f'{prefix}reset'), now), now)
+            if status_code in (429, 503):
+                until = parse_retry_after(headers.get('retry-after'), now)
+                if until is None and status_code == 429:
+                    # 重置时间刚过（时钟误差或取整）时稍等再发
+                    until = max(bucket.reset, now + 1) if bucket.reset else now + RATE_LIMIT_DEFAULT_BACKOFF
+                if until is not None:
+                    bucket.block(until)
+                    logging.warning(f"{platform} {endpoint} 请求被限流（{status_code}），{until - now:.0f} 秒后再发送")
+        if status_code == 429:
+            metrics.rate_limited_total.inc(platform=platform, endpoint=endpoint)
+
+    def status(self, endpoints=('read', 'write')):
+        """
+        各平台各类请求的剩余额度，供调度器参考；媒体上传额度用完时只推迟带媒体的帖子，默认不影响同步间隔
+        :return: 列表，每项包含 platform、endpoint、remaining、limit、reset（重置时间戳）
+        """
+        now = self.clock()
+        with self._lock:
+            return [dict(bucket.status(now), platform=platform, endpoint=endpoint)
+                    for (platform, endpoint), bucket in sorted(self.buckets.items()) if endpoint in endpoints]
+
+
+def mastodon_endpoint(method, url):
+    path = urlparse(url).path
+    if method.upper() == 'POST' and path.rstrip('/') in ('/api/v1/media', '/api/v2/media'):
+        return 'media'
+    return 'read' if method.upper() in ('GET', 'HEAD') else 'write'
+
+
+def bluesky_endpoint(method, url):
+    nsid = urlparse(url).path.rsplit('/', 1)[-1]
+    if nsid == 'com.atproto.repo.uploadBlob':
+        return 'media'
+    return 'read' if method.upper() == 'GET' else 'write'
+
+
+class GovernedSession:
+    def __init__(self, session, governor):
+        """
+        包装 Mastodon.py 使用的 requests 会话，每个API请求都经过速率限制调度
+        多账户模式下同一实例的账户共用底层会话（连接池），各自的额度分别计算
+        流式接口（session.get）不经过调度
+        """
+        self.session = session
+        self.governor = governor
+
+    def request(self, method, url, **kwargs):
+        endpoint = mastodon_endpoint(method, url)
+        self.governor.acquire('Mastodon', endpoint)
+        response = self.session.request(method, url, **kwargs)
+        self.governor.observe('Mastodon', endpoint, response.status_code, response.headers)
+        return response
+
+    def __getattr__(self, name):
+        return getattr(self.session, name)
+
+
+class GovernedRequest(Request):
+    def __init__(self, governor):
+        """
+        atproto客户端的请求：每个XRPC请求都经过速率限制调度，错误响应（包括429）的头同样用来更新额度
+        """
+        super().__init__()
+        self.governor = governor
+
+    def _send_request(self, method, url, **kwargs):
+        endpoint = bluesky_endpoint(method, url)
+        self.governor.acquire('Bluesky', endpoint)
+        try:
+            response = super()._send_request(method, url, **kwargs)
+        except AtProtocolError as e:
+            response = getattr(e, 'response', None)
+            if response is not None:
+                self.governor.observe('Bluesky', endpoint, getattr(response, 'status_code', None), getattr(response, 'headers', None))
+            raise
+        self.governor.observe('Bluesky', endpoint, response.status_code, response.headers)
+        return response
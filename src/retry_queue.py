@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import random
+import logging
+import threading
+import metrics
+
+# 同一帖子最多尝试的次数，超过后移入死信文件
+RETRY_MAX_ATTEMPTS = int(os.environ.get('RETRY_MAX_ATTEMPTS', 8))
+# 第一次重试前的等待时间（秒），之后每次失败翻倍
+RETRY_BASE_DELAY = int(os.environ.get('RETRY_BASE_DELAY', 60))
+# 两次重试之间的最长等待时间（秒）
+RETRY_MAX_DELAY = int(os.environ.get('RETRY_MAX_DELAY', 6 * 3600))
+
+
+class RetryQueue:
+    def __init__(self, filename='data/retry_queue.json', dead_letter_filename=None):
+        """
+        同步失败的帖子的持久化重试队列
+        每个条目记录尝试次数、下次重试时间和最近一次错误；退避期间不阻塞本轮其他帖子的同步，
+        超过最大尝试次数后移入死信文件（每行一条JSON），不再自动重试
+        :param filename: 保存队列的文件名
+        :param dead_letter_filename: 死信文件名，默认与队列文件同目录的 retry_dead_letter.jsonl
+        """
+        self.filename = filename
+        self.dead_letter_filename = dead_letter_filename or os.path.join(os.path.dirname(filename), 'retry_dead_letter.jsonl')
+        self._lock = threading.Lock()
+        # 正在重试的条目，避免流式线程和轮询线程同时重试同一帖子
+        self._in_flight = set()
+        self.items = self.load_items()
+
+    def load_items(self):
+        """
+        从文件加载队列
+        :return: 条目字典，键为 "方向:帖子ID"
+        """
+        if os.path.exists(self.filename):
+            try:
+                with open(self.filename, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except json.JSONDecodeError:
+                logging.warning(f"无法加载 {self.filename}。创建新的重试队列。")
+        return {}
+
+    def save_items(self):
+        try:
+            directory = os.path.dirname(self.filename)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_filename = f'{self.filename}.tmp'
+            with open(tmp_filename, 'w', encoding='utf-8') as f:
+                json.dump(self.items, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_filename, self.filename)
+        except Exception as e:
+            logging.error(f"保存重试队列失败: {str(e)}")
+
+    @staticmethod
+    def key(direction, post_id):
+        return f'{direction}:{post_id}'
+
+    @staticmethod
+    def backoff(attempts):
+        # 指数退避加随机抖动，避免大量条目在同一时刻重试
+        delay = min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+        return delay * random.uniform(0.8, 1.2)
+
+    def add(self, direction, post_id, error, ref=None):
+        """
+        记录一次同步失败，安排下次重试
+        :param direction: 同步方向 ('mastodon_to_bluesky' 或 'bluesky_to_mastodon')
+        :param post_id: 原始帖子ID
+        :param error: 失败的原因
+        :param ref: 重试时重新获取帖子所需的信息（例如Bluesky帖子的 uri）
+        :return: 队列中的条目，移入死信时返回None
+        """
+        key = self.key(direction, post_id)
+        now = time.time()
+        with self._lock:
+            self._in_flight.discard(key)
+            item = self.items.get(key) or {
+                'direction': direction,
+                'post_id': str(post_id),
+                'ref': ref,
+                'attempts': 0,
+                'first_failed_at': now,
+            }
+            item['attempts'] += 1
+            item['last_error'] = str(error)
+            item['last_failed_at'] = now
+            if item['attempts'] >= RETRY_MAX_ATTEMPTS:
+                metrics.retries_total.inc(direction=direction, event='dead_lettered')
+                self.items.pop(key, None)
+                self.save_items()
+                self.dead_letter(item)
+                return None
+            metrics.retries_total.inc(direction=direction, event='scheduled')
+            item['next_retry'] = now + self.backoff(item['attempts'])
+            self.items[key] = item
+            self.save_items()
+        logging.warning(f"{direction} 帖子 {post_id} 第 {item['attempts']} 次同步失败，"
+                        f"{item['next_retry'] - now:.0f} 秒后重试: {error}")
+        return item
+
+    def dead_letter(self, item):
+        logging.error(f"{item['direction']} 帖子 {item['post_id']} 同步失败 {item['attempts']} 次，"
+                      f"已移入死信文件 {self.dead_letter_filename}: {item['last_error']}")
+        try:
+            directory = os.path.dirname(self.dead_letter_filename)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.dead_letter_filename, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(item, ensure_ascii=False) + '\n')
+        except Exception as e:
+            logging.error(f"写入死信文件失败: {str(e)}")
+
+    def take_due(self, direction, now=None):
+        """
+        取出某个方向已到重试时间的条目，按首次失败的先后排列
+        取出的条目在 done 或 add 之前不会被再次取出
+        :return: 条目列表
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            due = [item for key, item in self.items.items()
+                   if item['direction'] == direction and item['next_retry'] <= now and key not in self._in_flight]
+            due.sort(key=lambda item: item['first_failed_at'])
+            for item in due:
+                self._in_flight.add(self.key(direction, item['post_id']))
+        if due:
+            metrics.retries_total.inc(len(due), direction=direction, event='attempted')
+        return due
+
+    def due_count(self, direction, now=None):
+        """
+        某个方向已到重试时间的条目数，不取出条目
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            return sum(1 for item in self.items.values() if item['direction'] == direction and item['next_retry'] <= now)
+
+    def done(self, direction, post_id):
+        """
+        重试成功（或帖子已不存在）后移出队列
+        """
+        key = self.key(direction, post_id)
+        with self._lock:
+            self._in_flight.discard(key)
+            if self.items.pop(key, None) is not None:
+                self.save_items()
+
+    def contains(self, direction, post_id):
+        with self._lock:
+            return self.key(direction, post_id) in self.items
+
+    def __len__(self):
+        with self._lock:
+            return len(self.items)
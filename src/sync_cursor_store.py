@@ -0,0 +1,62 @@
+import json
+import os
+import logging
+import threading
+
+class SyncCursorStore:
+    def __init__(self, filename='data/sync_cursor.json'):
+        """
+        初始化同步游标存储，用于保存每个同步方向已处理到的位置（高水位）
+        :param filename: 存储游标的文件名
+        """
+        self.filename = filename
+        self._lock = threading.Lock()
+        self.cursors = self.load_cursors()
+
+    def load_cursors(self):
+        """
+        从文件加载游标
+        :return: 游标字典
+        """
+        if os.path.exists(self.filename):
+            try:
+                with open(self.filename, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except json.JSONDecodeError:
+                logging.warning(f"无法加载 {self.filename}。将从最新的帖子重新开始。")
+        return {}
+
+    def save_cursors(self):
+        """
+        将游标保存到文件
+        """
+        try:
+            directory = os.path.dirname(self.filename)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_filename = f'{self.filename}.tmp'
+            with open(tmp_filename, 'w', encoding='utf-8') as f:
+                json.dump(self.cursors, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_filename, self.filename)
+        except Exception as e:
+            logging.error(f"保存同步游标失败: {str(e)}")
+
+    def get(self, key, default=None):
+        """
+        获取游标
+        :param key: 游标名称，例如 'mastodon_since_id'
+        :param default: 游标不存在时返回的默认值
+        """
+        return self.cursors.get(key, default)
+
+    def set(self, key, value):
+        """
+        更新游标并保存，值未变化时不写文件
+        :param key: 游标名称
+        :param value: 游标值
+        """
+        with self._lock:
+            if self.cursors.get(key) == value:
+                return
+            self.cursors[key] = value
+            self.save_cursors()
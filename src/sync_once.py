@@ -0,0 +1,212 @@
+if __name__ == '__main__':
+    # 作为入口运行时加载环境变量，被其他模块导入时不读取 .env
+    from dotenv import load_dotenv
+    load_dotenv()
+
+import os
+import sys
+import json
+import time
+import base64
+import logging
+import argparse
+import requests
+import metrics
+from account_config import account_from_env, load_accounts
+from sync_cursor_store import SyncCursorStore
+from retry_queue import RetryQueue
+
+# 配置日志，LOG_LEVEL=DEBUG 时输出逐条帖子的处理详情
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(), format='%(asctime)s - %(levelname)s - %(message)s')
+
+# 单次运行时，即使没有新帖子，也至少每隔该时间（秒）检查一次原帖的编辑和删除
+SYNC_ONCE_RECONCILE_INTERVAL = int(os.environ.get('SYNC_ONCE_RECONCILE_INTERVAL', 3600))
+# 预检查单个请求的超时（秒）
+PRECHECK_TIMEOUT = 10
+# 访问令牌剩余有效期低于该值（秒）时不用于预检查，交给客户端刷新
+ACCESS_TOKEN_MARGIN = 60
+DEFAULT_BLUESKY_INSTANCE_URL = 'https://bsky.social/xrpc'
+# 表示保存的会话已失效的错误
+BLUESKY_AUTH_ERRORS = ('ExpiredToken', 'InvalidToken', 'AuthenticationRequired', 'AuthMissing')
+
+
+def jwt_expiry(token):
+    # 只解码载荷读取过期时间，不校验签名
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        return json.loads(base64.urlsafe_b64decode(payload)).get('exp')
+    except (IndexError, ValueError):
+        return None
+
+
+class SyncPrecheck:
+    def __init__(self, account, session=None):
+        """
+        单次运行前的轻量检查：只用 requests、保存的同步游标和Bluesky会话判断各方向是否有需要处理的帖子，
+        不导入也不构建 Mastodon.py 和 atproto 客户端
+        :param account: 账户配置字典
+        :param session: requests 会话，默认新建
+        """
+        self.account = account
+        self.data_dir = account.get('data_dir') or 'data'
+        self.session = session or requests.Session()
+        self.cursor_store = SyncCursorStore(os.path.join(self.data_dir, 'sync_cursor.json'))
+        self.retry_queue = RetryQueue(os.path.join(self.data_dir, 'retry_queue.json'))
+        # 保存的Bluesky会话不能直接使用（不存在、访问令牌已过期或被服务器拒绝）时为False，构建客户端时需要确认会话
+        self.bluesky_session_ok = self.load_bluesky_session() is not None
+
+    def get_json(self, url, headers, params=None):
+        response = self.session.get(url, headers=headers, params=params, timeout=PRECHECK_TIMEOUT)
+        response.raise_for_status()
+        return response.json()
+
+    def mastodon_has_new(self):
+        # 上次处理到的嘟文之后是否有新嘟文
+        since_id = self.cursor_store.get('mastodon_since_id')
+        if since_id is None:
+            return True
+        base_url = (self.account.get('mastodon_instance_url') or '').rstrip('/')
+        if not base_url.startswith('http'):
+            base_url = f'https://{base_url}'
+        headers = {'Authorization': f"Bearer {self.account.get('mastodon_access_token')}"}
+        account = self.get_json(f'{base_url}/api/v1/accounts/verify_credentials', headers)
+        statuses = self.get_json(f"{base_url}/api/v1/accounts/{account['id']}/statuses", headers,
+                                 params={'min_id': since_id, 'limit': 1})
+        return bool(statuses)
+
+    def load_bluesky_session(self):
+        """
+        读取保存的会话字符串（handle:::did:::accessJwt:::refreshJwt[:::pdsEndpoint]），只在本地检查访问令牌的有效期
+        :return: (did, 访问令牌, PDS地址)，没有会话或访问令牌已过期时返回None
+        """
+        try:
+            with open(os.path.join(self.data_dir, 'bluesky_token.json'), 'r') as f:
+                token = json.load(f).get('token')
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        fields = (token or '').split(':::')
+        if len(fields) not in (4, 5):
+            return None
+        expiry = jwt_expiry(fields[2])
+        if not expiry or expiry - time.time() < ACCESS_TOKEN_MARGIN:
+            return None
+        return fields[1], fields[2], fields[4] if len(fields) == 5 else None
+
+    def bluesky_has_new(self):
+        # 作者动态中最新一条的时间是否晚于上次处理到的位置
+        last_indexed_at = self.cursor_store.get('bluesky_indexed_at')
+        if last_indexed_at is None:
+            return True
+        session = self.load_bluesky_session()
+        if session is None:
+            # 由客户端登录或刷新会话后再检查
+            return True
+        did, access_jwt, pds_endpoint = session
+        base_url = (pds_endpoint or self.account.get('bluesky_instance_url') or DEFAULT_BLUESKY_INSTANCE_URL).rstrip('/')
+        if not base_url.endswith('/xrpc'):
+            base_url = f'{base_url}/xrpc'
+        response = self.session.get(
+            f'{base_url}/app.bsky.feed.getAuthorFeed',
+            params={'actor': did, 'filter': 'posts_no_replies', 'limit': 1},
+            headers={'Authorization': f'Bearer {access_jwt}'}, timeout=PRECHECK_TIMEOUT)
+        if response.status_code in (400, 401):
+            error = response.json().get('error') if 'json' in response.headers.get('Content-Type', '') else None
+            if response.status_code == 401 or error in BLUESKY_AUTH_ERRORS:
+                logging.info(f"保存的Bluesky会话已失效: {error or response.status_code}")
+                self.bluesky_session_ok = False
+                return True
+        response.raise_for_status()
+        feed = response.json().get('feed') or []
+        if not feed:
+            return False
+        item = feed[0]
+        indexed_at = (item.get('reason') or {}).get('indexedAt') or item['post']['indexedAt']
+        return indexed_at > last_indexed_at
+
+    def pending(self):
+        """
+        检查需要处理的工作
+        :return: (需要同步的方向集合, 是否需要检查编辑和删除)
+        """
+        directions = set()
+        for direction, has_new in (('mastodon_to_bluesky', self.mastodon_has_new),
+                                   ('bluesky_to_mastodon', self.bluesky_has_new)):
+            if self.retry_queue.due_count(direction):
+                directions.add(direction)
+                continue
+            try:
+                if has_new():
+                    directions.add(direction)
+            except Exception as e:
+                # 检查失败时按有新帖子处理，由完整的同步过程重试和报告错误
+                logging.warning(f"检查 {direction} 的新帖子失败: {str(e)}")
+                directions.add(direction)
+        reconcile = (self.account.get('sync_edits_and_deletes', True) and
+                     time.time() - self.cursor_store.get('reconciled_at', 0) >= SYNC_ONCE_RECONCILE_INTERVAL)
+        return directions, reconcile
+
+    def close(self):
+        self.session.close()
+
+
+def run_account(account, force=False):
+    """
+    对一个账户执行单次同步：先做轻量检查，有需要处理的帖子时才导入和构建完整的同步工具
+    :param force: 跳过检查，两个方向都同步并检查编辑和删除
+    :return: 本次获取到的新帖子数
+    """
+    # 单次运行不启动流式连接
+    account = dict(account, mastodon_streaming=False, bluesky_jetstream=False)
+    name = account.get('name', 'default')
+    start = time.monotonic()
+    precheck = SyncPrecheck(account)
+    try:
+        if force:
+            directions, reconcile = None, True
+        else:
+            directions, reconcile = precheck.pending()
+            logging.info(f"账户 {name} 预检查完成，耗时 {time.monotonic() - start:.2f} 秒，"
+                         f"需要同步的方向: {', '.join(sorted(directions)) or '无'}，检查编辑和删除: {'是' if reconcile else '否'}")
+    finally:
+        precheck.close()
+    if directions is not None and not directions and not reconcile:
+        return 0
+
+    from sync_tool import SyncTool
+    sync_tool = SyncTool(account, validate_bluesky_session=not precheck.bluesky_session_ok)
+    try:
+        new_posts = sync_tool.run(directions, reconcile)
+        if reconcile:
+            sync_tool.cursor_store.set('reconciled_at', time.time())
+        return new_posts
+    finally:
+        sync_tool.close()
+        logging.info(f"账户 {name} 同步完成，总耗时 {time.monotonic() - start:.2f} 秒")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='单次同步：没有需要处理的帖子时不构建客户端，直接退出，适合由 cron 等定时调用')
+    parser.add_argument('--account', help='多账户模式（设置了 ACCOUNTS_CONFIG）下只处理该账户，默认处理全部账户')
+    parser.add_argument('--force', action='store_true', help='跳过预检查，两个方向都同步并检查编辑和删除')
+    args = parser.parse_args(argv)
+
+    accounts_config = os.environ.get('ACCOUNTS_CONFIG', '')
+    accounts = load_accounts(accounts_config) if accounts_config else [account_from_env()]
+    if args.account:
+        accounts = [account for account in accounts if account['name'] == args.account]
+        if not accounts:
+            parser.error(f"没有名为 {args.account} 的账户")
+    failed = 0
+    for account in accounts:
+        try:
+            run_account(account, force=args.force)
+        except Exception as e:
+            logging.error(f"账户 {account.get('name', 'default')} 同步失败: {str(e)}")
+            failed += 1
+    metrics.registry.dump_json()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,63 @@
+import os
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# 同一同步方向中提前转换（过滤、上传媒体）的帖子数，1 表示逐条转换和发布
+SYNC_PIPELINE_DEPTH = int(os.environ.get('SYNC_PIPELINE_DEPTH', 4))
+
+
+class SyncPipeline:
+    def __init__(self, depth=None, executor=None):
+        """
+        同一方向内的帖子流水线：后面帖子的过滤和媒体处理在线程池中进行，与前面帖子的发布重叠；
+        发布和同步状态的记录仍在调用线程中按原来的顺序进行，镜像时间线的顺序不变
+        :param depth: 最多提前转换的帖子数（有界窗口），默认使用 SYNC_PIPELINE_DEPTH
+        :param executor: 执行转换的线程池，多账户模式下各账户共用，由调用方关闭；为None时自行创建
+        """
+        self.depth = max(1, depth or SYNC_PIPELINE_DEPTH)
+        self.owns_executor = executor is None
+        if self.depth == 1:
+            self.executor = None
+        elif executor is not None:
+            self.executor = executor
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=self.depth, thread_name_prefix='prepare')
+
+    def run(self, items, prepare, publish):
+        """
+        按顺序处理所有条目
+        :param items: 条目，按发布顺序排列
+        :param prepare: prepare(item)，在线程池中执行，返回转换结果
+        :param publish: publish(item, result)，在调用线程中按顺序执行；result() 返回转换结果，转换失败时抛出转换时的异常
+        """
+        if self.executor is None:
+            for item in items:
+                publish(item, lambda item=item: prepare(item))
+            return
+        pending = iter(items)
+        window = deque()
+
+        def submit():
+            for item in pending:
+                window.append((item, self.executor.submit(prepare, item)))
+                return
+
+        for _ in range(self.depth):
+            submit()
+        try:
+            while window:
+                item, future = window.popleft()
+                # 发布当前条目之前先补满窗口，发布期间后面的条目继续转换
+                submit()
+                publish(item, future.result)
+        except BaseException:
+            # 发布出错时不再等待窗口中尚未开始的转换；已开始的转换完成后上传的媒体保存在媒体缓存中
+            for _, future in window:
+                future.cancel()
+            logging.debug(f"流水线中止，取消 {len(window)} 条尚未发布的帖子")
+            raise
+
+    def close(self):
+        if self.executor is not None and self.owns_executor:
+            self.executor.shutdown(wait=True)
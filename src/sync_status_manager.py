@@ -1,67 +1,471 @@
 import json
 import os
+import bisect
 import logging
+import threading
+from contextlib import contextmanager
 
 class SyncStatusManager:
-    def __init__(self, filename='data/sync_status.json'):
+    def __init__(self, filename='data/sync_status.json', journal_filename=None, compact_threshold=None, wait_timeout=None):
         """
         初始化同步状态管理器
-        :param filename: 存储同步状态的文件名
+        同步状态由两部分组成：快照文件（与旧版 sync_status.json 格式相同的ID对列表）
+        和只追加的日志文件。每次标记同步只向日志追加一行，日志达到阈值后再合并进快照。
+        新记录的ID对带有第三项元数据：原帖所在的平台（origin）、原帖内容的哈希（hash）和Bluesky帖子的 uri，
+        用于检测原帖的编辑和删除；旧版没有元数据的记录不参与编辑和删除的同步。
+        :param filename: 存储同步状态快照的文件名
+        :param journal_filename: 追加日志的文件名，默认为快照文件名加 .journal 后缀
+        :param compact_threshold: 日志条目数达到该值时合并进快照
+        :param wait_timeout: is_synced 等待另一方向正在发布的帖子的最长秒数
         """
         self.filename = filename
+        self.journal_filename = journal_filename or f'{filename}.journal'
+        if compact_threshold is None:
+            compact_threshold = int(os.environ.get('SYNC_STATUS_COMPACT_THRESHOLD', 1000))
+        self.compact_threshold = compact_threshold
+        if wait_timeout is None:
+            wait_timeout = float(os.environ.get('SYNC_STATUS_WAIT_TIMEOUT', 60))
+        self.wait_timeout = wait_timeout
+        # 两个同步方向并发运行时共用同一个管理器，该锁只保护内存索引和日志文件，不在持有期间发送网络请求
+        self.lock = threading.RLock()
+        # 正在发布的帖子：方向 -> {原始帖子ID: [持有的线程, 重入次数]}
+        # 发布前预留，标记同步后释放；另一方向检查未记录的帖子时等这些帖子发布完成后再判断，
+        # 不会看到“已发布但未标记”的中间状态，也不会把刚发布的帖子同步回来
+        self._publishing = {'mastodon_to_bluesky': {}, 'bluesky_to_mastodon': {}}
+        self._published = threading.Condition(self.lock)
+        self._journal = None
+        self._journal_entries = 0
         self.sync_status = self.load_sync_status()
 
     def load_sync_status(self):
         """
-        从文件加载同步状态
+        从快照和日志文件加载同步状态，并重建双向索引
         :return: 同步状态列表
         """
-        if os.path.exists(self.filename):
-            try:
-                with open(self.filename, 'r', encoding='utf-8') as f:
-                    self.sync_status = json.load(f)
-            except json.JSONDecodeError:
-                logging.warning(f"无法加载 {self.filename}。创建新的同步状态。")
-                self.sync_status = []
-        else:
+        with self.lock:
+            self.close()
             self.sync_status = []
-        return self.sync_status
+            # mastodon id -> bluesky id
+            self.mastodon_index = {}
+            # bluesky id -> mastodon id
+            self.bluesky_index = {}
+            # 一条嘟文拆分成Bluesky帖子串时：mastodon id -> 串中所有 bluesky id（按发布顺序）
+            self.thread_index = {}
+            # (mastodon id, bluesky id) -> 记录，用于读取和更新元数据
+            self.pair_index = {}
+            # 按原帖所在平台分组的嘟文ID（整数，升序；Bluesky原帖对应的是同步后的嘟文ID，与同步顺序一致）
+            # 用于按ID范围检测删除和分段巡检历史记录
+            self.origin_ids = {'mastodon': [], 'bluesky': []}
+            # Bluesky帖子的 uri -> 记录，Bluesky的删除事件只带 uri
+            self.uri_index = {}
+
+            if os.path.exists(self.filename):
+                try:
+                    with open(self.filename, 'r', encoding='utf-8') as f:
+                        pairs = json.load(f)
+                    for pair in pairs:
+                        self._add_pair(pair[0], pair[1], pair[2] if len(pair) > 2 else None)
+                except (json.JSONDecodeError, IndexError, TypeError):
+                    logging.warning(f"无法加载 {self.filename}。创建新的同步状态。")
+                    self.sync_status = []
+                    self.mastodon_index = {}
+                    self.bluesky_index = {}
+                    self.thread_index = {}
+                    self.pair_index = {}
+                    self.origin_ids = {'mastodon': [], 'bluesky': []}
+                    self.uri_index = {}
+
+            self._journal_entries = self._replay_journal()
+            if self._journal_entries >= self.compact_threshold:
+                self.compact()
+            return self.sync_status
+
+    def _replay_journal(self):
+        """
+        重放追加日志中的条目
+        :return: 成功重放的条目数
+        """
+        if not os.path.exists(self.journal_filename):
+            return 0
+        count = 0
+        with open(self.journal_filename, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    pair = json.loads(line)
+                except json.JSONDecodeError:
+                    # 进程中断时最后一行可能只写了一半
+                    logging.warning(f"忽略 {self.journal_filename} 中损坏的日志行")
+                    continue
+                if isinstance(pair, dict):
+                    # 删除记录的日志行：{"remove": [mastodon id, bluesky id]}
+                    self._remove_pair(*pair['remove'])
+                else:
+                    self._add_pair(pair[0], pair[1], pair[2] if len(pair) > 2 else None)
+                count += 1
+        return count
+
+    def _add_pair(self, mastodon_id, bluesky_id, meta=None):
+        mastodon_id = str(mastodon_id)
+        bluesky_id = str(bluesky_id)
+        entry = self.pair_index.get((mastodon_id, bluesky_id))
+        if entry is not None:
+            # 已有的记录只更新元数据
+            if meta is not None:
+                if len(entry) > 2:
+                    self.uri_index.pop(entry[2].get('uri'), None)
+                    entry[2] = meta
+                else:
+                    entry.append(meta)
+                    self._index_origin(mastodon_id, meta)
+                if meta.get('uri'):
+                    self.uri_index[meta['uri']] = entry
+            return entry
+        entry = [mastodon_id, bluesky_id] if meta is None else [mastodon_id, bluesky_id, meta]
+        self.sync_status.append(entry)
+        self.pair_index[(mastodon_id, bluesky_id)] = entry
+        first = self.mastodon_index.setdefault(mastodon_id, bluesky_id)
+        if first != bluesky_id:
+            self.thread_index.setdefault(mastodon_id, [first]).append(bluesky_id)
+        self.bluesky_index.setdefault(bluesky_id, mastodon_id)
+        if meta is not None:
+            self._index_origin(mastodon_id, meta)
+            if meta.get('uri'):
+                self.uri_index[meta['uri']] = entry
+        return entry
+
+    def _index_origin(self, mastodon_id, meta):
+        ids = self.origin_ids.get(meta.get('origin'))
+        if ids is None or not mastodon_id.isdigit():
+            return
+        # 记录大多按ID递增的顺序加入，插入位置通常在末尾
+        number = int(mastodon_id)
+        position = bisect.bisect_left(ids, number)
+        if position == len(ids) or ids[position] != number:
+            ids.insert(position, number)
+
+    def _remove_pair(self, mastodon_id, bluesky_id):
+        mastodon_id = str(mastodon_id)
+        bluesky_id = str(bluesky_id)
+        entry = self.pair_index.pop((mastodon_id, bluesky_id), None)
+        if entry is None:
+            return False
+        # 删除很少发生，线性查找可以接受
+        self.sync_status.remove(entry)
+        if len(entry) > 2 and self.uri_index.get(entry[2].get('uri')) is entry:
+            del self.uri_index[entry[2]['uri']]
+        if self.bluesky_index.get(bluesky_id) == mastodon_id:
+            del self.bluesky_index[bluesky_id]
+        remaining = [cid for cid in self.thread_index.pop(mastodon_id, [self.mastodon_index.get(mastodon_id)])
+                     if cid is not None and cid != bluesky_id]
+        if remaining:
+            self.mastodon_index[mastodon_id] = remaining[0]
+            if len(remaining) > 1:
+                self.thread_index[mastodon_id] = remaining
+        else:
+            self.mastodon_index.pop(mastodon_id, None)
+            if len(entry) > 2 and mastodon_id.isdigit():
+                ids = self.origin_ids.get(entry[2].get('origin'), [])
+                number = int(mastodon_id)
+                position = bisect.bisect_left(ids, number)
+                if position < len(ids) and ids[position] == number:
+                    del ids[position]
+        return True
+
+    def _append_journal(self, pair, flush=True):
+        # pair 是ID对（可带元数据），或删除记录 {"remove": [...]}
+        if self._journal is None:
+            directory = os.path.dirname(self.journal_filename)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._journal = open(self.journal_filename, 'a', encoding='utf-8')
+        self._journal.write(json.dumps(pair, ensure_ascii=False, separators=(',', ':')) + '\n')
+        if flush:
+            self._journal.flush()
+        self._journal_entries += 1
 
     def save_sync_status(self):
         """
-        将同步状态保存到文件
+        将同步状态保存到文件：把追加日志刷新到磁盘，不重写快照
+        逐条保存的调用方不会把只追加的日志变回每次重写整个快照，合并仍由日志条目数的阈值触发
         """
-        try:
-            with open(self.filename, 'w', encoding='utf-8') as f:
-                json.dump(self.sync_status, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            logging.error(f"保存同步状态失败: {str(e)}")
+        with self.lock:
+            if self._journal is not None:
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+            if self._journal_entries >= self.compact_threshold:
+                self.compact()
+
+    def compact(self):
+        """
+        把当前的完整同步状态写入快照文件并清空追加日志
+        先写临时文件再替换，避免中途失败损坏快照
+        """
+        with self.lock:
+            try:
+                directory = os.path.dirname(self.filename)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                tmp_filename = f'{self.filename}.tmp'
+                with open(tmp_filename, 'w', encoding='utf-8') as f:
+                    json.dump(self.sync_status, f, ensure_ascii=False, separators=(',', ':'))
+                os.replace(tmp_filename, self.filename)
 
-    def is_synced(self, post_id, direction):
+                self.close()
+                if os.path.exists(self.journal_filename):
+                    os.remove(self.journal_filename)
+                self._journal_entries = 0
+            except Exception as e:
+                logging.error(f"保存同步状态失败: {str(e)}")
+
+    def close(self):
+        """
+        关闭追加日志文件句柄
+        """
+        if getattr(self, '_journal', None) is not None:
+            self._journal.close()
+            self._journal = None
+
+    def import_sync_status(self, filename):
+        """
+        导入旧版 sync_status.json 文件中的ID对，已存在的记录会被跳过
+        :param filename: 要导入的文件名
+        :return: 导入的记录数
+        """
+        with self.lock:
+            with open(filename, 'r', encoding='utf-8') as f:
+                pairs = json.load(f)
+            imported = 0
+            for pair in pairs:
+                if not pair[0] or not pair[1]:
+                    continue
+                if str(pair[0]) in self.mastodon_index and str(pair[1]) in self.bluesky_index:
+                    continue
+                self._add_pair(pair[0], pair[1])
+                imported += 1
+            self.compact()
+            logging.info(f"从 {filename} 导入了 {imported} 条同步记录")
+            return imported
+
+    def _is_synced(self, post_id, direction):
+        if direction == 'mastodon_to_bluesky':
+            return str(post_id) in self.mastodon_index
+        elif direction == 'bluesky_to_mastodon':
+            return str(post_id) in self.bluesky_index
+        return False
+
+    def is_synced(self, post_id, direction, wait=True):
         """
         检查帖子是否已同步
+        帖子没有记录时，先等待同一帖子和另一方向此刻正在发布的帖子完成：另一方向刚发布的帖子可能就是它。
+        两个方向互相等待会死锁，因此应在预留帖子之前调用；预留之后用 wait=False 只查询记录。
+        持有预留的线程不会等待，等待超过 wait_timeout 时抛出 TimeoutError，调用方稍后重试
         :param post_id: 帖子ID
         :param direction: 同步方向 ('mastodon_to_bluesky' 或 'bluesky_to_mastodon')
+        :param wait: 是否等待正在发布的帖子
         :return: 布尔值，表示是否已同步
         """
-        if direction == 'mastodon_to_bluesky':
-            return any(pair[0] == str(post_id) for pair in self.sync_status)
-        elif direction == 'bluesky_to_mastodon':
-            return any(pair[1] == str(post_id) for pair in self.sync_status)
-        return False
+        with self.lock:
+            synced = self._is_synced(post_id, direction)
+            if synced or not wait or direction not in self._publishing:
+                return synced
+            key = str(post_id)
+            me = threading.get_ident()
+            if any(owner == me for reservations in self._publishing.values() for owner, _ in reservations.values()):
+                return synced
+            own = self._publishing[direction]
+            other = self._publishing['bluesky_to_mastodon' if direction == 'mastodon_to_bluesky' else 'mastodon_to_bluesky']
+            # 只等待此刻已在发布的帖子，另一方向持续发布新帖子时不会一直等下去
+            waiting = set(other)
+            if not self._published.wait_for(lambda: key not in own and waiting.isdisjoint(other), self.wait_timeout):
+                raise TimeoutError(f"等待正在发布的帖子超时，暂不同步帖子 {post_id}")
+            return self._is_synced(post_id, direction)
+
+    def reserve(self, post_id, direction):
+        """
+        发布帖子之前预留：同一帖子同时只能由一个线程发布，同一线程可以重入（例如编辑时先删除再重新发布）
+        预留前用 is_synced 等待另一方向正在发布的帖子，预留后再用 is_synced(wait=False) 检查是否已同步，
+        发布的网络请求在锁外进行，完成并标记后调用 release
+        :return: 是否预留成功，其他线程正在发布该帖子时返回False
+        """
+        key = str(post_id)
+        me = threading.get_ident()
+        with self.lock:
+            holder = self._publishing[direction].get(key)
+            if holder is None:
+                self._publishing[direction][key] = [me, 1]
+                return True
+            if holder[0] == me:
+                holder[1] += 1
+                return True
+            return False
+
+    def release(self, post_id, direction):
+        """
+        释放 reserve 的预留，唤醒等待这些帖子发布完成的 is_synced
+        """
+        key = str(post_id)
+        with self.lock:
+            holder = self._publishing[direction].get(key)
+            if holder is None:
+                return
+            holder[1] -= 1
+            if holder[1] == 0:
+                del self._publishing[direction][key]
+                self._published.notify_all()
+
+    @contextmanager
+    def publishing(self, post_id, direction):
+        """
+        在 with 块内预留帖子，块结束时释放
+        :return: 是否预留成功
+        """
+        reserved = self.reserve(post_id, direction)
+        try:
+            yield reserved
+        finally:
+            if reserved:
+                self.release(post_id, direction)
+
+    def get_synced_id(self, post_id, direction):
+        """
+        获取帖子在另一平台上对应的ID
+        :param post_id: 帖子ID
+        :param direction: 同步方向 ('mastodon_to_bluesky' 或 'bluesky_to_mastodon')
+        :return: 对应的ID，未同步时返回None
+        """
+        with self.lock:
+            if direction == 'mastodon_to_bluesky':
+                return self.mastodon_index.get(str(post_id))
+            elif direction == 'bluesky_to_mastodon':
+                return self.bluesky_index.get(str(post_id))
+            return None
+
+    def get_synced_ids(self, post_id, direction):
+        """
+        获取帖子在另一平台上对应的所有ID（拆分成帖子串的嘟文对应多条Bluesky帖子）
+        :param post_id: 帖子ID
+        :param direction: 同步方向 ('mastodon_to_bluesky' 或 'bluesky_to_mastodon')
+        :return: ID列表，未同步时为空列表
+        """
+        with self.lock:
+            if direction == 'mastodon_to_bluesky' and str(post_id) in self.thread_index:
+                return list(self.thread_index[str(post_id)])
+            synced_id = self.get_synced_id(post_id, direction)
+            return [synced_id] if synced_id is not None else []
+
+    def get_entries(self, post_id, direction):
+        """
+        获取帖子对应的所有记录（拆分成帖子串的嘟文有多条）
+        :param post_id: 帖子ID
+        :param direction: 同步方向 ('mastodon_to_bluesky' 或 'bluesky_to_mastodon')
+        :return: [mastodon id, bluesky id, 元数据] 列表，元数据可能为None
+        """
+        with self.lock:
+            if direction == 'mastodon_to_bluesky':
+                pairs = [(str(post_id), cid) for cid in self.get_synced_ids(post_id, direction)]
+            else:
+                mastodon_id = self.get_synced_id(post_id, direction)
+                pairs = [(mastodon_id, str(post_id))] if mastodon_id is not None else []
+            entries = []
+            for pair in pairs:
+                entry = self.pair_index.get(pair)
+                if entry is not None:
+                    entries.append([entry[0], entry[1], entry[2] if len(entry) > 2 else None])
+            return entries
 
-    def mark_as_synced(self, post_id, synced_id, direction):
+    def get_entry_by_uri(self, uri):
+        """
+        按Bluesky帖子的 uri 查找记录
+        :return: [mastodon id, bluesky id, 元数据]，没有时返回None
+        """
+        with self.lock:
+            entry = self.uri_index.get(uri)
+            return list(entry) if entry is not None else None
+
+    def origin_count(self, origin):
+        """
+        原帖在某个平台上的带元数据的嘟文数
+        :param origin: 'mastodon' 或 'bluesky'
+        """
+        with self.lock:
+            return len(self.origin_ids[origin])
+
+    def origin_ids_between(self, origin, low, high=None, limit=None):
+        """
+        原帖在某个平台上、嘟文ID在 [low, high] 范围内的记录的嘟文ID
+        :param origin: 'mastodon' 或 'bluesky'
+        :param high: 上界，None表示不限
+        :param limit: 最多返回的个数（从小到大）
+        :return: 嘟文ID（字符串）列表，升序
+        """
+        with self.lock:
+            ids = self.origin_ids[origin]
+            start = bisect.bisect_left(ids, int(low))
+            end = bisect.bisect_right(ids, int(high)) if high is not None else len(ids)
+            if limit is not None:
+                end = min(end, start + limit)
+            return [str(number) for number in ids[start:end]]
+
+    def latest_origin_ids(self, origin, count):
+        """
+        原帖在某个平台上的最近 count 条记录的嘟文ID，升序
+        """
+        with self.lock:
+            return [str(number) for number in self.origin_ids[origin][-count:]] if count > 0 else []
+
+    def remove_synced(self, mastodon_id, bluesky_id):
+        """
+        删除一条同步记录（原帖或同步后的帖子已被删除）
+        :param mastodon_id: 嘟文ID
+        :param bluesky_id: Bluesky帖子的CID
+        """
+        with self.lock:
+            if self._remove_pair(mastodon_id, bluesky_id):
+                self._append_journal({'remove': [str(mastodon_id), str(bluesky_id)]})
+                if self._journal_entries >= self.compact_threshold:
+                    self.compact()
+
+    def mark_as_synced(self, post_id, synced_id, direction, meta=None):
         """
         标记帖子为已同步
         :param post_id: 原始帖子ID
         :param synced_id: 同步后的帖子ID
         :param direction: 同步方向 ('mastodon_to_bluesky' 或 'bluesky_to_mastodon')
+        :param meta: 元数据（origin、hash、uri），已有的记录只更新元数据
         """
-        if direction == 'mastodon_to_bluesky':
-            self.sync_status.append([str(post_id), str(synced_id)])
-        elif direction == 'bluesky_to_mastodon':
-            self.sync_status.append([str(synced_id), str(post_id)])
-        self.save_sync_status()
+        with self.lock:
+            if direction == 'mastodon_to_bluesky':
+                pair = self._add_pair(post_id, synced_id, meta)
+            elif direction == 'bluesky_to_mastodon':
+                pair = self._add_pair(synced_id, post_id, meta)
+            else:
+                return
+            self._append_journal(pair)
+            if self._journal_entries >= self.compact_threshold:
+                self.compact()
+
+    def mark_many_as_synced(self, pairs, direction):
+        """
+        批量标记帖子为已同步，所有条目追加到日志后只刷新一次，用于批量写入的帖子
+        :param pairs: (原始帖子ID, 同步后的帖子ID, 元数据) 列表
+        :param direction: 同步方向 ('mastodon_to_bluesky' 或 'bluesky_to_mastodon')
+        """
+        if direction not in ('mastodon_to_bluesky', 'bluesky_to_mastodon'):
+            return
+        with self.lock:
+            for post_id, synced_id, meta in pairs:
+                if direction == 'mastodon_to_bluesky':
+                    pair = self._add_pair(post_id, synced_id, meta)
+                else:
+                    pair = self._add_pair(synced_id, post_id, meta)
+                self._append_journal(pair, flush=False)
+            if self._journal is not None:
+                self._journal.flush()
+            if self._journal_entries >= self.compact_threshold:
+                self.compact()
 
     def get_sync_status(self):
         """
@@ -5,41 +5,154 @@ import os
 import logging
 import time
 import json
+import requests
+import metrics
+from concurrent.futures import ThreadPoolExecutor
 from mastodon import Mastodon
-from atproto import Client
+from atproto import Client, SessionEvent, models
 from atproto_client.exceptions import InvokeTimeoutError
 from mastodon_to_bluesky_sync import MastodonToBlueskySyncer
 from bluesky_to_mastodon_sync import BlueskyToMastodonSyncer
 from sync_status_manager import SyncStatusManager
-import httpx
+from sync_cursor_store import SyncCursorStore
+from media_pipeline import MediaPipeline
+from media_cache import MediaCache
+from media_fetcher import MediaFetcher
+from retry_queue import RetryQueue
+from post_reconciler import PostReconciler
+from post_archive import PostArchive
+from sync_pipeline import SyncPipeline
+from account_config import account_from_env
+from rate_governor import RateGovernor, GovernedSession, GovernedRequest
 
-# 配置日志
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+# 配置日志，LOG_LEVEL=DEBUG 时输出逐条帖子的处理详情
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO').upper(), format='%(asctime)s - %(levelname)s - %(message)s')
+
+# 刷新令牌剩余有效期低于该值（秒）时重新登录，默认1天
+BLUESKY_SESSION_RELOGIN_MARGIN = int(os.environ.get('BLUESKY_SESSION_RELOGIN_MARGIN', 86400))
+# 缓存的Mastodon实例版本的有效期（秒），过期后启动时重新查询
+MASTODON_VERSION_CACHE_TTL = 86400
 
 
 class SyncTool:
-    def __init__(self):
+    def __init__(self, account=None, shared=None, validate_bluesky_session=True):
+        """
+        :param account: 账户配置字典，默认从环境变量读取
+        :param shared: 多账户模式下各账户共用的连接池和线程池（SharedResources），为None时自行创建
+        :param validate_bluesky_session: 恢复保存的Bluesky会话时是否请求个人资料来确认会话有效；
+            为False时直接使用保存的会话（刷新令牌的有效期仍在本地检查），启动时不发送请求
+        """
+        self.account = account or account_from_env()
+        self.shared = shared
+        self.validate_bluesky_session = validate_bluesky_session
+        self.data_dir = self.account.get('data_dir') or 'data'
+        os.makedirs(self.data_dir, exist_ok=True)
+
         # 初始化Mastodon客户端
-        mastodon_instance_url = os.environ.get('MASTODON_INSTANCE_URL', '')
+        mastodon_instance_url = self.account.get('mastodon_instance_url') or ''
         if not mastodon_instance_url.startswith('http'):
             mastodon_instance_url = f'https://{mastodon_instance_url}'
         
+        # 两个平台的所有API请求都经过速率限制调度，按读取、写入、媒体上传分别控制节奏
+        self.governor = RateGovernor()
+        session = shared.mastodon_session(mastodon_instance_url) if shared else requests.Session()
+        # 实例版本缓存在本地，启动时不必每次查询实例信息
+        self.version_file = os.path.join(self.data_dir, 'mastodon_version.json')
+        mastodon_version = self.load_mastodon_version()
+        # 额度由调度器控制；仍然收到429时直接抛出，帖子进入重试队列，而不是在请求中等待
         self.mastodon = Mastodon(
-            access_token=os.environ.get('MASTODON_ACCESS_TOKEN'),
-            api_base_url=mastodon_instance_url
+            access_token=self.account.get('mastodon_access_token'),
+            api_base_url=mastodon_instance_url,
+            session=GovernedSession(session, self.governor),
+            ratelimit_method='throw',
+            mastodon_version=mastodon_version
         )
+        if mastodon_version is None and self.mastodon.version_check_worked:
+            self.save_mastodon_version()
 
         # 初始化Bluesky客户端
         
-        self.token_file = 'data/bluesky_token.json'
+        self.token_file = os.path.join(self.data_dir, 'bluesky_token.json')
         self.initialize_bluesky_client()
         
         # 初始化同步状态管理器
-        self.sync_status_manager = SyncStatusManager()
+        self.sync_status_manager = SyncStatusManager(os.path.join(self.data_dir, 'sync_status.json'))
+        # 初始化同步游标存储（两个方向各自的高水位）
+        self.cursor_store = SyncCursorStore(os.path.join(self.data_dir, 'sync_cursor.json'))
+        # 两个方向共用的媒体处理线程池
+        self.media_pipeline = shared.media_pipeline if shared else MediaPipeline()
+        # 两个方向共用的媒体缓存（Bluesky blob只能被上传它的账户引用，因此每个账户各自一份）
+        self.media_cache = MediaCache(os.path.join(self.data_dir, 'media_cache'))
+        # 两个方向共用的媒体下载连接池
+        self.media_fetcher = shared.media_fetcher if shared else MediaFetcher()
+        # 两个方向共用的重试队列（按方向区分条目）
+        self.retry_queue = RetryQueue(os.path.join(self.data_dir, 'retry_queue.json'))
+        # 获取到的原帖写入 data/archive/ 下的压缩归档，可用 python src/post_archive.py 补全历史和重新同步
+        self.archive = PostArchive(os.path.join(self.data_dir, 'archive')) if self.account.get('archive_posts') else None
+        # 两个同步方向在各自的线程中并发运行；多账户模式下线程池和帖子流水线的线程池由各账户共用
+        self.direction_executor = shared.direction_executor if shared else ThreadPoolExecutor(max_workers=2, thread_name_prefix='sync')
+        prepare_executor = shared.prepare_executor if shared else None
         # 初始化同步器mastodon到bluesky
-        self.mastodon_to_bluesky_syncer = MastodonToBlueskySyncer(self.mastodon, self.bluesky, self.sync_status_manager)
+        self.mastodon_to_bluesky_syncer = MastodonToBlueskySyncer(
+            self.mastodon, self.bluesky, self.sync_status_manager,
+            cursor_store=self.cursor_store,
+            media_pipeline=self.media_pipeline,
+            media_cache=self.media_cache,
+            media_fetcher=self.media_fetcher,
+            from_mastodon_at=self.account.get('from_mastodon_at') or '',
+            split_threads=bool(self.account.get('bluesky_thread_split')),
+            retry_queue=self.retry_queue,
+            archive=self.archive,
+            pipeline=SyncPipeline(executor=prepare_executor),
+        )
         # 初始化同步器bluesky到mastodon
-        self.bluesky_to_mastodon_syncer = BlueskyToMastodonSyncer(self.mastodon, self.bluesky, self.sync_status_manager)
+        self.bluesky_to_mastodon_syncer = BlueskyToMastodonSyncer(
+            self.mastodon, self.bluesky, self.sync_status_manager,
+            cursor_store=self.cursor_store,
+            media_pipeline=self.media_pipeline,
+            media_cache=self.media_cache,
+            media_fetcher=self.media_fetcher,
+            from_bluesky_at=self.account.get('from_bluesky_at') or '',
+            retry_queue=self.retry_queue,
+            archive=self.archive,
+            pipeline=SyncPipeline(executor=prepare_executor),
+        )
+        # 把原帖的编辑和删除同步到另一平台（默认开启）
+        self.reconciler = None
+        if self.account.get('sync_edits_and_deletes', True):
+            self.reconciler = PostReconciler(self.mastodon_to_bluesky_syncer, self.bluesky_to_mastodon_syncer,
+                                             self.sync_status_manager, self.cursor_store)
+        # 流式模式下Mastodon到Bluesky方向由推送驱动，每轮同步只轮询Bluesky
+        self.mastodon_stream = None
+        if self.account.get('mastodon_streaming'):
+            from mastodon_stream import MastodonStatusStream
+            self.mastodon_stream = MastodonStatusStream(self.mastodon, self.mastodon_to_bluesky_syncer, self.cursor_store,
+                                                        reconciler=self.reconciler)
+            self.mastodon_stream.start()
+        # Jetstream模式下Bluesky到Mastodon方向由事件流驱动；多账户模式下所有账户共用一个连接
+        self.jetstream = None
+        if self.account.get('bluesky_jetstream'):
+            from jetstream_consumer import JetstreamConsumer
+            self.jetstream = shared.jetstream_consumer() if shared else JetstreamConsumer(self.cursor_store)
+            # 匹配到的事件交给同步方向的线程池处理，不占用接收事件的线程
+            self.jetstream.subscribe(self.bluesky.me.did, self.bluesky_to_mastodon_syncer, reconciler=self.reconciler,
+                                     executor=self.direction_executor)
+            self.jetstream.start()
+
+    def load_mastodon_version(self):
+        try:
+            with open(self.version_file, 'r') as f:
+                data = json.load(f)
+            if time.time() - data.get('time', 0) < MASTODON_VERSION_CACHE_TTL:
+                return data.get('version')
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+        return None
+
+    def save_mastodon_version(self):
+        version = f"{self.mastodon.mastodon_major}.{self.mastodon.mastodon_minor}.{self.mastodon.mastodon_patch}"
+        with open(self.version_file, 'w') as f:
+            json.dump({"version": version, "time": time.time()}, f)
 
     def save_token(self, token):
         with open(self.token_file, 'w') as f:
@@ -66,18 +179,56 @@ class SyncTool:
         if not login_result:
             self.login_bluesky()
 
-    def bluesky_login_with_token(self):
-        bluesky_instance_url = os.environ.get('BLUESKY_INSTANCE_URL', '')
+    def create_bluesky_client(self):
+        bluesky_instance_url = self.account.get('bluesky_instance_url') or ''
         if bluesky_instance_url == '':
-            self.bluesky = Client()
+            self.bluesky = Client(request=GovernedRequest(self.governor))
         else:
-            self.bluesky = Client(bluesky_instance_url)
+            self.bluesky = Client(bluesky_instance_url, request=GovernedRequest(self.governor))
+        if self.shared:
+            # 多账户模式下所有Bluesky客户端共用一个httpx连接池，认证头由各客户端在每次请求时单独附加
+            self.bluesky.request.close()
+            self.bluesky.request._client = self.shared.bluesky_http_client()
+        # 客户端会在访问令牌快过期时自动刷新会话，这里把刷新后的会话写回本地，
+        # 下次启动时可以直接恢复，而不必重新登录
+        self.bluesky.on_session_change(self.on_bluesky_session_change)
+        # 重新登录后让同步器使用新的客户端，批量写入器也换用新的会话，否则积压的批次会一直用过期的会话提交
+        for syncer in (getattr(self, 'mastodon_to_bluesky_syncer', None), getattr(self, 'bluesky_to_mastodon_syncer', None)):
+            if syncer is not None:
+                syncer.bluesky = self.bluesky
+                batch_writer = getattr(syncer, 'batch_writer', None)
+                if batch_writer is not None:
+                    batch_writer.bluesky = self.bluesky
+        return self.bluesky
+
+    def on_bluesky_session_change(self, event, session):
+        if event in (SessionEvent.CREATE, SessionEvent.REFRESH):
+            self.save_token(session.export())
+            logging.info("Bluesky会话已更新并保存新令牌")
+
+    def ensure_bluesky_session(self):
+        # 访问令牌由客户端在请求前按需刷新；刷新令牌本身快过期时才需要重新登录
+        refresh_payload = getattr(self.bluesky, '_refresh_jwt_payload', None)
+        if refresh_payload is None or not refresh_payload.exp:
+            return
+        remaining = refresh_payload.exp - time.time()
+        if remaining < BLUESKY_SESSION_RELOGIN_MARGIN:
+            logging.info(f"Bluesky刷新令牌将在 {int(remaining)} 秒后过期，重新登录")
+            self.login_bluesky()
+
+    def bluesky_login_with_token(self):
+        self.create_bluesky_client()
         
         token = self.load_token()
         
         if token:
             try:
-                self.bluesky.login(session_string=token)
+                if self.validate_bluesky_session:
+                    self.bluesky.login(session_string=token)
+                else:
+                    # 不发送请求，直接导入会话；同步只用到个人资料中的DID
+                    session = self.bluesky._import_session_string(token)
+                    self.bluesky.me = models.AppBskyActorDefs.ProfileViewDetailed(did=session.did, handle=session.handle)
                 logging.info("使用保存的令牌恢复Bluesky会话成功")
                 return True
             except Exception as e:
@@ -89,55 +240,111 @@ class SyncTool:
             return False
 
     def login_bluesky(self):
-        bluesky_instance_url = os.environ.get('BLUESKY_INSTANCE_URL', '')
-        if bluesky_instance_url == '':
-            self.bluesky = Client()
-        else:
-            self.bluesky = Client(bluesky_instance_url)
-        bluesky_username = os.environ.get('BLUESKY_USERNAME', '')
-        bluesky_password = os.environ.get('BLUESKY_PASSWORD', '')
+        self.create_bluesky_client()
+        bluesky_username = self.account.get('bluesky_username') or ''
+        bluesky_password = self.account.get('bluesky_password') or ''
         logging.info(f"Bluesky用户名: {bluesky_username}")
-        logging.info(f"Bluesky密码: {bluesky_password}")
-        
-        
+
         try:
+            # 新令牌由 on_bluesky_session_change 回调保存
             self.bluesky.login(bluesky_username, bluesky_password)
-            token = self.bluesky.export_session_string()
-            self.save_token(token)
             logging.info("Bluesky登录成功并保存新令牌")
             return
         except Exception as e:
             logging.warning(f"Bluesky登录失败：{str(e)}。") 
             raise
 
-    def run(self):
+    def run(self, directions=None, reconcile=True):
+        """
+        执行一轮同步
+        :param directions: 要同步的方向（'mastodon_to_bluesky'、'bluesky_to_mastodon'），默认两个方向都同步
+        :param reconcile: 是否检查原帖的编辑和删除
+        :return: 本轮获取到的新帖子数
+        """
         logging.info("开始同步过程")
 
         try:
-            # 检查初始同步状态
-            logging.info("检查初始同步状态")
-            self.sync_status_manager.load_sync_status()
+            # 长时间运行时客户端和同步状态都常驻内存，只需确认Bluesky会话仍然有效
+            self.ensure_bluesky_session()
 
-            # 同步 Mastodon 到 Bluesky
-            logging.info("正在同步 Mastodon 到 Bluesky")
-            self.mastodon_to_bluesky_syncer.sync()
-
-            # 再次检查同步状态
-            logging.info("Mastodon 到 Bluesky 同步后检查同步状态")
-            self.sync_status_manager.load_sync_status()
-
-            # 同步 Bluesky 到 Mastodon
-            logging.info("正在同步 Bluesky 到 Mastodon")
-            self.bluesky_to_mastodon_syncer.sync()
+            # 两个方向并发同步，各自记录耗时
+            start = time.monotonic()
+            # 由推送驱动的方向每轮只处理到期的重试
+            futures = {
+                name: self.direction_executor.submit(self.run_direction, name, direction, syncer, retries_only)
+                for name, direction, syncer, retries_only in (
+                    ('Mastodon 到 Bluesky', 'mastodon_to_bluesky', self.mastodon_to_bluesky_syncer, self.mastodon_stream is not None),
+                    ('Bluesky 到 Mastodon', 'bluesky_to_mastodon', self.bluesky_to_mastodon_syncer, self.jetstream is not None),
+                )
+                if directions is None or direction in directions
+            }
+            results = {name: future.result() for name, future in futures.items()}
+            if reconcile and self.reconciler is not None:
+                self.reconciler.reconcile()
+            if self.archive is not None:
+                self.archive.flush()
+            metrics.cycle_seconds.observe(time.monotonic() - start)
+            logging.info(f"本轮同步总耗时 {time.monotonic() - start:.2f} 秒 (" +
+                         ", ".join(f"{name} {duration:.2f} 秒" for name, (duration, _) in results.items()) + ")")
 
+            stats = self.media_fetcher.pop_stats()
+            logging.info(f"本轮媒体下载: {stats['requests']} 次请求, {stats['bytes']} 字节, "
+                         f"新建连接 {stats['new_connections']} 个, 复用连接 {stats['reused_connections']} 次, "
+                         f"条件请求命中 {stats['not_modified']} 次")
             logging.info("同步过程完成")
+            # 返回本轮获取到的新帖子数，供调度器调整同步间隔
+            new_posts = sum(direction_stats['fetched'] for _, direction_stats in results.values())
+            if self.mastodon_stream is not None:
+                new_posts += self.mastodon_stream.pop_new_posts()
+            if self.jetstream is not None:
+                new_posts += self.jetstream.pop_new_posts(self.bluesky.me.did)
+            return new_posts
         except Exception as e:
             logging.error(f"同步过程中出错: {str(e)}")
             if "invalid token" in str(e).lower():
                 logging.info("令牌可能已失效，尝试重新登录")
                 self.login_bluesky()
                 # 可以在这里重新尝试失败的操作
-                self.run()  # 重新运行同步过程
+                return self.run(directions, reconcile)  # 重新运行同步过程
+            return 0
+
+    def run_direction(self, name, direction, syncer, retries_only=False):
+        logging.info(f"正在同步 {name}")
+        start = time.monotonic()
+        stats = syncer.retry_failed() if retries_only else syncer.sync()
+        duration = time.monotonic() - start
+        metrics.record_sync_stats(direction, stats)
+        logging.info(f"{name} 同步完成，耗时 {duration:.2f} 秒")
+        return duration, stats
+
+    def rate_limit_status(self):
+        """
+        两个平台读取和写入请求的速率限制状态
+        :return: 列表，每项包含 platform、endpoint、remaining、limit、reset（重置时间戳）
+        """
+        return self.governor.status()
+
+    def close(self):
+        # 关闭常驻的连接和文件句柄
+        if self.mastodon_stream is not None:
+            self.mastodon_stream.close()
+        if self.jetstream is not None:
+            self.jetstream.unsubscribe(self.bluesky.me.did)
+            if not self.shared:
+                self.jetstream.close()
+        self.sync_status_manager.close()
+        self.mastodon_to_bluesky_syncer.pipeline.close()
+        self.bluesky_to_mastodon_syncer.pipeline.close()
+        if self.archive is not None:
+            self.archive.close()
+        if self.shared:
+            # 共用的连接池和线程池由多账户调度器负责关闭
+            return
+        self.direction_executor.shutdown(wait=True)
+        self.media_pipeline.close()
+        self.media_fetcher.close()
+        self.bluesky.request.close()
+        self.mastodon.session.close()
 
 if __name__ == "__main__":
     sync_tool = SyncTool()
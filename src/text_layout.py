@@ -0,0 +1,223 @@
+import re
+import unicodedata
+
+# Bluesky帖子正文的上限：300个字素（用户感知的字符），3000个UTF-8字节
+POST_MAX_GRAPHEMES = 300
+POST_MAX_BYTES = 3000
+
+ZWJ = '‍'
+# 句子结束的位置：中日文句末标点（可带后引号、括号），或后面跟空白的西文句末标点，或换行
+SENTENCE_END_RE = re.compile(r'[。！？!?…]+[」』”’）)]*|[.;；]+(?=\s)|\n+')
+
+# 字素簇的扩展字符：组合符号、变体选择符、肤色修饰符、标签字符，以及泰文、老挝文的 SARA AM
+_EXTEND_CATEGORIES = {'Mn', 'Me', 'Mc'}
+_EXTEND_EXTRA = {'ำ', 'ຳ'}
+# 控制字符（包括换行）前后总是断开
+_CONTROL_CATEGORIES = {'Cc', 'Zl', 'Zp'}
+
+
+def _is_extend(char, code, category):
+    return (category in _EXTEND_CATEGORIES
+            or char == ZWJ
+            or 0x1F3FB <= code <= 0x1F3FF
+            or 0xE0020 <= code <= 0xE007F
+            or char in _EXTEND_EXTRA)
+
+
+def _hangul_type(code):
+    # 韩文字母的音节组合规则，返回 L、V、T、LV、LVT 或 None
+    if 0x1100 <= code <= 0x115F or 0xA960 <= code <= 0xA97C:
+        return 'L'
+    if 0x1160 <= code <= 0x11A7 or 0xD7B0 <= code <= 0xD7C6:
+        return 'V'
+    if 0x11A8 <= code <= 0x11FF or 0xD7CB <= code <= 0xD7FB:
+        return 'T'
+    if 0xAC00 <= code <= 0xD7A3:
+        return 'LV' if (code - 0xAC00) % 28 == 0 else 'LVT'
+    return None
+
+
+_HANGUL_JOINS = {
+    'L': {'L', 'V', 'LV', 'LVT'},
+    'LV': {'V', 'T'},
+    'V': {'V', 'T'},
+    'LVT': {'T'},
+    'T': {'T'},
+}
+
+
+def grapheme_bounds(text):
+    """
+    按扩展字素簇切分文本，一次扫描同时计算UTF-8字节偏移
+    覆盖常见情况：CRLF、组合符号、ZWJ连接的emoji序列、变体选择符、肤色修饰符、国旗（区域指示符对）、韩文音节
+    :return: (bounds, byte_offsets)，bounds 是每个字素的起始下标（最后一项为 len(text)），byte_offsets 是对应的字节偏移
+    """
+    if text.isascii():
+        # 纯ASCII文本每个字符一个字素（CRLF除外），字节数等于字符数
+        if '\r\n' not in text:
+            bounds = list(range(len(text) + 1))
+            return bounds, bounds
+        bounds = [index for index in range(len(text)) if not (text[index] == '\n' and index > 0 and text[index - 1] == '\r')]
+        bounds.append(len(text))
+        return bounds, bounds
+
+    bounds = []
+    byte_offsets = []
+    byte_offset = 0
+    previous = None
+    previous_control = False
+    previous_hangul = None
+    regional_run = 0
+    for index, char in enumerate(text):
+        code = ord(char)
+        category = unicodedata.category(char)
+        control = category in _CONTROL_CATEGORIES
+        hangul = _hangul_type(code) if 0x1100 <= code <= 0xD7FB else None
+        if previous is None:
+            boundary = True
+        elif previous == '\r' and char == '\n':
+            boundary = False
+        elif previous_control or control:
+            boundary = True
+        elif previous_hangul is not None and hangul in _HANGUL_JOINS[previous_hangul]:
+            boundary = False
+        elif _is_extend(char, code, category):
+            boundary = False
+        elif previous == ZWJ:
+            boundary = False
+        elif 0x1F1E6 <= code <= 0x1F1FF and regional_run % 2 == 1:
+            boundary = False
+        else:
+            boundary = True
+
+        if boundary:
+            bounds.append(index)
+            byte_offsets.append(byte_offset)
+        regional_run = regional_run + 1 if 0x1F1E6 <= code <= 0x1F1FF else 0
+        previous = char
+        previous_control = control
+        previous_hangul = hangul
+        byte_offset += 1 if code < 0x80 else 2 if code < 0x800 else 3 if code < 0x10000 else 4
+    bounds.append(len(text))
+    byte_offsets.append(byte_offset)
+    return bounds, byte_offsets
+
+
+def measure(text):
+    """
+    :return: (字素数, UTF-8字节数)
+    """
+    bounds, byte_offsets = grapheme_bounds(text)
+    return len(bounds) - 1, byte_offsets[-1]
+
+
+def fits(text, max_graphemes=POST_MAX_GRAPHEMES, max_bytes=POST_MAX_BYTES):
+    graphemes, size = measure(text)
+    return graphemes <= max_graphemes and size <= max_bytes
+
+
+def _shift_facets(facets, start_byte, end_byte):
+    # 取出完整落在 [start_byte, end_byte) 内的facets，并把偏移改为相对片段开头
+    shifted = []
+    for facet in facets:
+        index = facet['index']
+        if index['byteStart'] >= start_byte and index['byteEnd'] <= end_byte:
+            shifted.append(dict(facet, index={'byteStart': index['byteStart'] - start_byte, 'byteEnd': index['byteEnd'] - start_byte}))
+    return shifted
+
+
+def _last_fitting(bounds, byte_offsets, start, max_graphemes, max_bytes):
+    # 从第 start 个字素开始，在上限内最多能放到第几个字素（返回字素序号）
+    end = min(start + max_graphemes, len(bounds) - 1)
+    limit = byte_offsets[start] + max_bytes
+    while end > start and byte_offsets[end] > limit:
+        end -= 1
+    return end
+
+
+def truncate(text, facets=None, suffix='', ellipsis='...', max_graphemes=POST_MAX_GRAPHEMES, max_bytes=POST_MAX_BYTES):
+    """
+    按字素数和字节数截断文本，超出时在末尾加省略号，最后附加 suffix；被截断的facets不再保留
+    :return: (文本, facets)
+    """
+    facets = facets or []
+    if fits(text + suffix, max_graphemes, max_bytes):
+        return text + suffix, facets
+    reserve_graphemes, reserve_bytes = measure(ellipsis + suffix)
+    bounds, byte_offsets = grapheme_bounds(text)
+    end = _last_fitting(bounds, byte_offsets, 0, max(0, max_graphemes - reserve_graphemes), max(0, max_bytes - reserve_bytes))
+    kept = text[:bounds[end]]
+    return kept + ellipsis + suffix, _shift_facets(facets, 0, byte_offsets[end])
+
+
+def split_thread(text, facets=None, suffix='', max_graphemes=POST_MAX_GRAPHEMES, max_bytes=POST_MAX_BYTES):
+    """
+    把长文本拆分为多条帖子，优先在句末断开，其次在空白处，都没有时按字素断开；不会把一个facet拆到两条帖子里
+    suffix 附加在最后一条帖子末尾
+    :return: [(文本, facets), ...]
+    """
+    facets = facets or []
+    if fits(text + suffix, max_graphemes, max_bytes):
+        return [(text + suffix, facets)]
+
+    bounds, byte_offsets = grapheme_bounds(text)
+    total = len(bounds) - 1
+    # 下标到字素序号的映射，用于把句末和空白位置换算为字素边界
+    grapheme_at = {bound: number for number, bound in enumerate(bounds)}
+    sentence_ends = sorted({grapheme_at[match.end()] for match in SENTENCE_END_RE.finditer(text) if match.end() in grapheme_at})
+    spaces = [number for number in range(1, total) if text[bounds[number]].isspace()]
+    facet_ranges = [(facet['index']['byteStart'], facet['index']['byteEnd']) for facet in facets]
+    suffix_graphemes, suffix_bytes = measure(suffix)
+
+    def is_space(number):
+        return number < total and text[bounds[number]:bounds[number + 1]].isspace()
+
+    def inside_facet(number):
+        offset = byte_offsets[number]
+        return any(start < offset < end for start, end in facet_ranges)
+
+    def last_before(candidates, start, end):
+        # candidates 中在 (start, end] 内且不在facet中间的最大值
+        for number in reversed(candidates):
+            if number <= start:
+                break
+            if number <= end and not inside_facet(number):
+                return number
+        return None
+
+    posts = []
+    start = 0
+    while start < total:
+        # 剩余部分连同 suffix 放得下时作为最后一条
+        if total - start + suffix_graphemes <= max_graphemes and byte_offsets[total] - byte_offsets[start] + suffix_bytes <= max_bytes:
+            end = total
+        else:
+            # 单个字素本身就超过上限时也单独成为一条，保证每条至少前进一个字素
+            limit = max(start + 1, _last_fitting(bounds, byte_offsets, start, max_graphemes, max_bytes))
+            if limit == total:
+                # 剩余部分单独放得下但加上 suffix 放不下，给最后一条留出 suffix 的位置
+                limit = max(start + 1, _last_fitting(bounds, byte_offsets, start, max_graphemes - suffix_graphemes, max_bytes - suffix_bytes))
+            end = last_before(sentence_ends, start, limit) or last_before(spaces, start, limit)
+            if end is None:
+                end = limit
+                # 不在facet中间断开，除非整个facet本身就超过一条帖子的上限
+                while end > start + 1 and inside_facet(end):
+                    end -= 1
+                if end == start + 1 and limit > end and inside_facet(end):
+                    end = limit
+        # 去掉片段结尾的空白，下一条跳过开头的空白
+        text_end = end
+        while text_end > start and is_space(text_end - 1):
+            text_end -= 1
+        if text_end > start:
+            posts.append((text[bounds[start]:bounds[text_end]], _shift_facets(facets, byte_offsets[start], byte_offsets[text_end])))
+        start = end
+        while start < total and is_space(start):
+            start += 1
+
+    if posts:
+        last_text, last_facets = posts[-1]
+        posts[-1] = (last_text + suffix, last_facets)
+    else:
+        posts.append((suffix.lstrip(), []))
+    return posts
@@ -0,0 +1,86 @@
+import os
+import json
+import shutil
+import logging
+import tempfile
+import subprocess
+
+# ffmpeg 可执行文件，默认在 PATH 中查找；没有 ffmpeg 时只同步不需要转码的视频
+FFMPEG_PATH = os.environ.get('FFMPEG_PATH', '') or shutil.which('ffmpeg') or ''
+FFPROBE_PATH = os.environ.get('FFPROBE_PATH', '') or shutil.which('ffprobe') or ''
+# 转码后视频最长边的像素上限
+VIDEO_MAX_DIMENSION = int(os.environ.get('VIDEO_MAX_DIMENSION', 1280))
+# 首次转码使用的 x264 质量参数，过大时按时长计算码率重新编码
+VIDEO_CRF = 26
+# 按码率重新编码时给容器和音频预留的比例
+BITRATE_HEADROOM = 0.9
+AUDIO_BITRATE = 96 * 1000
+# 单次转码的超时（秒）
+VIDEO_TRANSCODE_TIMEOUT = int(os.environ.get('VIDEO_TRANSCODE_TIMEOUT', 600))
+
+
+class VideoTranscodeError(Exception):
+    pass
+
+
+def ffmpeg_available():
+    return bool(FFMPEG_PATH)
+
+
+def probe_duration(path):
+    # 用 ffprobe 读取时长（秒），失败时返回None
+    if not FFPROBE_PATH:
+        return None
+    try:
+        output = subprocess.run(
+            [FFPROBE_PATH, '-v', 'error', '-show_entries', 'format=duration', '-of', 'json', path],
+            capture_output=True, timeout=60, check=True).stdout
+        return float(json.loads(output)['format']['duration'])
+    except Exception as e:
+        logging.debug(f"读取视频时长失败: {str(e)}")
+        return None
+
+
+def _encode(source, target, video_args):
+    # 编码为 H.264/AAC 的 MP4：缩放到尺寸上限、宽高取偶数、moov 前置以便边下载边播放
+    scale = (f"scale='min({VIDEO_MAX_DIMENSION},iw)':'min({VIDEO_MAX_DIMENSION},ih)'"
+             f":force_original_aspect_ratio=decrease,scale=trunc(iw/2)*2:trunc(ih/2)*2")
+    command = [FFMPEG_PATH, '-y', '-v', 'error', '-i', source, '-map_metadata', '-1', '-vf', scale,
+               '-c:v', 'libx264', '-preset', 'veryfast', '-pix_fmt', 'yuv420p', *video_args,
+               '-c:a', 'aac', '-b:a', str(AUDIO_BITRATE), '-movflags', '+faststart', target]
+    result = subprocess.run(command, capture_output=True, timeout=VIDEO_TRANSCODE_TIMEOUT)
+    if result.returncode != 0:
+        raise VideoTranscodeError(f"ffmpeg 转码失败: {result.stderr.decode('utf-8', 'replace')[-500:]}")
+
+
+def transcode_video(path, max_bytes):
+    """
+    把视频或GIF动图转码为不超过大小上限的 MP4（H.264/AAC）
+    先按固定质量编码，仍然过大时按时长计算码率重新编码
+    :param path: 源文件路径
+    :param max_bytes: 转码结果的大小上限（字节）
+    :return: 转码结果的临时文件路径，由调用方删除
+    """
+    if not ffmpeg_available():
+        raise VideoTranscodeError("没有找到 ffmpeg，无法转码视频")
+    fd, target = tempfile.mkstemp(suffix='.mp4')
+    os.close(fd)
+    try:
+        _encode(path, target, ['-crf', str(VIDEO_CRF)])
+        size = os.path.getsize(target)
+        if size > max_bytes:
+            duration = probe_duration(path)
+            if not duration:
+                raise VideoTranscodeError(f"转码后的视频仍然过大: {size} 字节")
+            bitrate = int(max_bytes * 8 * BITRATE_HEADROOM / duration) - AUDIO_BITRATE
+            if bitrate <= 0:
+                raise VideoTranscodeError(f"视频过长（{duration:.0f} 秒），无法压缩到 {max_bytes} 字节")
+            logging.debug(f"视频转码后 {size} 字节仍然过大，以 {bitrate} bps 重新编码")
+            _encode(path, target, ['-b:v', str(bitrate), '-maxrate', str(bitrate), '-bufsize', str(bitrate * 2)])
+            size = os.path.getsize(target)
+            if size > max_bytes:
+                raise VideoTranscodeError(f"转码后的视频仍然过大: {size} 字节")
+        return target
+    except Exception:
+        os.remove(target)
+        raise
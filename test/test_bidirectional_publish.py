@@ -0,0 +1,50 @@
+import threading
+from types import SimpleNamespace
+from mastodon_to_bluesky_sync import MastodonToBlueskySyncer
+from bluesky_to_mastodon_sync import BlueskyToMastodonSyncer
+from sync_status_manager import SyncStatusManager
+from sync_cursor_store import SyncCursorStore
+from retry_queue import RetryQueue
+
+
+class FakeClients:
+    def __init__(self):
+        self.me = SimpleNamespace(did='did:plc:test')
+        self.com = SimpleNamespace(atproto=SimpleNamespace(repo=SimpleNamespace(create_record=self.create_record)))
+
+    def create_record(self, data):
+        return SimpleNamespace(cid='cid-m1', uri='at://did:plc:test/app.bsky.feed.post/m1')
+
+    def status_post(self, text, media_ids=None):
+        return {'id': '200'}
+
+
+def test_both_directions_publish_concurrently(tmp_path):
+    ledger = SyncStatusManager(str(tmp_path / 'sync_status.json'), wait_timeout=5)
+    clients = FakeClients()
+    # 两个方向同时预留各自的帖子，然后才继续检查和发布
+    barrier = threading.Barrier(2, timeout=2)
+    reserve = ledger.reserve
+    ledger.reserve = lambda post_id, direction: barrier.wait() is not None and reserve(post_id, direction)
+    options = dict(media_pipeline=object(), media_cache=object(), media_fetcher=object())
+    m2b = MastodonToBlueskySyncer(None, clients, ledger, cursor_store=SyncCursorStore(str(tmp_path / 'm2b.json')),
+                                  retry_queue=RetryQueue(str(tmp_path / 'm2b_retry.json')), batch_writer=object(), **options)
+    b2m = BlueskyToMastodonSyncer(clients, clients, ledger, cursor_store=SyncCursorStore(str(tmp_path / 'b2m.json')),
+                                  retry_queue=RetryQueue(str(tmp_path / 'b2m_retry.json')), **options)
+    toot = SimpleNamespace(id='100', content='<p>toot</p>', media_attachments=[])
+    post_view = SimpleNamespace(cid='cid-b1', uri='at://did:plc:test/app.bsky.feed.post/b1', embed=None)
+    results = {}
+    threads = [threading.Thread(target=lambda: results.update(m2b=m2b.publish_post(toot, [{'text': 'toot'}]))),
+               threading.Thread(target=lambda: results.update(b2m=b2m.publish_post(post_view, 'post', [])))]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(3)
+        assert not any(thread.is_alive() for thread in threads)
+        assert results == {'m2b': True, 'b2m': True}
+        # 各自的镜像帖子已记录，另一方向不会再把它同步回来
+        assert ledger.is_synced('cid-m1', 'bluesky_to_mastodon')
+        assert ledger.is_synced('200', 'mastodon_to_bluesky')
+    finally:
+        ledger.close()
@@ -0,0 +1,37 @@
+import os
+import json
+from html import unescape
+import pytest
+from html_to_text import html_to_text, decode_entities
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks', 'html_corpus')
+SAMPLES = sorted(name[:-len('.html')] for name in os.listdir(CORPUS_DIR) if name.endswith('.html'))
+
+
+@pytest.mark.parametrize('name', SAMPLES)
+def test_corpus_sample_matches_expected_text_and_facets(name):
+    with open(os.path.join(CORPUS_DIR, f'{name}.html'), 'r', encoding='utf-8') as f:
+        content = f.read()
+    with open(os.path.join(CORPUS_DIR, f'{name}.json'), 'r', encoding='utf-8') as f:
+        expected = json.load(f)
+    text, facets = html_to_text(content)
+    assert {'text': text, 'facets': facets} == expected
+    # facet的字节区间必须落在文本内且切在字符边界上
+    data = text.encode('utf-8')
+    for facet in facets:
+        start, end = facet['index']['byteStart'], facet['index']['byteEnd']
+        assert 0 <= start < end <= len(data)
+        data[start:end].decode('utf-8')
+
+
+@pytest.mark.parametrize('text', ['&amp;lt;', '&lt;&amp;&gt;', '&ltx &amp;', '&#x1F600; &amp;amp;', '&quot;&#39;',
+                                  '&&amp;', '&amp', 'x&y', '&#39&amp;', '&copy; &hellip;'])
+def test_decode_entities_matches_html_unescape(text):
+    assert decode_entities(text) == unescape(text)
+
+
+def test_nbsp_becomes_plain_space():
+    # 与旧版一致：&nbsp; 换成普通空格，不是 U+00A0
+    assert decode_entities('a&nbsp;b &amp;nbsp;') == 'a b &nbsp;'
+    assert decode_entities('&nbsp;&copy;') == ' ©'
+    assert html_to_text('<p>fine&nbsp;now</p>')[0] == 'fine now'
@@ -0,0 +1,85 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from jetstream_consumer import JetstreamConsumer, JETSTREAM_COLLECTION
+
+
+class MemoryCursorStore:
+    def __init__(self):
+        self.cursors = {}
+
+    def get(self, key, default=None):
+        return self.cursors.get(key, default)
+
+    def set(self, key, value):
+        self.cursors[key] = value
+
+
+class BlockingSyncer:
+    # 第一条帖子在放行前一直阻塞，记录处理顺序和线程
+    def __init__(self):
+        self.release = threading.Event()
+        self.synced = []
+        self.threads = set()
+
+    def sync_or_defer(self, post, stats):
+        self.release.wait(5)
+        self.threads.add(threading.current_thread().name)
+        self.synced.append(post.post.record.text)
+        stats['synced'] += 1
+
+
+def message(did, rkey, text, time_us):
+    return json.dumps({'did': did, 'time_us': time_us, 'kind': 'commit', 'commit': {
+        'operation': 'create', 'collection': JETSTREAM_COLLECTION, 'rkey': rkey, 'cid': f'cid-{rkey}',
+        'record': {'text': text, 'createdAt': '2024-01-01T00:00:00Z'}}}, separators=(',', ':'))
+
+
+def test_events_are_synced_off_the_receive_thread_in_order():
+    consumer = JetstreamConsumer(MemoryCursorStore(), url='ws://127.0.0.1')
+    executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='sync')
+    syncer = BlockingSyncer()
+    consumer.subscribe('did:plc:a', syncer, executor=executor)
+    try:
+        # 同步阻塞时接收线程仍然可以继续处理后面的消息
+        for index in range(5):
+            assert consumer.handle_message(message('did:plc:a', f'{index}', f'post {index}', 1000 + index))
+        assert consumer.handle_message(message('did:plc:b', 'x', 'other', 2000)) is False
+        assert syncer.synced == []
+        syncer.release.set()
+        deadline = time.monotonic() + 5
+        while len(syncer.synced) < 5 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert syncer.synced == [f'post {index}' for index in range(5)]
+        assert all(name.startswith('sync') for name in syncer.threads)
+    finally:
+        executor.shutdown(wait=True)
+
+
+def test_unsubscribe_waits_for_running_event_and_drops_the_rest():
+    consumer = JetstreamConsumer(MemoryCursorStore(), url='ws://127.0.0.1')
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sync')
+    syncer = BlockingSyncer()
+    consumer.subscribe('did:plc:a', syncer, executor=executor)
+    try:
+        for index in range(3):
+            consumer.handle_message(message('did:plc:a', f'{index}', f'post {index}', 1000 + index))
+        threading.Timer(0.2, syncer.release.set).start()
+        # 尚未开始的事件由下次订阅时的增量轮询补上
+        consumer.unsubscribe('did:plc:a')
+        assert syncer.synced == ['post 0']
+        consumer.handle_message(message('did:plc:a', '3', 'post 3', 1003))
+        assert syncer.synced == ['post 0']
+    finally:
+        executor.shutdown(wait=True)
+
+
+def test_without_executor_events_are_synced_inline():
+    consumer = JetstreamConsumer(MemoryCursorStore(), url='ws://127.0.0.1')
+    syncer = BlockingSyncer()
+    syncer.release.set()
+    consumer.subscribe('did:plc:a', syncer)
+    consumer.handle_message(message('did:plc:a', '1', 'post', 1000))
+    assert syncer.synced == ['post']
+    assert syncer.threads == {threading.current_thread().name}
@@ -0,0 +1,95 @@
+import os
+import sys
+from types import SimpleNamespace
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+from mastodon import Mastodon
+import mastodon_stream
+from mastodon_stream import MastodonStatusStream
+from mastodon_to_bluesky_sync import MastodonToBlueskySyncer
+from sync_status_manager import SyncStatusManager
+from sync_cursor_store import SyncCursorStore
+from retry_queue import RetryQueue
+from fake_mastodon_streaming import FakeMastodonServer, FakeBluesky, wait_until
+
+
+@pytest.fixture
+def stream_setup(tmp_path, monkeypatch):
+    monkeypatch.setattr(mastodon_stream, 'MASTODON_STREAM_RETRY_DELAY', 1)
+    server = FakeMastodonServer()
+    bluesky = FakeBluesky()
+    mastodon = Mastodon(access_token='token', api_base_url=server.url)
+    ledger = SyncStatusManager(str(tmp_path / 'sync_status.json'))
+    cursor_store = SyncCursorStore(str(tmp_path / 'sync_cursor.json'))
+    syncer = MastodonToBlueskySyncer(mastodon, bluesky, ledger, cursor_store=cursor_store, from_mastodon_at='',
+                                     retry_queue=RetryQueue(str(tmp_path / 'retry_queue.json')))
+    stream = MastodonStatusStream(mastodon, syncer, cursor_store)
+    stream.start()
+    assert wait_until(lambda: stream.connected)
+    yield server, bluesky, cursor_store, stream
+    stream.close()
+    ledger.close()
+    server.close()
+
+
+def test_reconnect_fills_gap(stream_setup):
+    server, bluesky, cursor_store, stream = stream_setup
+    live = server.publish('live')
+    assert wait_until(lambda: 'live' in bluesky.created)
+    assert cursor_store.get('mastodon_since_id') == live['id']
+
+    server.drop_streams()
+    assert wait_until(lambda: not stream.connected)
+    missed = [server.publish(f'gap {index}') for index in range(3)]
+    assert wait_until(lambda: all(f'gap {index}' in bluesky.created for index in range(3)))
+    assert wait_until(lambda: cursor_store.get('mastodon_since_id') == missed[-1]['id'])
+    assert server.stream_connections == 2
+
+
+def test_failed_catch_up_keeps_cursor_pinned(stream_setup):
+    server, bluesky, cursor_store, stream = stream_setup
+    before = server.publish('before')
+    assert wait_until(lambda: 'before' in bluesky.created)
+
+    # 断线期间发布的嘟文，重连后的补漏轮询失败
+    server.fail_polls = True
+    server.drop_streams()
+    assert wait_until(lambda: not stream.connected)
+    server.publish('gap')
+    assert wait_until(lambda: stream.connected and stream.retry_at is not None)
+
+    # 推送的新嘟文照常同步，但高水位不越过漏掉的嘟文
+    after = server.publish('after')
+    assert wait_until(lambda: 'after' in bluesky.created)
+    assert 'gap' not in bluesky.created
+    assert cursor_store.get('mastodon_since_id') == before['id']
+
+    # 轮询恢复后补上漏掉的嘟文，高水位推进到最新
+    server.fail_polls = False
+    assert wait_until(lambda: 'gap' in bluesky.created)
+    assert wait_until(lambda: cursor_store.get('mastodon_since_id') == after['id'])
+    # catch_up 在同步器推进高水位之后才清除 retry_at
+    assert wait_until(lambda: stream.retry_at is None)
+
+
+class DeadLetterSyncer:
+    # 本轮获取成功，但有一条嘟文重试次数用尽移入了死信
+    round_complete = True
+
+    def sync(self):
+        return {'fetched': 1, 'synced': 0, 'skipped': 0, 'failed': 1, 'deferred': 0}
+
+    def sync_or_defer(self, status, stats):
+        stats['synced'] += 1
+
+
+def test_dead_lettered_toot_does_not_pin_cursor(tmp_path):
+    cursor_store = SyncCursorStore(str(tmp_path / 'sync_cursor.json'))
+    cursor_store.set('mastodon_since_id', '100')
+    stream = MastodonStatusStream(None, DeadLetterSyncer(), cursor_store)
+    stream.catch_up()
+    assert stream.retry_at is None
+    stream.handle_status(SimpleNamespace(id='101'))
+    assert cursor_store.get('mastodon_since_id') == '101'
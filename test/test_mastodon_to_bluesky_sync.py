@@ -0,0 +1,95 @@
+from types import SimpleNamespace
+import pytest
+from atproto_client.models.blob_ref import BlobRef
+from mastodon_to_bluesky_sync import MastodonToBlueskySyncer
+from sync_status_manager import SyncStatusManager
+from sync_cursor_store import SyncCursorStore
+from retry_queue import RetryQueue
+
+
+class FlakyBluesky:
+    # 第 fail_at 次创建记录时失败一次
+    def __init__(self, fail_at=None):
+        self.me = SimpleNamespace(did='did:plc:test')
+        self.records = []
+        self.fail_at = fail_at
+        self.com = SimpleNamespace(atproto=SimpleNamespace(repo=SimpleNamespace(create_record=self.create_record)))
+
+    def create_record(self, data):
+        if self.fail_at is not None and len(self.records) == self.fail_at:
+            self.fail_at = None
+            raise ConnectionError('创建记录失败')
+        self.records.append(dict(data['record']))
+        number = len(self.records)
+        return SimpleNamespace(cid=f'cid-{number}', uri=f'at://did:plc:test/app.bsky.feed.post/{number}')
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    manager = SyncStatusManager(str(tmp_path / 'sync_status.json'))
+    yield manager
+    manager.close()
+
+
+def make_syncer(tmp_path, ledger, bluesky):
+    return MastodonToBlueskySyncer(None, bluesky, ledger, cursor_store=SyncCursorStore(str(tmp_path / 'sync_cursor.json')),
+                                   retry_queue=RetryQueue(str(tmp_path / 'retry_queue.json')), media_pipeline=object(),
+                                   media_cache=object(), media_fetcher=object(), batch_writer=object())
+
+
+def test_partially_published_thread_resumes_from_first_missing_part(tmp_path, ledger):
+    bluesky = FlakyBluesky(fail_at=1)
+    syncer = make_syncer(tmp_path, ledger, bluesky)
+    post = SimpleNamespace(id='1', content='<p>long</p>', media_attachments=[])
+    parts = lambda: [{'text': f'part {index}'} for index in range(3)]
+
+    with pytest.raises(ConnectionError):
+        syncer.publish_post(post, parts())
+    assert ledger.is_synced('1', 'mastodon_to_bluesky')
+    assert not syncer.is_published('1')
+
+    assert syncer.publish_post(post, parts())
+    assert [record['text'] for record in bluesky.records] == ['part 0', 'part 1', 'part 2']
+    root = {'uri': 'at://did:plc:test/app.bsky.feed.post/1', 'cid': 'cid-1'}
+    assert bluesky.records[1]['reply'] == {'root': root, 'parent': root}
+    assert bluesky.records[2]['reply']['parent'] == {'uri': 'at://did:plc:test/app.bsky.feed.post/2', 'cid': 'cid-2'}
+    assert syncer.is_published('1')
+    assert not syncer.publish_post(post, parts())
+    assert len(bluesky.records) == 3
+
+
+def test_single_post_meta_has_no_parts(tmp_path, ledger):
+    syncer = make_syncer(tmp_path, ledger, FlakyBluesky())
+    post = SimpleNamespace(id='2', content='<p>short</p>', media_attachments=[])
+    assert syncer.publish_post(post, [{'text': 'short'}])
+    [(_, _, meta)] = ledger.get_entries('2', 'mastodon_to_bluesky')
+    assert 'part' not in meta
+    assert syncer.is_published('2')
+
+
+class VideoBluesky(FlakyBluesky):
+    # 记录 upload_blob 收到的请求体类型和内容
+    def __init__(self):
+        super().__init__()
+        self.uploads = []
+        self.com.atproto.repo.upload_blob = self.upload_blob
+
+    def upload_blob(self, data, timeout=None):
+        self.uploads.append((isinstance(data, bytes), data.read()))
+        return SimpleNamespace(blob=BlobRef(mime_type='video/mp4', size=len(self.uploads[-1][1]), ref='bafyvideo'))
+
+
+def test_video_upload_streams_the_file(tmp_path, ledger):
+    path = tmp_path / 'video.mp4'
+    path.write_bytes(b'\x00\x00\x00\x18ftypmp42' + b'\x00' * 4096)
+    fetched = SimpleNamespace(content_hash='hash', path=str(path), size=path.stat().st_size,
+                              head=path.read_bytes()[:64], close=lambda: None)
+    cache = SimpleNamespace(lookup_url=lambda url: None, remember_url=lambda url, content_hash: None,
+                            get_remote=lambda platform, content_hash: None, put_remote=lambda platform, content_hash, ref: None)
+    bluesky = VideoBluesky()
+    syncer = make_syncer(tmp_path, ledger, bluesky)
+    syncer.media_cache = cache
+    syncer.media_fetcher = SimpleNamespace(fetch_to_file=lambda url, max_bytes: fetched)
+    blob = syncer.process_and_upload_video('https://example.com/video.mp4')
+    assert blob.size == fetched.size
+    assert bluesky.uploads == [(False, path.read_bytes())]
@@ -0,0 +1,55 @@
+from types import SimpleNamespace
+from atproto_client import models
+from post_archive import PostArchive, backfill, load_bluesky_item
+from bluesky_to_mastodon_sync import BlueskyToMastodonSyncer
+from sync_status_manager import SyncStatusManager
+from sync_cursor_store import SyncCursorStore
+from retry_queue import RetryQueue
+
+DID = 'did:plc:test'
+
+
+def post_view(rkey, reply=False):
+    record = {'$type': 'app.bsky.feed.post', 'text': f'post {rkey}', 'createdAt': '2024-01-01T00:00:00Z'}
+    if reply:
+        parent = {'uri': f'at://{DID}/app.bsky.feed.post/parent', 'cid': 'bafyparent'}
+        record['reply'] = {'root': parent, 'parent': parent}
+    return models.AppBskyFeedDefs.PostView.model_validate({
+        'uri': f'at://{DID}/app.bsky.feed.post/{rkey}', 'cid': f'bafy{rkey}', 'record': record,
+        'author': {'did': DID, 'handle': 'test.bsky.social'}, 'indexedAt': '2024-01-01T00:00:00Z'})
+
+
+class FakeBluesky:
+    def __init__(self, feed):
+        self.me = SimpleNamespace(did=DID)
+        self.feed = feed
+        self.calls = []
+
+    def get_author_feed(self, **params):
+        self.calls.append(params)
+        return SimpleNamespace(feed=self.feed, cursor=None)
+
+
+def test_backfill_requests_feed_without_replies(tmp_path):
+    bluesky = FakeBluesky([SimpleNamespace(post=post_view('1'), reason=None)])
+    archive = PostArchive(str(tmp_path / 'archive'))
+    try:
+        assert backfill(archive, SimpleNamespace(bluesky=bluesky), 'bluesky') == 1
+    finally:
+        archive.close()
+    assert bluesky.calls[0]['filter'] == 'posts_no_replies'
+
+
+def test_prepare_post_skips_replies(tmp_path):
+    ledger = SyncStatusManager(str(tmp_path / 'sync_status.json'))
+    syncer = BlueskyToMastodonSyncer(None, FakeBluesky([]), ledger, cursor_store=SyncCursorStore(str(tmp_path / 'sync_cursor.json')),
+                                     retry_queue=RetryQueue(str(tmp_path / 'retry_queue.json')), media_pipeline=object(),
+                                     media_cache=object(), media_fetcher=object())
+    syncer.convert_bluesky_to_mastodon = lambda view: (view.record.text, [])
+    try:
+        # 归档中的帖子还原后与作者动态条目结构相同
+        reply = load_bluesky_item(post_view('2', reply=True).model_dump(by_alias=True, mode='json', exclude_none=True))
+        assert syncer.prepare_post(reply) is None
+        assert syncer.prepare_post(SimpleNamespace(post=post_view('3'), reason=None)) == ('post 3', [])
+    finally:
+        ledger.close()
@@ -0,0 +1,64 @@
+import threading
+from types import SimpleNamespace
+import pytest
+from mastodon_to_bluesky_sync import MastodonToBlueskySyncer, mastodon_content_hash
+from post_reconciler import PostReconciler
+from sync_status_manager import SyncStatusManager
+from sync_cursor_store import SyncCursorStore
+from retry_queue import RetryQueue
+
+
+class FakeBluesky:
+    def __init__(self):
+        self.me = SimpleNamespace(did='did:plc:test')
+        self.created = []
+        self.deleted = []
+        self.com = SimpleNamespace(atproto=SimpleNamespace(repo=SimpleNamespace(
+            create_record=self.create_record, delete_record=self.delete_record)))
+
+    def create_record(self, data):
+        self.created.append(data['record'])
+        return SimpleNamespace(cid='cid-new', uri='at://did:plc:test/app.bsky.feed.post/new')
+
+    def delete_record(self, data):
+        self.deleted.append(data['rkey'])
+
+
+def toot(visibility='public', mentions=()):
+    return SimpleNamespace(id='100', content='<p>edited</p>', media_attachments=[], in_reply_to_id=None, reblog=None,
+                           mentions=list(mentions), visibility=visibility)
+
+
+@pytest.fixture
+def setup(tmp_path):
+    ledger = SyncStatusManager(str(tmp_path / 'sync_status.json'), wait_timeout=0.5)
+    bluesky = FakeBluesky()
+    m2b = MastodonToBlueskySyncer(None, bluesky, ledger, cursor_store=SyncCursorStore(str(tmp_path / 'sync_cursor.json')),
+                                  retry_queue=RetryQueue(str(tmp_path / 'retry_queue.json')), media_pipeline=object(),
+                                  media_cache=object(), media_fetcher=object(), batch_writer=object())
+    m2b.convert_mastodon_to_bluesky = lambda status: [{'text': 'edited'}]
+    ledger.mark_as_synced('100', 'cid-old', 'mastodon_to_bluesky',
+                          meta={'origin': 'mastodon', 'hash': 'old', 'uri': 'at://did:plc:test/app.bsky.feed.post/old'})
+    yield ledger, bluesky, PostReconciler(m2b, None, ledger, None)
+    ledger.close()
+
+
+def test_edit_republishes_without_waiting_for_the_other_direction(setup):
+    ledger, bluesky, reconciler = setup
+    # 另一方向的预留由其他线程持有，编辑同步不应等待它
+    holder = threading.Thread(target=lambda: ledger.reserve('cid-x', 'bluesky_to_mastodon'))
+    holder.start()
+    holder.join()
+    status = toot()
+    assert reconciler.apply_mastodon_edit(status)
+    assert bluesky.deleted == ['old'] and bluesky.created == [{'text': 'edited'}]
+    [(_, cid, meta)] = ledger.get_entries('100', 'mastodon_to_bluesky')
+    assert cid == 'cid-new' and meta['hash'] == mastodon_content_hash(status)
+
+
+@pytest.mark.parametrize('status', [toot(visibility='unlisted'), toot(mentions=[SimpleNamespace(acct='someone')])])
+def test_edit_that_is_no_longer_eligible_only_deletes_mirrors(setup, status):
+    ledger, bluesky, reconciler = setup
+    assert reconciler.apply_mastodon_edit(status)
+    assert bluesky.deleted == ['old'] and bluesky.created == []
+    assert not ledger.is_synced('100', 'mastodon_to_bluesky', wait=False)
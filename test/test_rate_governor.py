@@ -0,0 +1,126 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime
+import pytest
+from rate_governor import RateGovernor, RateLimitExceeded, TokenBucket, RATE_LIMIT_BURST, RATE_LIMIT_DEFAULT_BACKOFF
+
+START = 1_700_000_000.0
+
+
+class FakeClock:
+    # 模拟时钟，sleep 只推进时间并记录等待
+    def __init__(self):
+        self.now = START
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def governor(clock):
+    return RateGovernor(clock=clock, sleep=clock.sleep, max_wait=120)
+
+
+def iso(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def test_no_waiting_before_any_rate_limit_headers(governor, clock):
+    for _ in range(RATE_LIMIT_BURST * 4):
+        governor.acquire('Mastodon', 'read')
+    assert clock.sleeps == []
+
+
+def test_bucket_paces_remaining_quota_until_reset(governor, clock):
+    # 剩余50次，保留 100 * 5% = 5 次，100秒内均匀发送 45 次
+    governor.observe('Mastodon', 'read', 200, {'X-RateLimit-Limit': '100', 'X-RateLimit-Remaining': '50',
+                                               'X-RateLimit-Reset': iso(START + 100)})
+    for _ in range(RATE_LIMIT_BURST):
+        governor.acquire('Mastodon', 'read')
+    assert clock.sleeps == []
+    governor.acquire('Mastodon', 'read')
+    assert clock.sleeps == [pytest.approx(1 / 0.45)]
+    # 等待期间补充的令牌刚好够一次请求
+    governor.acquire('Mastodon', 'read')
+    assert clock.sleeps[-1] == pytest.approx(1 / 0.45)
+
+
+def test_tokens_refill_over_time(clock):
+    bucket = TokenBucket()
+    bucket.observe(100, 50, START + 100, START)
+    for _ in range(RATE_LIMIT_BURST):
+        assert bucket.wait_time(clock()) == 0
+        bucket.consume()
+    assert bucket.wait_time(clock()) > 0
+    # 经过足够长的时间后补满，但不超过突发上限
+    clock.now += 60
+    assert bucket.wait_time(clock()) == 0
+    assert bucket.tokens == RATE_LIMIT_BURST
+
+
+def test_waits_until_reset_when_quota_reaches_reserve(governor, clock):
+    governor.observe('Bluesky', 'write', 200, {'ratelimit-limit': '100', 'ratelimit-remaining': '5',
+                                               'ratelimit-reset': str(int(START + 30))})
+    governor.acquire('Bluesky', 'write')
+    assert clock.sleeps == [pytest.approx(30)]
+    # 窗口重置后恢复突发额度
+    clock.sleeps.clear()
+    for _ in range(RATE_LIMIT_BURST):
+        governor.acquire('Bluesky', 'write')
+    assert clock.sleeps == []
+
+
+def test_wait_longer_than_max_raises(governor, clock):
+    governor.observe('Bluesky', 'write', 200, {'RateLimit-Limit': '100', 'RateLimit-Remaining': '1',
+                                               'RateLimit-Reset': str(int(START + 3600))})
+    with pytest.raises(RateLimitExceeded) as error:
+        governor.acquire('Bluesky', 'write')
+    assert error.value.wait == pytest.approx(3600)
+    assert clock.sleeps == []
+
+
+def test_429_respects_retry_after_seconds(governor, clock):
+    governor.observe('Mastodon', 'write', 429, {'Retry-After': '42'})
+    governor.acquire('Mastodon', 'write')
+    assert clock.sleeps == [pytest.approx(42)]
+    # 其他类别的请求不受影响
+    governor.acquire('Mastodon', 'read')
+    assert len(clock.sleeps) == 1
+
+
+def test_503_respects_retry_after_http_date(governor, clock):
+    until = datetime.fromtimestamp(START + 10, timezone.utc)
+    governor.observe('Mastodon', 'media', 503, {'Retry-After': format_datetime(until, usegmt=True)})
+    governor.acquire('Mastodon', 'media')
+    assert clock.sleeps == [pytest.approx(10)]
+
+
+def test_429_without_retry_after_uses_reset_or_default_backoff(governor, clock):
+    governor.observe('Bluesky', 'read', 429, {'RateLimit-Limit': '100', 'RateLimit-Remaining': '0',
+                                              'RateLimit-Reset': str(int(START + 20))})
+    governor.acquire('Bluesky', 'read')
+    assert clock.sleeps == [pytest.approx(20)]
+
+    clock.sleeps.clear()
+    governor.observe('Bluesky', 'write', 429, {})
+    governor.acquire('Bluesky', 'write')
+    assert clock.sleeps == [pytest.approx(RATE_LIMIT_DEFAULT_BACKOFF)]
+
+
+def test_status_reports_blocked_bucket(governor, clock):
+    governor.observe('Mastodon', 'read', 200, {'X-RateLimit-Limit': '300', 'X-RateLimit-Remaining': '200',
+                                               'X-RateLimit-Reset': iso(START + 300)})
+    governor.observe('Mastodon', 'write', 429, {'Retry-After': '30'})
+    status = {item['endpoint']: item for item in governor.status()}
+    assert status['read']['remaining'] == 200 and status['read']['limit'] == 300
+    assert status['read']['reset'] == pytest.approx(START + 300)
+    assert status['write']['remaining'] == 0 and status['write']['reset'] == pytest.approx(START + 30)
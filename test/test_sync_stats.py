@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+import pytest
+from mastodon_to_bluesky_sync import MastodonToBlueskySyncer
+from bluesky_to_mastodon_sync import BlueskyToMastodonSyncer
+from sync_status_manager import SyncStatusManager
+from sync_cursor_store import SyncCursorStore
+from retry_queue import RetryQueue, RETRY_MAX_ATTEMPTS
+
+
+class BrokenClient:
+    # 所有请求都失败
+    def __getattr__(self, name):
+        def request(*args, **kwargs):
+            raise ConnectionError(f'{name} 失败')
+        return request
+
+
+@pytest.fixture
+def stores(tmp_path):
+    ledger = SyncStatusManager(str(tmp_path / 'sync_status.json'))
+    cursor_store = SyncCursorStore(str(tmp_path / 'sync_cursor.json'))
+    retry_queue = RetryQueue(str(tmp_path / 'retry_queue.json'))
+    yield ledger, cursor_store, retry_queue
+    ledger.close()
+
+
+def syncers(stores):
+    ledger, cursor_store, retry_queue = stores
+    common = dict(cursor_store=cursor_store, retry_queue=retry_queue, media_pipeline=object(), media_cache=object(), media_fetcher=object())
+    return (MastodonToBlueskySyncer(BrokenClient(), BrokenClient(), ledger, batch_writer=object(), **common),
+            BlueskyToMastodonSyncer(BrokenClient(), BrokenClient(), ledger, **common))
+
+
+def test_fetch_failure_counts_as_failed_and_keeps_cursor(stores):
+    _, cursor_store, _ = stores
+    cursor_store.set('mastodon_since_id', '100')
+    cursor_store.set('bluesky_indexed_at', '2024-01-01T00:00:00Z')
+    for syncer in syncers(stores):
+        stats = syncer.sync()
+        assert stats['failed'] == 1
+        assert stats['fetched'] == 0
+    assert cursor_store.get('mastodon_since_id') == '100'
+    assert cursor_store.get('bluesky_indexed_at') == '2024-01-01T00:00:00Z'
+
+
+def test_exhausted_retries_count_as_failed(stores):
+    _, _, retry_queue = stores
+    for syncer, direction in zip(syncers(stores), ('mastodon_to_bluesky', 'bluesky_to_mastodon')):
+        for _ in range(RETRY_MAX_ATTEMPTS - 2):
+            retry_queue.add(direction, '1', 'error', ref='at://did:plc:test/app.bsky.feed.post/1')
+        retry_queue.items[retry_queue.key(direction, '1')]['next_retry'] = 0
+        # 倒数第二次失败仍然排队，最后一次失败移入死信
+        assert syncer.retry_failed() == {'fetched': 0, 'synced': 0, 'skipped': 0, 'failed': 0, 'deferred': 1}
+        retry_queue.items[retry_queue.key(direction, '1')]['next_retry'] = 0
+        assert syncer.retry_failed() == {'fetched': 0, 'synced': 0, 'skipped': 0, 'failed': 1, 'deferred': 0}
+        assert not retry_queue.contains(direction, '1')
+
+
+def test_dead_lettered_new_post_counts_as_failed(stores):
+    _, _, retry_queue = stores
+    syncer = syncers(stores)[0]
+    post = SimpleNamespace(id='2')
+    for _ in range(RETRY_MAX_ATTEMPTS - 1):
+        retry_queue.add('mastodon_to_bluesky', '2', 'error')
+    stats = {'synced': 0, 'skipped': 0, 'failed': 0, 'deferred': 0}
+    syncer.publish_or_defer(post, lambda: syncer.prepare_post(post), stats)
+    assert stats == {'synced': 0, 'skipped': 0, 'failed': 1, 'deferred': 0}
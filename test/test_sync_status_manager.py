@@ -0,0 +1,108 @@
+import os
+import threading
+import time
+import pytest
+from sync_status_manager import SyncStatusManager
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    manager = SyncStatusManager(str(tmp_path / 'sync_status.json'))
+    yield manager
+    manager.close()
+
+
+def test_reserve_is_exclusive_across_threads_and_reentrant(ledger):
+    assert ledger.reserve('1', 'mastodon_to_bluesky')
+    assert ledger.reserve('1', 'mastodon_to_bluesky')
+    result = []
+    thread = threading.Thread(target=lambda: result.append(ledger.reserve('1', 'mastodon_to_bluesky')))
+    thread.start()
+    thread.join()
+    assert result == [False]
+    ledger.release('1', 'mastodon_to_bluesky')
+    ledger.release('1', 'mastodon_to_bluesky')
+    with ledger.publishing('1', 'mastodon_to_bluesky') as reserved:
+        assert reserved
+
+
+def test_lock_is_free_while_publishing(ledger):
+    # 发布的网络请求期间其他线程可以读写同步状态
+    with ledger.publishing('1', 'mastodon_to_bluesky'):
+        done = threading.Event()
+
+        def other_direction():
+            ledger.mark_as_synced('cid-x', '99', 'bluesky_to_mastodon')
+            assert ledger.is_synced('99', 'mastodon_to_bluesky')
+            done.set()
+
+        threading.Thread(target=other_direction).start()
+        assert done.wait(2)
+
+
+def test_is_synced_waits_for_the_other_direction(ledger):
+    # 嘟文同步到Bluesky后、标记之前，Bluesky方向看到新帖子时要等标记完成，不能把它同步回来
+    assert ledger.reserve('1', 'mastodon_to_bluesky')
+    answer = []
+    checker = threading.Thread(target=lambda: answer.append(ledger.is_synced('cid-1', 'bluesky_to_mastodon')))
+    checker.start()
+    time.sleep(0.1)
+    assert answer == []
+    ledger.mark_as_synced('1', 'cid-1', 'mastodon_to_bluesky')
+    ledger.release('1', 'mastodon_to_bluesky')
+    checker.join(2)
+    assert answer == [True]
+
+
+def test_is_synced_does_not_wait_for_own_reservation(ledger):
+    # 持有预留的线程（例如编辑时删除后重新发布）检查时不会等待自己
+    with ledger.publishing('1', 'bluesky_to_mastodon'):
+        assert not ledger.is_synced('2', 'mastodon_to_bluesky')
+        assert not ledger.is_synced('1', 'bluesky_to_mastodon')
+
+
+def test_holder_of_a_reservation_does_not_wait_for_the_other_direction(ledger):
+    # 两个方向各自持有预留时互相等待会死锁
+    assert ledger.reserve('1', 'mastodon_to_bluesky')
+    with ledger.publishing('cid-2', 'bluesky_to_mastodon'):
+        assert not ledger.is_synced('cid-3', 'bluesky_to_mastodon')
+    ledger.release('1', 'mastodon_to_bluesky')
+
+
+def test_is_synced_wait_is_bounded(tmp_path):
+    manager = SyncStatusManager(str(tmp_path / 'sync_status.json'), wait_timeout=0.1)
+    try:
+        assert manager.reserve('1', 'mastodon_to_bluesky')
+        result = []
+
+        def check():
+            try:
+                manager.is_synced('cid-1', 'bluesky_to_mastodon')
+            except TimeoutError as e:
+                result.append(e)
+
+        checker = threading.Thread(target=check)
+        checker.start()
+        checker.join(2)
+        assert len(result) == 1
+        assert not manager.is_synced('cid-1', 'bluesky_to_mastodon', wait=False)
+    finally:
+        manager.close()
+
+
+def test_save_sync_status_flushes_journal_without_compacting(tmp_path):
+    filename = str(tmp_path / 'sync_status.json')
+    manager = SyncStatusManager(filename, compact_threshold=3)
+    manager.mark_as_synced('1', 'cid-1', 'mastodon_to_bluesky')
+    manager.save_sync_status()
+    # 未达到阈值时只有追加日志，快照不重写
+    assert not os.path.exists(filename)
+    reloaded = SyncStatusManager(filename)
+    assert reloaded.is_synced('1', 'mastodon_to_bluesky', wait=False)
+    reloaded.close()
+
+    manager.mark_as_synced('2', 'cid-2', 'mastodon_to_bluesky')
+    manager.mark_as_synced('3', 'cid-3', 'mastodon_to_bluesky')
+    manager.save_sync_status()
+    assert os.path.exists(filename) and not os.path.exists(f'{filename}.journal')
+    manager.close()
@@ -0,0 +1,28 @@
+from text_layout import split_thread, truncate, fits, measure
+
+
+def test_split_thread_respects_limits_and_keeps_text():
+    text = '第一句话。' * 40 + ' '.join(['word'] * 80)
+    posts = split_thread(text, max_graphemes=50, max_bytes=200)
+    assert len(posts) > 1
+    assert all(fits(part, 50, 200) for part, _ in posts)
+    assert ''.join(part.replace(' ', '') for part, _ in posts) == text.replace(' ', '')
+
+
+def test_split_thread_terminates_on_grapheme_larger_than_limit():
+    # 一个带大量组合符号的字素超过了字节上限，单独成为一条而不是死循环
+    huge = 'e' + '́' * 40
+    assert measure(huge) == (1, 81)
+    posts = split_thread('ab ' + huge + ' cd', max_graphemes=300, max_bytes=20)
+    assert [part for part, _ in posts] == ['ab', huge, 'cd']
+
+
+def test_split_thread_with_suffix_as_long_as_limit():
+    posts = split_thread('abcdefghij', suffix='0123', max_graphemes=4, max_bytes=100)
+    assert posts[-1][0].endswith('0123')
+    assert ''.join(part for part, _ in posts).startswith('abcdefghij')
+
+
+def test_truncate_adds_ellipsis():
+    text, _ = truncate('x' * 20, max_graphemes=10, max_bytes=100)
+    assert text == 'x' * 7 + '...'